@@ -1,5 +1,12 @@
 """
 Anomaly Detection - Conditional VAE for KMR anomaly scoring
+
+Each point is scored by the reconstruction error of the window ending at it
+(left-padded with the mean of the available values for the first points).
+Windows of a whole cohort are built as one strided array and run through the
+autoencoder in a single batched call. update() scores a single newly arrived
+value in O(window) from per-patient running statistics (see its docstring
+for how that differs from batch scoring).
 """
 import numpy as np
 import pandas as pd
@@ -7,15 +14,22 @@ from typing import Dict, List, Optional
 import warnings
 warnings.filterwarnings('ignore')
 
-try:
-    import tensorflow as tf
-    from tensorflow import keras
-    from tensorflow.keras import layers, Model
-    HAS_TF = True
-except ImportError:
-    HAS_TF = False
+from .tf_backend import HAS_TF, tf, keras, layers, Model
 
 from .config import ANOMALY_CONFIG
+from .feature_kernel import stack_frames
+from .patient_panel import PatientPanel
+from .time_mapping import get_kmr_time_info
+from .windowing import RunningSeries, point_windows, trailing_windows, training_windows, zscore
+
+
+def reconstruction_errors(model, windows: np.ndarray) -> np.ndarray:
+    """Mean squared reconstruction error per window from one batched call (0 if the model fails)"""
+    try:
+        reconstructed = model.predict_on_batch(windows.astype(np.float32))
+        return np.mean((windows - np.asarray(reconstructed, dtype=np.float64)) ** 2, axis=1)
+    except Exception:
+        return np.zeros(len(windows))
 
 
 class KMRAnomalyDetector:
@@ -26,6 +40,7 @@ class KMRAnomalyDetector:
         self.reconstruction_errors: Dict[str, List[float]] = {}
         self.thresholds: Dict[str, float] = {}
         self.global_threshold: float = 0.0
+        self._streams: Dict[str, RunningSeries] = {}
     
     def _build_vae(self, input_dim: int, latent_dim: int = 4) -> tuple:
         """Build simple VAE encoder/decoder using Keras 3 compatible approach"""
@@ -51,21 +66,7 @@ class KMRAnomalyDetector:
         
         return autoencoder, encoder, None
     
-    def _prepare_windows(self, kmr_series: np.ndarray, window_size: int = 5) -> np.ndarray:
-        """Prepare sliding windows from series"""
-        if len(kmr_series) < window_size:
-            # Pad with mean if too short
-            pad_size = window_size - len(kmr_series)
-            padding = np.full(pad_size, kmr_series.mean())
-            kmr_series = np.concatenate([padding, kmr_series])
-        
-        windows = []
-        for i in range(len(kmr_series) - window_size + 1):
-            windows.append(kmr_series[i:i+window_size])
-        
-        return np.array(windows)
-    
-    def fit_global(self, kmr_long: pd.DataFrame) -> None:
+    def fit_global(self, kmr_long: pd.DataFrame, panel: PatientPanel = None) -> None:
         """Fit global VAE on all patient data to establish baseline"""
         if not HAS_TF:
             self._fit_simple_threshold(kmr_long)
@@ -73,44 +74,33 @@ class KMRAnomalyDetector:
         
         print("🔍 Training global anomaly detector...")
         
-        # Collect all windows
-        all_windows = []
         window_size = 5
         
-        for patient in kmr_long["patient_code"].unique():
-            patient_df = kmr_long[kmr_long["patient_code"] == patient].sort_values("time_order")
-            kmr_values = patient_df["kmr"].dropna().values
-            
-            # Filter out None/NaN values
-            kmr_values = np.array([v for v in kmr_values if v is not None and not np.isnan(v)])
-            
-            if len(kmr_values) >= 3:
-                # Normalize per patient
-                mean_val = float(np.nanmean(kmr_values))
-                std_val = float(np.nanstd(kmr_values)) + 1e-6
-                normalized = (kmr_values - mean_val) / std_val
-                
-                # Ensure no NaN in normalized
-                normalized = np.nan_to_num(normalized, nan=0.0)
-                
-                windows = self._prepare_windows(normalized, window_size)
-                # Filter out any windows with NaN
-                for w in windows:
-                    if not np.any(np.isnan(w)) and not np.any(w is None):
-                        all_windows.append(w.astype(np.float32))
+        # Measured values of every patient with >= 3 of them, in time order
+        if panel is None:
+            panel = PatientPanel(kmr_long=kmr_long)
+        long_df, lengths = stack_frames([panel.kmr(patient) for patient in panel.kmr_patients])
+        values = long_df["kmr"].to_numpy(dtype=np.float64)
+        measured = ~np.isnan(values)
+        counts = np.bincount(np.repeat(np.arange(len(lengths)), lengths)[measured], minlength=len(lengths))
+        keep = np.repeat(counts >= 3, counts)
+        values, counts = values[measured][keep], counts[counts >= 3]
+        
+        # Per-patient normalization, then all windows in one strided gather (float32)
+        all_windows = training_windows(zscore(values, counts), counts, window_size)
         
         if len(all_windows) < 10:
             self._fit_simple_threshold(kmr_long)
             return
         
-        all_windows = np.array(all_windows, dtype=np.float32)
         all_windows = np.nan_to_num(all_windows, nan=0.0, posinf=0.0, neginf=0.0)
         
         # Train VAE
         vae, encoder, decoder = self._build_vae(window_size)
         
         try:
-            vae.fit(all_windows, epochs=30, batch_size=min(32, len(all_windows)), verbose=0)
+            # Autoencoder: the windows are their own targets
+            vae.fit(all_windows, all_windows, epochs=30, batch_size=min(32, len(all_windows)), verbose=0)
         except Exception as e:
             print(f"⚠️ VAE training failed: {e}")
             self._fit_simple_threshold(kmr_long)
@@ -142,7 +132,29 @@ class KMRAnomalyDetector:
         self.global_threshold = q3 + k * iqr
         self.use_simple = True
         print(f"✅ Simple threshold set: {self.global_threshold:.4f}")
-    
+
+    def export_state(self) -> dict:
+        """Fitted state for the detector store (autoencoder weights as arrays)"""
+        vae = getattr(self, "vae", None)
+        return {
+            "window_size": getattr(self, "window_size", 5),
+            "global_threshold": self.global_threshold,
+            "use_simple": getattr(self, "use_simple", False),
+            "weights": [np.asarray(w) for w in vae.get_weights()] if vae is not None else None,
+        }
+
+    def load_state(self, state: dict) -> bool:
+        """Restore an exported state; False if it holds autoencoder weights and TensorFlow is missing"""
+        if state["weights"] is not None:
+            if not HAS_TF:
+                return False
+            self.vae, self.encoder, _ = self._build_vae(state["window_size"])
+            self.vae.set_weights(state["weights"])
+        self.window_size = state["window_size"]
+        self.global_threshold = state["global_threshold"]
+        self.use_simple = state["use_simple"]
+        return True
+
     def score_patient(self, kmr_df: pd.DataFrame) -> List[dict]:
         """Calculate anomaly scores for a patient's KMR series"""
         df = kmr_df.sort_values("time_order").copy()
@@ -158,38 +170,20 @@ class KMRAnomalyDetector:
         std_val = kmr_values.std() + 1e-6
         normalized = (kmr_values - mean_val) / std_val
         
-        # Prepare windows
-        window_size = getattr(self, "window_size", 5)
-        
-        scores = []
-        for i in range(n_points):
-            # Get window ending at this point
-            start_idx = max(0, i - window_size + 1)
-            window = normalized[start_idx:i+1]
-            
-            if len(window) < window_size:
-                # Pad
-                pad = np.full(window_size - len(window), window.mean())
-                window = np.concatenate([pad, window])
-            
-            window = window.reshape(1, -1)
-            
-            try:
-                reconstructed = self.vae.predict(window, verbose=0)
-                error = float(np.mean((window - reconstructed) ** 2))
-            except:
-                error = 0.0
-            
-            # Normalize score to 0-100
-            score = min(100, (error / (self.global_threshold + 1e-6)) * 50)
-            flag = error > self.global_threshold
-            
-            scores.append({
-                "kmr_anomaly_score": round(score, 2),
-                "kmr_anomaly_flag": flag
-            })
+        windows = trailing_windows(normalized.reshape(1, -1), getattr(self, "window_size", 5))[0]
+        return self._score_windows(windows)
+    
+    def _score_windows(self, windows: np.ndarray) -> List[dict]:
+        """Scores/flags of (n, window_size) windows (one per point) from one batched autoencoder call"""
+        errors = reconstruction_errors(self.vae, windows)
         
-        return scores
+        # Normalize score to 0-100
+        scores = (errors / (self.global_threshold + 1e-6)) * 50
+        flags = errors > self.global_threshold
+        return [
+            {"kmr_anomaly_score": round(min(100, score), 2), "kmr_anomaly_flag": flag}
+            for score, flag in zip(scores, flags.tolist())
+        ]
     
     def _simple_scoring(self, kmr_values: np.ndarray) -> List[dict]:
         """Simple z-score based anomaly scoring"""
@@ -209,29 +203,86 @@ class KMRAnomalyDetector:
         
         return scores
     
-    def bulk_score(self, kmr_long: pd.DataFrame) -> Dict[str, List[dict]]:
-        """Score all patients"""
+    def bulk_score(self, kmr_long: pd.DataFrame, panel: PatientPanel = None,
+                   patients: List[str] = None) -> Dict[str, List[dict]]:
+        """
+        Score all patients (or only `patients`)
+
+        Windows of every patient scored by the autoencoder are stacked and
+        reconstructed in one batched call; short series (and the simple
+        threshold mode) keep the per-patient z-score rule.
+        """
         results = {}
-        patients = kmr_long["patient_code"].unique()
+        if panel is None:
+            panel = PatientPanel(kmr_long=kmr_long)
+        patients = panel.kmr_patients if patients is None else list(patients)
         
         print(f"🔍 Scoring anomalies for {len(patients)} patients...")
         
+        use_vae = HAS_TF and not getattr(self, "use_simple", False)
+        vae_patients = [p for p in patients if use_vae and panel.n_kmr(p) >= 3]
+        batched = set(vae_patients)
         for patient in patients:
-            patient_df = kmr_long[kmr_long["patient_code"] == patient]
-            results[patient] = self.score_patient(patient_df)
+            if patient not in batched:
+                results[patient] = self.score_patient(panel.kmr(patient))
+        
+        if vae_patients:
+            long_df, lengths = stack_frames([panel.kmr(p) for p in vae_patients])
+            normalized = zscore(long_df["kmr"].to_numpy(dtype=np.float64), lengths)
+            scored = self._score_windows(point_windows(normalized, lengths, getattr(self, "window_size", 5)))
+            bounds = np.concatenate([[0], np.cumsum(lengths)])
+            for i, patient in enumerate(vae_patients):
+                results[patient] = scored[bounds[i]:bounds[i + 1]]
         
         print("✅ Anomaly scoring complete")
-        return results
+        return {p: results[p] for p in patients}
+    
+    def start_stream(self, kmr_long: pd.DataFrame, panel: PatientPanel = None) -> None:
+        """Seed the running per-patient state of update() from the measurements so far"""
+        if panel is None:
+            panel = PatientPanel(kmr_long=kmr_long)
+        window_size = getattr(self, "window_size", 5)
+        self._streams = {}
+        for patient in panel.kmr_patients:
+            df = panel.kmr(patient).sort_values("time_order")
+            self._streams[str(patient)] = RunningSeries.from_history(
+                df["kmr"].to_numpy(dtype=np.float64), int(df["time_order"].iloc[-1]), window_size)
+    
+    def update(self, patient: str, time_key: str, value: float) -> dict:
+        """
+        Score one newly arrived KMR value in O(window_size)
+        
+        The patient's running mean/std and last window_size values are
+        updated and only the window ending at the new point is scored, with
+        the same rules as bulk_score. The score equals the batch score of the
+        new point over the series so far (up to float rounding of the running
+        stats); it is causal, so it differs from a later bulk_score, which
+        re-normalizes every window with the mean/std of the whole series
+        (`python3 backend/benchmarks.py anomaly-streaming` measures both).
+        Values must arrive in time order; a correction needs bulk_score.
+        """
+        order = get_kmr_time_info(time_key)["order"]
+        if not order:
+            raise ValueError(f"Unknown KMR time key {time_key!r}")
+        stream = self._streams.setdefault(str(patient), RunningSeries(getattr(self, "window_size", 5)))
+        stream.push(float(value), order)
+        
+        if HAS_TF and not getattr(self, "use_simple", False) and stream.count >= 3:
+            return self._score_windows(stream.window().reshape(1, -1))[0]
+        
+        # Short series / simple threshold mode: z-score against the running stats
+        z = abs(float(value) - stream.mean) / (stream.std + 1e-6)
+        return {"kmr_anomaly_score": round(float(min(100, z * 20)), 2), "kmr_anomaly_flag": bool(z > 2.5)}
 
 
 if __name__ == "__main__":
     from io_excel import load_all_data
     
-    meta, kmr_long, lab_long, improved, raw = load_all_data()
+    meta, kmr_long, lab_long, improved, raw, panel = load_all_data()
     
     detector = KMRAnomalyDetector()
-    detector.fit_global(kmr_long)
-    scores = detector.bulk_score(kmr_long)
+    detector.fit_global(kmr_long, panel)
+    scores = detector.bulk_score(kmr_long, panel)
     
     print("\nSample scores:")
     sample = list(scores.keys())[0]
@@ -7,11 +7,9 @@ import pandas as pd
 from typing import Dict, List, Tuple, Optional, Any
 from datetime import datetime
 
-import tensorflow as tf
-from tensorflow import keras
-from keras import layers, Model
-
 from .time_mapping import KMR_TIME_MAP, get_kmr_time_info
+from .patient_panel import PatientPanel, PatientTensor
+from .tf_backend import tf, keras, layers, Model
 
 
 class CohortTrajectoryAnalyzer:
@@ -20,11 +18,25 @@ class CohortTrajectoryAnalyzer:
     Uses LSTM for sequence modeling and autoencoder for confidence bounds.
     """
     
-    def __init__(self):
+    def __init__(self, panel: Optional[PatientPanel] = None):
         self.lstm_model = None
         self.autoencoder = None
         self.scaler_mean = 0
         self.scaler_std = 1
+        self.panel = panel
+    
+    def _patient_kmr(self, kmr_long: pd.DataFrame, patient: str) -> pd.DataFrame:
+        """Per-patient KMR rows via the panel (rebuilt if a different frame is passed)"""
+        if self.panel is None or self.panel.kmr_long is not kmr_long:
+            self.panel = PatientPanel(kmr_long=kmr_long)
+        return self.panel.kmr(patient)
+    
+    def _kmr_tensor(self, kmr_long: pd.DataFrame, patients: List[str]) -> PatientTensor:
+        """
+        Dense float64 KMR tensor of `patients`: the exported trajectory must not
+        pass through the panel tensor's float32 storage
+        """
+        return PatientTensor.from_long(kmr_long, None, list(dict.fromkeys(map(str, patients))), dtype=np.float64)
         
     def prepare_cohort_sequences(self, kmr_long: pd.DataFrame, 
                                   improved_patients: List[str]) -> Tuple[np.ndarray, List[str]]:
@@ -32,31 +44,20 @@ class CohortTrajectoryAnalyzer:
         Prepare cohort data as sequences for LSTM training.
         Each patient becomes one sequence.
         """
-        cohort_df = kmr_long[kmr_long["patient_code"].isin(improved_patients)].copy()
-        
         # Get all time points in order
         time_keys = sorted(KMR_TIME_MAP.keys(), key=lambda x: KMR_TIME_MAP[x]["order"])
-        n_time_points = len(time_keys)
         
-        sequences = []
-        patient_ids = []
+        # Dense KMR channel of the patient tensor: (patients, time) slice, no per-row loop
+        tensor = self._kmr_tensor(kmr_long, improved_patients)
+        rows = [tensor.patient_index[p] for p in map(str, improved_patients)]
+        sequences = tensor.metric("kmr")[np.ix_(rows, tensor.time_slice(time_keys))]
         
-        for patient in improved_patients:
-            patient_data = cohort_df[cohort_df["patient_code"] == patient]
-            
-            # Create sequence with NaN for missing points
-            seq = np.full(n_time_points, np.nan)
-            for _, row in patient_data.iterrows():
-                if row["time_key"] in time_keys:
-                    idx = time_keys.index(row["time_key"])
-                    seq[idx] = row["kmr"]
-            
-            # Only include if patient has at least 5 measurements
-            if np.sum(~np.isnan(seq)) >= 5:
-                sequences.append(seq)
-                patient_ids.append(patient)
+        # Only include if patient has at least 5 measurements
+        sequences = sequences[np.sum(~np.isnan(sequences), axis=1) >= 5]
+        if len(sequences) == 0:
+            return np.array([]), time_keys
         
-        return np.array(sequences), time_keys
+        return sequences, time_keys
     
     def interpolate_sequences(self, sequences: np.ndarray) -> np.ndarray:
         """Interpolate missing values in sequences using linear interpolation"""
@@ -277,11 +278,12 @@ class CohortTrajectoryAnalyzer:
 
 
 def analyze_improved_cohort(kmr_long: pd.DataFrame, 
-                            improved_patients: List[str]) -> dict:
+                            improved_patients: List[str],
+                            panel: Optional[PatientPanel] = None) -> dict:
     """
     Main function to analyze improved cohort and generate trajectory.
     """
-    analyzer = CohortTrajectoryAnalyzer()
+    analyzer = CohortTrajectoryAnalyzer(panel=panel)
     
     # Fit models
     fit_result = analyzer.fit(kmr_long, improved_patients, epochs=50)
@@ -303,10 +305,10 @@ def analyze_improved_cohort(kmr_long: pd.DataFrame,
 if __name__ == "__main__":
     from io_excel import load_all_data
     
-    meta, kmr_long, lab_long, improved, raw = load_all_data()
+    meta, kmr_long, lab_long, improved, raw, panel = load_all_data()
     improved_patients = [p for p, v in improved.items() if v]
     
-    result = analyze_improved_cohort(kmr_long, improved_patients)
+    result = analyze_improved_cohort(kmr_long, improved_patients, panel)
     
     print("\nTrajectory sample:")
     for t in result["trajectory"][:5]:
@@ -6,11 +6,9 @@ import pandas as pd
 from typing import Dict, List, Tuple, Optional, Any
 from datetime import datetime
 
-import tensorflow as tf
-from tensorflow import keras
-from keras import layers, Model
-
-from .time_mapping import LAB_TIME_MAP, UNIFIED_TIME_MAP, get_lab_time_info, get_unified_time_info
+from .time_mapping import LAB_TIME_MAP, UNIFIED_LAB_KEYS, get_lab_time_info, get_unified_time_info
+from .patient_panel import PatientPanel
+from .tf_backend import tf, keras, layers, Model
 
 
 class LABCohortTrajectoryAnalyzer:
@@ -19,7 +17,8 @@ class LABCohortTrajectoryAnalyzer:
     Uses LSTM for sequence modeling and autoencoder for confidence bounds.
     """
     
-    def __init__(self):
+    def __init__(self, panel: Optional[PatientPanel] = None):
+        self.panel = panel
         self.lstm_model_kre = None
         self.lstm_model_gfr = None
         self.lstm_model_multi = None
@@ -30,6 +29,16 @@ class LABCohortTrajectoryAnalyzer:
         self.scaler_kre_std = 1
         self.scaler_gfr_mean = 0
         self.scaler_gfr_std = 1
+    
+    def _patient_lab(self, lab_long: pd.DataFrame, patient: str) -> pd.DataFrame:
+        """Per-patient LAB rows via the panel (rebuilt if a different frame is passed)"""
+        return self._lab_panel(lab_long).lab(patient)
+    
+    def _lab_panel(self, lab_long: pd.DataFrame) -> PatientPanel:
+        """Patient panel over lab_long (rebuilt if a different frame is passed)"""
+        if self.panel is None or self.panel.lab_long is not lab_long:
+            self.panel = PatientPanel(lab_long=lab_long)
+        return self.panel
         
     def _get_improved_lab_patients(self, lab_long: pd.DataFrame, improved_patients: List[str]) -> List[str]:
         """
@@ -44,7 +53,7 @@ class LABCohortTrajectoryAnalyzer:
         late_time_keys = ["Month_6", "Month_9", "Month_10", "Month_11", "Month_12"]
         
         for patient in improved_patients:
-            patient_data = lab_long[lab_long["patient_code"] == patient]
+            patient_data = self._patient_lab(lab_long, patient)
             
             if len(patient_data) == 0:
                 continue
@@ -79,54 +88,19 @@ class LABCohortTrajectoryAnalyzer:
         Prepare cohort data as sequences for LSTM training.
         Uses unified time grid (UNIFIED_TIME_MAP order 1-22).
         """
-        # Filter to improved patients
-        cohort_df = lab_long[lab_long["patient_code"].isin(improved_patients)].copy()
-        
         # Get unified time keys that have lab data
-        unified_time_keys = [tk for tk, info in sorted(UNIFIED_TIME_MAP.items(), key=lambda x: x[1]["order"]) 
-                            if info["has_lab"]]
-        n_time_points = len(unified_time_keys)
+        unified_time_keys = list(UNIFIED_LAB_KEYS)
         
-        kre_sequences = []
-        gfr_sequences = []
-        patient_ids = []
+        # KRE/GFR of all improved patients aligned on the LAB slots in one pass
+        kre_sequences, gfr_sequences = self._lab_panel(lab_long).lab_grid(list(map(str, improved_patients)))
         
-        for patient in improved_patients:
-            patient_data = cohort_df[cohort_df["patient_code"] == patient]
-            
-            # Create sequences with NaN for missing points
-            kre_seq = np.full(n_time_points, np.nan)
-            gfr_seq = np.full(n_time_points, np.nan)
-            
-            for _, row in patient_data.iterrows():
-                time_key = row["time_key"]
-                # LAB data from io_excel.py uses base time_key (e.g., "Day_7")
-                # without _KRE/_GFR suffix. Each row has both kre and gfr columns.
-                base_key = time_key.replace("_KRE", "").replace("_GFR", "")
-                
-                if base_key in unified_time_keys:
-                    idx = unified_time_keys.index(base_key)
-                    
-                    # Both kre and gfr are in the same row
-                    kre_val = row.get("kre")
-                    gfr_val = row.get("gfr")
-                    
-                    if pd.notna(kre_val):
-                        kre_seq[idx] = float(kre_val)
-                    if pd.notna(gfr_val):
-                        gfr_seq[idx] = float(gfr_val)
-            
-            # Only include if patient has at least 3 measurements for either metric
-            # Lowered threshold per user requirement (min_sequences=3)
-            kre_valid = np.sum(~np.isnan(kre_seq))
-            gfr_valid = np.sum(~np.isnan(gfr_seq))
-            
-            if kre_valid >= 3 or gfr_valid >= 3:
-                kre_sequences.append(kre_seq)
-                gfr_sequences.append(gfr_seq)
-                patient_ids.append(patient)
+        # Only include if patient has at least 3 measurements for either metric
+        # Lowered threshold per user requirement (min_sequences=3)
+        keep = (np.sum(~np.isnan(kre_sequences), axis=1) >= 3) | (np.sum(~np.isnan(gfr_sequences), axis=1) >= 3)
+        if not keep.any():
+            return np.array([]), np.array([]), unified_time_keys
         
-        return np.array(kre_sequences), np.array(gfr_sequences), unified_time_keys
+        return kre_sequences[keep], gfr_sequences[keep], unified_time_keys
     
     def interpolate_sequences(self, sequences: np.ndarray) -> np.ndarray:
         """Interpolate missing values in sequences using linear interpolation"""
@@ -217,7 +191,7 @@ class LABCohortTrajectoryAnalyzer:
             # Fallback: use all improved patients with ≥3 LAB measurements
             fallback_lab = []
             for patient in improved_patients:
-                patient_data = lab_long[lab_long["patient_code"] == patient]
+                patient_data = self._patient_lab(lab_long, patient)
                 kre_count = patient_data["kre"].notna().sum()
                 gfr_count = patient_data["gfr"].notna().sum()
                 if kre_count >= 3 or gfr_count >= 3:
@@ -498,11 +472,12 @@ class LABCohortTrajectoryAnalyzer:
 
 
 def analyze_improved_lab_cohort(lab_long: pd.DataFrame, 
-                                improved_patients: List[str]) -> dict:
+                                improved_patients: List[str],
+                                panel: Optional[PatientPanel] = None) -> dict:
     """
     Main function to analyze improved LAB cohort and generate trajectory.
     """
-    analyzer = LABCohortTrajectoryAnalyzer()
+    analyzer = LABCohortTrajectoryAnalyzer(panel=panel)
     
     # Fit models
     fit_result = analyzer.fit(lab_long, improved_patients, epochs=50)
@@ -528,10 +503,10 @@ def analyze_improved_lab_cohort(lab_long: pd.DataFrame,
 if __name__ == "__main__":
     from io_excel import load_all_data
     
-    meta, kmr_long, lab_long, improved, raw = load_all_data()
+    meta, kmr_long, lab_long, improved, raw, panel = load_all_data()
     improved_patients = [p for p, v in improved.items() if v]
     
-    result = analyze_improved_lab_cohort(lab_long, improved_patients)
+    result = analyze_improved_lab_cohort(lab_long, improved_patients, panel)
     
     print("\nTrajectory sample:")
     for t in result["trajectory"][:5]:
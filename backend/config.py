@@ -12,6 +12,13 @@ PATIENTS_DIR = FRONTEND_PUBLIC / "patients"
 # Excel file
 EXCEL_FILE = DATA_DIR / "data.xlsx"
 
+# Local cache (parsed input, derived artifacts) - safe to delete at any time
+CACHE_DIR = PROJECT_ROOT / ".cache"
+INPUT_CACHE_DIR = CACHE_DIR / "input"
+PIPELINE_STATE_DIR = CACHE_DIR / "pipeline"
+MODEL_STORE_DIR = CACHE_DIR / "models"
+DETECTOR_STORE_DIR = CACHE_DIR / "detectors"
+
 # Time mapping configuration
 TIME_CONFIG = {
     # KMR time points
@@ -28,18 +35,96 @@ TIME_CONFIG = {
     ]
 }
 
+# Dense patient tensor (patients x unified time x KMR/KRE/GFR)
+TENSOR_CONFIG = {
+    "dtype": "float32",
+    # Cached tensors are memory-mapped from disk instead of read for cohorts this large
+    "mmap_min_patients": 2000
+}
+
 # Model configuration
 MODEL_CONFIG = {
     "seq_len_min": 5,
     "seq_len_max": 12,
     "physics_lambda": 0.03,
     "random_seed": 42,
+    # Per-patient KMR/LAB forecaster (run_all --engine):
+    # "keras": GRU/LSTM per patient (runs "numpy" when TensorFlow is not installed)
+    # "numpy": Kalman local-level model fitted for all patients in one vectorized pass
+    # "joint": one masked KMR+KRE+GFR LSTM over the unified grid, trained once on the
+    #          whole cohort (runs "numpy" when TensorFlow is not installed)
+    "forecast_engine": "keras",
+    "numpy_engine": {
+        # level noise / measurement noise variance ratio (higher follows jumps faster)
+        "level_noise_ratio": 0.5,
+        # prediction interval half-width in innovation standard deviations (~90%)
+        "interval_z": 1.645
+    },
+    "joint_engine": {
+        "units": 32,
+        "dropout": 0.1,
+        "learning_rate": 0.005,
+        "epochs": 300,
+        "batch_size": 8,
+        # early stopping on the training loss (the cohort is too small to hold out patients)
+        "patience": 15,
+        # interval half-width = this quantile of |normalized one-step residual| x patient std
+        "interval_quantile": 0.9,
+        # forecasts (unmeasured slots) widen the half-width by this factor
+        "forecast_widen": 1.5
+    },
+    # "per_patient": one GRU/LSTM per patient (adaptive seq_len/complexity)
+    # "global": one LSTM trained on windows pooled from every patient (per-patient
+    #           normalization, fixed global_seq_len), batched inference per patient
+    "kmr_model_mode": "per_patient",
+    "global_seq_len": 5,
+    "global_batch_size": 32,
+    # Reuse one compiled Keras model per (architecture, seq_len, n_features) across
+    # patients, re-initializing its weights instead of rebuilding the graph
+    "model_templates": {
+        "enabled": True,
+        "max_templates": 16
+    },
+    # Prediction intervals of the per-patient Keras models:
+    # "band": fixed relative bands (±15% in-sample, ±25% forecast for KMR/KRE)
+    # "mc_dropout": quantiles of mc_samples dropout-active passes, batched in one call
+    "uncertainty": {
+        "mode": "band",
+        "mc_samples": 30,
+        "quantiles": (0.05, 0.95)
+    },
+    # Wall-clock budget for per-patient KMR/LAB training (run_all --train-budget);
+    # seconds=None trains every model for up to 50 epochs with early stopping
+    "train_budget": {
+        "seconds": None,
+        "max_epochs": 50,
+        "min_epochs": 5,
+        # stop when the best loss of the last plateau_patience epochs improves by
+        # less than plateau_min_delta (relative) on the best loss before them
+        "plateau_patience": 3,
+        "plateau_min_delta": 0.01
+    },
     "complexity_thresholds": {
         "simple": 10,
         "medium": 20
     }
 }
 
+# Persistent per-patient model store (run_all --no-model-cache disables it)
+MODEL_STORE_CONFIG = {
+    # Entries not reused for this long are dropped at the end of a run
+    "max_age_days": 30,
+    # Least recently used entries are dropped beyond this total size
+    "max_size_mb": 512
+}
+
+# Persisted anomaly detector artifacts (run_all --score-only scores with them)
+DETECTOR_STORE_CONFIG = {
+    # A detector whose training cohort changed in more than this fraction of
+    # patients (new, changed or removed) is refitted even in --score-only runs
+    "max_drift_fraction": 0.2
+}
+
 # Risk scoring weights
 RISK_WEIGHTS = {
     # KMR components
@@ -73,6 +158,17 @@ CLINICAL_THRESHOLDS = {
     }
 }
 
+# Improved-proxy cohort rule (io_excel.calculate_improved_proxy)
+IMPROVED_PROXY_RULE = {
+    "late_months": ["Month_9", "Month_10", "Month_11", "Month_12"],
+    "kmr_last_lt": 0.5,           # last KMR below this
+    "kmr_reduction_ratio": 0.35,  # or last <= first * ratio
+    "kre_last_lt": 1.2,           # last KRE below this (or last <= first)
+    "gfr_last_ge": 90,            # last GFR at/above this (or last >= first)
+    "min_strict_count": 5,        # strict cohort smaller than
+    "min_strict_fraction": 0.15   # max(count, fraction * n) -> fallback to candidates
+}
+
 # Alarm thresholds - dengeli kalibre edilmiş eşikler
 ALARM_THRESHOLDS = {
     "dikkat": 30,
@@ -0,0 +1,138 @@
+"""
+Detector Store - Versioned on-disk artifacts of fitted anomaly detectors
+
+One artifact per detector stage (kmr_anomaly, lab_anomaly) holds the
+detector's exported state (autoencoder weights, window size, global
+thresholds, simple-threshold mode) and a fingerprint of the data it was
+fitted on: the stage's input digest (incremental.global_input_digests) plus
+the per-patient channel hashes behind it. A run whose inputs match the
+fingerprint loads the detector instead of refitting it; run_all --score-only
+also keeps a detector whose cohort drifted by at most max_drift_fraction and
+scores only new or changed patients with it. Artifacts written by another
+store version or anomaly config are stale and ignored.
+"""
+import hashlib
+import json
+import os
+import pickle
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Dict, Optional, Set
+
+from .config import ANOMALY_CONFIG, DETECTOR_STORE_CONFIG, DETECTOR_STORE_DIR, MODEL_CONFIG
+
+
+# Bump when detector architectures/training/state layout change so old artifacts are refitted
+DETECTOR_STORE_VERSION = 1
+ARTIFACT_SUFFIX = ".pkl"
+
+
+def detector_config_fingerprint() -> str:
+    """Hash of the settings a fitted detector depends on"""
+    payload = json.dumps(
+        {
+            "anomaly": ANOMALY_CONFIG,
+            "random_seed": MODEL_CONFIG.get("random_seed"),
+            "version": DETECTOR_STORE_VERSION,
+        },
+        sort_keys=True,
+        default=str,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:16]
+
+
+@dataclass
+class DetectorArtifact:
+    """A fitted detector's state and the data it was fitted on"""
+    name: str
+    fingerprint: str  # input digest of the stage when the detector was fitted
+    patient_hashes: Dict[str, str]  # patient -> channel hash the detector was fitted on
+    state: Dict[str, Any]  # detector.export_state()
+    config_fingerprint: str = ""
+    version: int = DETECTOR_STORE_VERSION
+    created: float = field(default_factory=time.time)
+
+    def changed_patients(self, patient_hashes: Dict[str, str]) -> Set[str]:
+        """Patients that are new, changed or removed since the detector was fitted"""
+        old = self.patient_hashes
+        changed = {p for p, h in patient_hashes.items() if old.get(p) != h}
+        return changed | (set(old) - set(patient_hashes))
+
+    def drift(self, patient_hashes: Dict[str, str]) -> float:
+        """Fraction of the training cohort that changed"""
+        return len(self.changed_patients(patient_hashes)) / max(len(self.patient_hashes), 1)
+
+
+class DetectorStore:
+    """One artifact file per detector stage (safe to delete at any time: detectors are refitted)"""
+
+    def __init__(self, root: Path = None, store_config: dict = None):
+        self.root = Path(root or DETECTOR_STORE_DIR)
+        self.store_config = store_config or DETECTOR_STORE_CONFIG
+
+    def _path(self, name: str) -> Path:
+        return self.root / f"{name}{ARTIFACT_SUFFIX}"
+
+    def load(self, name: str) -> Optional[DetectorArtifact]:
+        """The stored artifact of `name`; None if missing, unreadable or written by another version/config"""
+        path = self._path(name)
+        if not path.exists():
+            return None
+        try:
+            with open(path, "rb") as f:
+                artifact = pickle.load(f)
+        except Exception as e:
+            print(f"⚠️ Ignoring unreadable detector artifact {name}: {e}")
+            return None
+        if not isinstance(artifact, DetectorArtifact) or artifact.version != DETECTOR_STORE_VERSION:
+            print(f"   Stored {name} detector has an old format, refitting")
+            return None
+        if artifact.config_fingerprint != detector_config_fingerprint():
+            print(f"   Stored {name} detector was fitted with another anomaly config, refitting")
+            return None
+        return artifact
+
+    def restore(self, name: str, detector: Any, fingerprint: str, patient_hashes: Dict[str, str],
+                allow_drift: bool = False) -> Optional[DetectorArtifact]:
+        """
+        Load the stored state into `detector` if the artifact fits these inputs.
+
+        It fits when it was fitted on exactly `fingerprint`, or (allow_drift)
+        when at most max_drift_fraction of its training cohort changed since.
+        Returns the artifact, or None when the detector has to be refitted.
+        """
+        artifact = self.load(name)
+        if artifact is None:
+            return None
+        if artifact.fingerprint != fingerprint:
+            drift = artifact.drift(patient_hashes)
+            limit = float(self.store_config.get("max_drift_fraction", 0.2))
+            if not allow_drift or drift > limit:
+                print(f"   Stored {name} detector is stale ({drift:.0%} of its training cohort changed), refitting")
+                return None
+        if not detector.load_state(artifact.state):
+            print(f"   Stored {name} detector needs TensorFlow, refitting")
+            return None
+        return artifact
+
+    def save(self, name: str, detector: Any, fingerprint: str, patient_hashes: Dict[str, str]) -> None:
+        """Persist the fitted detector (written to a temp file, then renamed)"""
+        path = self._path(name)
+        tmp_path = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            artifact = DetectorArtifact(
+                name=name,
+                fingerprint=fingerprint,
+                patient_hashes=dict(patient_hashes),
+                state=detector.export_state(),
+                config_fingerprint=detector_config_fingerprint(),
+            )
+            with open(tmp_path, "wb") as f:
+                pickle.dump(artifact, f, protocol=pickle.HIGHEST_PROTOCOL)
+            tmp_path.replace(path)
+        except Exception as e:
+            # The store is an optimization only; never fail a run because of it
+            print(f"⚠️ Could not write detector artifact {name}: {e}")
+            tmp_path.unlink(missing_ok=True)
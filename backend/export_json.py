@@ -17,6 +17,7 @@ from .config import (
     ALARM_THRESHOLDS,
     CLINICAL_THRESHOLDS,
 )
+from .patient_panel import PatientPanel
 
 
 def sanitize_for_json(obj: Any) -> Any:
@@ -204,10 +205,13 @@ class JSONExporter:
                                 patient_risks: Dict[str, dict],
                                 kmr_long: pd.DataFrame,
                                 lab_long: pd.DataFrame,
-                                timelines: Dict[str, List[dict]] = None) -> None:
+                                timelines: Dict[str, List[dict]] = None,
+                                panel: PatientPanel = None) -> None:
         """Export patient features JSON for dashboard list"""
         features = []
         timelines = timelines or {}
+        if panel is None:
+            panel = PatientPanel(kmr_long, lab_long)
         
         for _, row in meta_df.iterrows():
             patient = row["patient_code"]
@@ -215,11 +219,11 @@ class JSONExporter:
             timeline = timelines.get(patient, [])
             
             # Get KMR data
-            p_kmr = kmr_long[kmr_long["patient_code"] == patient].sort_values("time_order")
+            p_kmr = panel.kmr(patient).sort_values("time_order")
             kmr_values = p_kmr["kmr"].tolist() if len(p_kmr) > 0 else []
             
             # Get LAB data
-            p_lab = lab_long[lab_long["patient_code"] == patient].sort_values("time_order")
+            p_lab = panel.lab(patient).sort_values("time_order")
             # None + NaN değerleri güvenli şekilde ele (NaN, "is not None" filtresinden geçebilir)
             kre_values = [float(v) for v in p_lab["kre"].tolist() if pd.notna(v)] if len(p_lab) > 0 else []
             gfr_values = [float(v) for v in p_lab["gfr"].tolist() if pd.notna(v)] if len(p_lab) > 0 else []
@@ -891,19 +895,33 @@ class JSONExporter:
     def bulk_export_patients(self, meta_df: pd.DataFrame,
                              kmr_long: pd.DataFrame,
                              lab_long: pd.DataFrame,
-                             timelines: Dict[str, List[dict]]) -> Dict[str, dict]:
-        """Export all patient JSON files and return last status for each"""
+                             timelines: Dict[str, List[dict]],
+                             panel: PatientPanel = None,
+                             write_patients: Optional[set] = None,
+                             train_paths: Optional[Dict[str, Dict[str, Optional[str]]]] = None) -> Dict[str, dict]:
+        """
+        Export all patient JSON files and return last status for each
+
+        write_patients limits which files are written (incremental runs copy the
+        unchanged ones); last status is still returned for every patient.
+        train_paths: patient -> {"kmr": ..., "lab": ...} training path of the
+        patient's forecasts (written to meta as kmr_train_path / lab_train_path).
+        """
         patient_risks = {}
+        if panel is None:
+            panel = PatientPanel(kmr_long, lab_long)
         
-        print(f"📁 Exporting {len(meta_df)} patient JSON files...")
+        n_write = len(meta_df) if write_patients is None else len(write_patients)
+        print(f"📁 Exporting {n_write} patient JSON files...")
         
         for _, row in meta_df.iterrows():
             patient = row["patient_code"]
             timeline = timelines.get(patient, [])
             
             # Build meta
-            p_kmr = kmr_long[kmr_long["patient_code"] == patient]
-            p_lab = lab_long[lab_long["patient_code"] == patient]
+            p_kmr = panel.kmr(patient)
+            p_lab = panel.lab(patient)
+            paths = (train_paths or {}).get(patient, {})
             
             # Safe value extraction
             def safe_float(val):
@@ -937,7 +955,11 @@ class JSONExporter:
                 "improved_proxy": bool(row["improved_proxy"]),
                 "n_kmr_points": len(p_kmr),
                 "n_kre_points": int(p_lab["kre"].notna().sum()) if len(p_lab) > 0 else 0,
-                "n_gfr_points": int(p_lab["gfr"].notna().sum()) if len(p_lab) > 0 else 0
+                "n_gfr_points": int(p_lab["gfr"].notna().sum()) if len(p_lab) > 0 else 0,
+                # keras / keras_budget / keras_plateau / model_store / simple / numpy / joint /
+                # global / budget_fallback (None without a forecast of that channel)
+                "kmr_train_path": paths.get("kmr"),
+                "lab_train_path": paths.get("lab")
             }
             
             # Build last status - max risk point veya son dolu ölçüm
@@ -1007,7 +1029,8 @@ class JSONExporter:
             anomaly_flags = _timeline_anomaly_flags(timeline)
             
             # Export
-            self.export_patient_json(patient, meta, timeline, last_status)
+            if write_patients is None or patient in write_patients:
+                self.export_patient_json(patient, meta, timeline, last_status)
             
             # Store for summary
             patient_risks[patient] = {
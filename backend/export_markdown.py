@@ -9,7 +9,7 @@ import shutil
 from dataclasses import dataclass
 from datetime import datetime
 from pathlib import Path
-from typing import Any, Dict, List, Optional, Tuple
+from typing import Any, Dict, List, Optional, Set, Tuple
 
 import matplotlib
 import numpy as np
@@ -550,8 +550,25 @@ class MarkdownReportExporter:
         lines.append("")
         self.index_path.write_text("\n".join(lines), encoding="utf-8")
 
-    def generate(self) -> Dict[str, Any]:
-        """Generate all markdown reports and image assets from exported JSON artifacts."""
+    def _existing_artifacts(self, code: str) -> Optional[PatientArtifacts]:
+        """Artifacts from a previous run, if all of them are still on disk."""
+        artifacts = PatientArtifacts(
+            code=code,
+            report_path=self.reports_patients_dir / f"{code}.md",
+            kmr_chart=self.reports_assets_dir / f"{code}_kmr.png",
+            lab_chart=self.reports_assets_dir / f"{code}_kre_gfr.png",
+            risk_chart=self.reports_assets_dir / f"{code}_risk.png",
+        )
+        paths = (artifacts.report_path, artifacts.kmr_chart, artifacts.lab_chart, artifacts.risk_chart)
+        return artifacts if all(path.exists() for path in paths) else None
+
+    def generate(self, patients: Optional[Set[str]] = None) -> Dict[str, Any]:
+        """
+        Generate all markdown reports and image assets from exported JSON artifacts.
+
+        With `patients`, only those reports/charts are re-rendered; the others are
+        reused from disk (and rendered anyway if missing). The index is always rebuilt.
+        """
         self.reports_patients_dir.mkdir(parents=True, exist_ok=True)
         self.reports_assets_dir.mkdir(parents=True, exist_ok=True)
 
@@ -581,7 +598,14 @@ class MarkdownReportExporter:
         alarm_thresholds = system_config.get("alarm_thresholds", {}) if isinstance(system_config, dict) else {}
 
         patient_artifacts: List[PatientArtifacts] = []
+        rendered = 0
         for patient_file in patient_files:
+            if patients is not None and patient_file.stem not in patients:
+                existing = self._existing_artifacts(patient_file.stem)
+                if existing is not None:
+                    patient_artifacts.append(existing)
+                    continue
+
             patient_payload = self._load_json(patient_file)
             meta = patient_payload.get("meta", {}) if isinstance(patient_payload, dict) else {}
             code = str(meta.get("patient_code") or patient_file.stem)
@@ -612,6 +636,18 @@ class MarkdownReportExporter:
                 ref_lookup=ref_lookup,
             )
             patient_artifacts.append(artifacts)
+            rendered += 1
+
+        if patients is not None:
+            # Drop reports of patients that are no longer exported
+            current = {patient_file.stem for patient_file in patient_files}
+            for report in self.reports_patients_dir.glob("*.md"):
+                if report.stem not in current:
+                    report.unlink()
+            expected = {f"{code}{suffix}" for code in current for suffix in ("_kmr", "_kre_gfr", "_risk")}
+            for chart in self.reports_assets_dir.glob("*.png"):
+                if chart.stem not in expected:
+                    chart.unlink()
 
         created_at = (
             str(data_summary.get("metadata", {}).get("created_at"))
@@ -629,5 +665,6 @@ class MarkdownReportExporter:
         return {
             "index_markdown": str(self.index_path),
             "patient_reports": len(patient_artifacts),
+            "rendered_reports": rendered,
             "assets": len(list(self.reports_assets_dir.glob("*.png"))),
         }
@@ -0,0 +1,159 @@
+"""
+Feature Kernel - Vectorized per-series features for KMR/LAB forecasters
+
+All patients' series are stacked into one long frame and one NaN-padded
+(patients x time) array (padding at the end, so causal features of real
+points are unaffected); every feature is computed for the whole cohort at
+once and written back to the long frame as whole columns:
+
+- baseline / delta / ratio
+- EWMA (span 3, pandas adjust=True semantics with NaN gaps)
+- rolling CV over trailing 3-point windows (pandas min_periods=1, ddof=1)
+- slope_short: closed-form least-squares slope over trailing strided windows
+  (x = 0..k-1, so the slope is a fixed weight vector dotted with the window)
+"""
+import warnings
+from typing import Dict, List, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+from numpy.lib.stride_tricks import sliding_window_view
+
+EWMA_SPAN = 3
+ROLLING_WINDOW = 3
+FEATURE_COLUMNS = ("delta_from_baseline", "ratio_from_baseline", "ewma", "rolling_cv", "slope_short")
+
+# Least-squares slope weights for x = 0..k-1: (x - mean(x)) / sum((x - mean(x))^2)
+_SLOPE_WEIGHTS = {
+    2: np.array([-1.0, 1.0]),
+    3: np.array([-0.5, 0.0, 0.5]),
+}
+
+
+def stack_frames(frames: Sequence[pd.DataFrame], sort_col: str = "time_order") -> Tuple[pd.DataFrame, np.ndarray]:
+    """
+    Concatenate per-series frames into one long frame, each series sorted by
+    sort_col (stable) and keeping its own index. Returns (long_df, lengths).
+    """
+    lengths = np.array([len(f) for f in frames], dtype=np.intp)
+    long_df = pd.concat(frames)
+    series_id = np.repeat(np.arange(len(frames)), lengths)
+    order = np.lexsort((long_df[sort_col].to_numpy(), series_id))
+    return long_df.take(order), lengths
+
+
+def split_frames(long_df: pd.DataFrame, lengths: np.ndarray) -> List[pd.DataFrame]:
+    """Inverse of stack_frames: one positional slice per series"""
+    bounds = np.concatenate([[0], np.cumsum(lengths)])
+    return [long_df.iloc[bounds[i]:bounds[i + 1]] for i in range(len(lengths))]
+
+
+def _pad_index(lengths: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    rows = np.repeat(np.arange(len(lengths)), lengths)
+    cols = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    return rows, cols
+
+
+def pad(flat: np.ndarray, lengths: np.ndarray) -> np.ndarray:
+    """Concatenated series -> NaN-padded (n_series, max_len) float64 array"""
+    width = int(lengths.max()) if len(lengths) else 0
+    padded = np.full((len(lengths), width), np.nan)
+    padded[_pad_index(lengths)] = flat
+    return padded
+
+
+def unpad(padded: np.ndarray, lengths: np.ndarray) -> np.ndarray:
+    """Inverse of pad: the real (non-padding) cells, concatenated series by series"""
+    return padded[_pad_index(lengths)]
+
+
+def trailing_window_view(values: np.ndarray, window: int) -> np.ndarray:
+    """(n, T, window) view of the trailing window ending at each t (NaN before the series start)"""
+    if values.shape[1] == 0:
+        return np.empty(values.shape + (window,))
+    lead = np.full((values.shape[0], window - 1), np.nan)
+    return sliding_window_view(np.hstack([lead, values]), window, axis=1)
+
+
+def early_median_baseline(values: np.ndarray, early_mask: np.ndarray) -> np.ndarray:
+    """Median of the early values per row; first value for rows with no early point"""
+    has_early = early_mask.any(axis=1)
+    early = np.where(early_mask, values, np.nan)
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)  # all-NaN early rows -> NaN, like pandas
+        median = np.nanmedian(early, axis=1) if values.shape[1] else np.full(len(values), np.nan)
+    first = values[:, 0] if values.shape[1] else np.full(len(values), np.nan)
+    return np.where(has_early, median, first)
+
+
+def first_valid_baseline(values: np.ndarray, default: float = 0.0) -> np.ndarray:
+    """First non-NaN value per row (`default` for rows without any)"""
+    observed = ~np.isnan(values)
+    first = observed.argmax(axis=1)
+    baseline = values[np.arange(len(values)), first] if values.shape[1] else np.full(len(values), np.nan)
+    return np.where(observed.any(axis=1), baseline, default)
+
+
+def ewma(values: np.ndarray, span: int = EWMA_SPAN) -> np.ndarray:
+    """
+    pandas ewm(span, min_periods=1, adjust=True).mean() row-wise.
+
+    Weights decay with absolute position (NaN gaps still decay older points),
+    and NaN positions repeat the previous average.
+    """
+    n_time = values.shape[1]
+    decay = 1.0 - 2.0 / (span + 1.0)
+    lag = np.arange(n_time)[:, None] - np.arange(n_time)[None, :]
+    weights = np.where(lag >= 0, decay ** np.clip(lag, 0, None), 0.0)  # (t, i)
+
+    observed = ~np.isnan(values)
+    numer = np.where(observed, values, 0.0) @ weights.T
+    denom = observed.astype(np.float64) @ weights.T
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(denom > 0, numer / denom, np.nan)
+
+
+def rolling_cv(values: np.ndarray, window: int = ROLLING_WINDOW) -> np.ndarray:
+    """rolling(window, min_periods=1) std (ddof=1) / (mean + 1e-6); NaN where std is undefined"""
+    windows = trailing_window_view(values, window)
+    observed = ~np.isnan(windows)
+    count = observed.sum(axis=2)
+    filled = np.where(observed, windows, 0.0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = filled.sum(axis=2) / count
+        centered = np.where(observed, windows - mean[..., None], 0.0)
+        var = (centered ** 2).sum(axis=2) / (count - 1)
+    # Constant windows are exactly 0, as in pandas
+    constant = np.where(observed, windows, -np.inf).max(axis=2) == np.where(observed, windows, np.inf).min(axis=2)
+    var = np.where(constant, 0.0, np.clip(var, 0.0, None))
+    std = np.where(count >= 2, np.sqrt(var), np.nan)
+    mean = np.where(count >= 1, mean, np.nan)
+    return std / (mean + 1e-6)
+
+
+def slope_short(values: np.ndarray, min_points: int = 3) -> np.ndarray:
+    """
+    Least-squares slope over the trailing 3 points at each t (0 before enough points).
+
+    min_points=2 also fits the 2-point window at t=1. A window containing NaN
+    yields NaN, the same as np.polyfit on it.
+    """
+    n_time = values.shape[1]
+    slope = np.zeros_like(values)
+    if n_time >= 3:
+        slope[:, 2:] = trailing_window_view(values, 3)[:, 2:] @ _SLOPE_WEIGHTS[3]
+    if min_points <= 2 and n_time >= 2:
+        slope[:, 1] = values[:, :2] @ _SLOPE_WEIGHTS[2]
+    return slope
+
+
+def series_features(values: np.ndarray, baseline: np.ndarray, slope_min_points: int = 3) -> Dict[str, np.ndarray]:
+    """All FEATURE_COLUMNS for a padded (n_series, T) block; each value is (n_series, T)"""
+    base = baseline[:, None]
+    return {
+        "delta_from_baseline": values - base,
+        "ratio_from_baseline": values / (base + 1e-6),
+        "ewma": ewma(values),
+        "rolling_cv": rolling_cv(values),
+        "slope_short": slope_short(values, slope_min_points),
+    }
@@ -0,0 +1,143 @@
+"""
+Forecast Engine - Pluggable per-patient forecasters for KMR/LAB predictors
+
+An engine forecasts every series of a (series x grid) block at once and
+returns per-point prediction, interval and status arrays; the predictors turn
+them into their usual prediction dicts. "keras" is the per-patient GRU/LSTM
+path inside the predictors; "numpy" is LocalLevelEngine below, which needs no
+TensorFlow and fits a whole cohort in one vectorized pass over the grid;
+"joint" is joint_model.JointForecaster, one masked LSTM for KMR/KRE/GFR
+trained on the whole cohort, which returns the same GridForecast blocks.
+"""
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from typing import Tuple
+
+import numpy as np
+
+ENGINES = ("keras", "numpy", "joint")
+
+
+@dataclass
+class GridForecast:
+    """Per-point forecast on a (series x grid) block (NaN pred where a series has no data)"""
+    pred: np.ndarray
+    lo: np.ndarray
+    hi: np.ndarray
+    status: np.ndarray  # "warmup_copy" | "ok" | "forecast"
+
+
+class ForecastEngine(ABC):
+    """Interface: forecast all series of a NaN-masked (series x grid) block"""
+
+    name = "base"
+
+    @abstractmethod
+    def forecast(self, values: np.ndarray, rel_band: Tuple[float, float] = (0.15, 0.25)) -> GridForecast:
+        """
+        values: (n_series, n_grid) observations, NaN where missing.
+        rel_band: relative half-widths (in-sample, forecast) used when a series is
+        too short to estimate its own noise level.
+        """
+
+
+class LocalLevelEngine(ForecastEngine):
+    """
+    Kalman local-level model (random walk level + measurement noise).
+
+    The level-noise / measurement-noise ratio is fixed by config; the noise
+    scale is estimated per series from its standardized one-step innovations
+    (concentrated likelihood), so one filter pass over the grid fits every
+    series. Missing grid points skip the update and widen the level variance.
+    """
+
+    name = "numpy"
+
+    def __init__(self, level_noise_ratio: float = 0.5, interval_z: float = 1.645, min_innovations: int = 2):
+        self.q = float(level_noise_ratio)
+        self.z = float(interval_z)
+        self.min_innovations = int(min_innovations)
+
+    def forecast(self, values: np.ndarray, rel_band: Tuple[float, float] = (0.15, 0.25)) -> GridForecast:
+        values = np.asarray(values, dtype=np.float64)
+        n_series, n_grid = values.shape
+        observed = ~np.isnan(values)
+
+        level = np.zeros(n_series)
+        level_var = np.zeros(n_series)  # filtered level variance, in measurement-noise units
+        started = np.zeros(n_series, dtype=bool)
+        pred = np.full(values.shape, np.nan)
+        pred_var = np.full(values.shape, np.nan)
+        first = np.zeros(values.shape, dtype=bool)
+        sum_sq = np.zeros(n_series)
+        n_innov = np.zeros(n_series, dtype=np.intp)
+
+        for t in range(n_grid):
+            y, obs = values[:, t], observed[:, t]
+
+            # Predict: level carries over, its variance grows by q per grid step
+            var_pred = level_var + self.q
+            f = var_pred + 1.0
+            pred[:, t] = np.where(started, level, np.nan)
+            pred_var[:, t] = np.where(started, f, np.nan)
+
+            # Update series that already have a level and observe this point
+            update = started & obs
+            innovation = np.where(update, y - level, 0.0)
+            gain = var_pred / f
+            sum_sq += innovation ** 2 / f
+            n_innov += update
+            level = np.where(update, level + gain * innovation, level)
+            level_var = np.where(update, var_pred * (1.0 - gain), np.where(started, var_pred, level_var))
+
+            # Diffuse start: the first observation sets the level (variance = one measurement)
+            init = obs & ~started
+            level = np.where(init, y, level)
+            level_var = np.where(init, 1.0, level_var)
+            first[:, t] = init
+            started |= obs
+
+        with np.errstate(invalid="ignore", divide="ignore"):
+            sigma2 = np.where(n_innov >= self.min_innovations, sum_sq / n_innov, np.nan)
+            series_mean = np.nansum(values, axis=1) / observed.sum(axis=1)
+
+        # Before the first observation: the series mean, like the Keras path
+        no_history = np.isnan(pred)
+        pred = np.where(no_history, series_mean[:, None], pred)
+        # First observation: copied as-is
+        pred = np.where(first, values, pred)
+        pred_var = np.where(first, 1.0, pred_var)
+
+        status = np.where(first, "warmup_copy", np.where(observed & ~no_history, "ok", "forecast")).astype(object)
+
+        half = self.z * np.sqrt(sigma2[:, None] * pred_var)
+        rel = np.where(observed, rel_band[0], rel_band[1]) * np.abs(pred)
+        half = np.where(np.isnan(half), rel, half)
+        # Points with no history have no filtered variance: always the relative band
+        half = np.where(no_history & ~first, rel, half)
+        return GridForecast(pred=pred, lo=pred - half, hi=pred + half, status=status)
+
+
+def resolve_engine(config: dict, has_tf: bool) -> str:
+    """Engine name from MODEL_CONFIG forecast_engine (keras/joint fall back to numpy without TensorFlow)"""
+    name = config.get("forecast_engine", "keras")
+    if name not in ENGINES:
+        raise ValueError(f"Unknown forecast_engine {name!r} (expected one of {ENGINES})")
+    return "numpy" if name in ("keras", "joint") and not has_tf else name
+
+
+def numpy_engine(config: dict) -> LocalLevelEngine:
+    """LocalLevelEngine configured from MODEL_CONFIG numpy_engine"""
+    params = config.get("numpy_engine", {})
+    return LocalLevelEngine(
+        level_noise_ratio=params.get("level_noise_ratio", 0.5),
+        interval_z=params.get("interval_z", 1.645),
+    )
+
+
+def sanitize(pred: np.ndarray, lo: np.ndarray, hi: np.ndarray,
+             lower: float, upper: float) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Vectorized _sanitize_prediction: clamp to bounds and keep lo <= pred <= hi"""
+    pred, lo, hi = (np.clip(a, lower, upper) for a in (pred, lo, hi))
+    lo, hi = np.minimum(lo, hi), np.maximum(lo, hi)
+    return np.clip(pred, lo, hi), lo, hi
@@ -323,6 +323,11 @@ def main() -> int:
         checker.check(meta.get("patient_code") == patient_code, f"{patient_code}: meta.patient_code mismatch")
         checker.check(isinstance(timeline, list), f"{patient_code}: timeline is not a list")
         checker.check(feature is not None, f"{patient_code}: missing from patient_features.json")
+        # Every forecast channel records the training path it came from
+        if meta.get("n_kmr_points"):
+            checker.check(isinstance(meta.get("kmr_train_path"), str), f"{patient_code}: meta.kmr_train_path missing")
+        if meta.get("n_kre_points") or meta.get("n_gfr_points"):
+            checker.check(isinstance(meta.get("lab_train_path"), str), f"{patient_code}: meta.lab_train_path missing")
 
         if meta.get("improved_proxy") is True:
             improved_count += 1
@@ -0,0 +1,123 @@
+"""
+GFR Calibration - Patient-level GFR bias correction on a (patients x slots) block
+
+Each patient's GFR predictions are shifted by a robust estimate of its own
+bias: the median prediction error over its observed, non-warmup points
+(IQR outliers dropped when >= 3 points remain), capped at
+max(8, 1.5 x std). Corrected values are floored at 35% of the measured value
+(10th percentile of the patient's measurements where there is none) and
+sanitized to 0..180. Patients with < 4 usable points or a correction below
+0.1 are left as-is. Every statistic is a row-wise array operation, so one
+call calibrates a whole cohort.
+"""
+from dataclasses import dataclass
+
+import numpy as np
+
+from .forecast_engine import sanitize
+
+MIN_POINTS = 4
+GFR_BOUNDS = (0.0, 180.0)
+
+
+@dataclass
+class GFRCalibration:
+    """Calibrated values on the input block; `calibrated` marks the cells that changed"""
+    pred: np.ndarray
+    lo: np.ndarray
+    hi: np.ndarray
+    residual: np.ndarray  # actual - calibrated pred (NaN without an actual)
+    calibrated: np.ndarray
+    correction: np.ndarray  # per patient (0 where not applied)
+
+
+def _sorted_rows(values: np.ndarray, mask: np.ndarray) -> np.ndarray:
+    """Rows sorted ascending with the unmasked cells (as +inf) at the end"""
+    return np.sort(np.where(mask, values, np.inf), axis=1)
+
+
+def _row_quantile(sorted_rows: np.ndarray, counts: np.ndarray, q: float) -> np.ndarray:
+    """np.percentile(..., method="linear") of the first `counts` cells of each sorted row"""
+    rows = np.arange(len(sorted_rows))
+    last = np.maximum(counts - 1, 0)
+    virtual = last * q
+    previous = np.floor(virtual)
+    gamma = virtual - previous
+    previous = previous.astype(np.intp)
+    following = np.minimum(previous + 1, last)
+    a, b = sorted_rows[rows, previous], sorted_rows[rows, following]
+    # Same two-sided interpolation as numpy's _lerp
+    diff = b - a
+    with np.errstate(invalid="ignore"):
+        out = np.where(gamma >= 0.5, b - diff * (1 - gamma), a + diff * gamma)
+    return np.where(virtual >= last, sorted_rows[rows, last], out)
+
+
+def _row_median(sorted_rows: np.ndarray, counts: np.ndarray) -> np.ndarray:
+    """np.median of the first `counts` cells of each sorted row"""
+    rows = np.arange(len(sorted_rows))
+    upper = counts // 2
+    lower = np.maximum(counts - 1, 0) // 2
+    with np.errstate(invalid="ignore"):
+        return (sorted_rows[rows, lower] + sorted_rows[rows, upper]) / 2
+
+
+def _row_std(values: np.ndarray, mask: np.ndarray, counts: np.ndarray) -> np.ndarray:
+    """Population std of the masked cells of each row"""
+    safe = np.maximum(counts, 1)
+    mean = np.where(mask, values, 0.0).sum(axis=1) / safe
+    dev = np.where(mask, values - mean[:, None], 0.0)
+    return np.sqrt((dev * dev).sum(axis=1) / safe)
+
+
+def calibrate_gfr(pred: np.ndarray, lo: np.ndarray, hi: np.ndarray, actual: np.ndarray,
+                  calibrate: np.ndarray) -> GFRCalibration:
+    """
+    pred/lo/hi/actual: (patients, slots) float arrays, NaN where missing.
+    calibrate: cells eligible for calibration (False for warmup predictions).
+    """
+    pred, lo, hi, actual = (np.asarray(a, dtype=np.float64) for a in (pred, lo, hi, actual))
+    calibrate = np.asarray(calibrate, dtype=bool)
+    has_actual = ~np.isnan(actual)
+
+    # Prediction errors on observed, non-warmup points
+    usable = calibrate & has_actual & ~np.isnan(pred)
+    n_usable = usable.sum(axis=1)
+    errors = pred - actual
+
+    ordered = _sorted_rows(errors, usable)
+    q1 = _row_quantile(ordered, n_usable, 0.25)
+    q3 = _row_quantile(ordered, n_usable, 0.75)
+    iqr = np.maximum(q3 - q1, 1e-6)
+    with np.errstate(invalid="ignore"):
+        inliers = usable & (errors >= (q1 - 1.5 * iqr)[:, None]) & (errors <= (q3 + 1.5 * iqr)[:, None])
+    n_inliers = inliers.sum(axis=1)
+    core = np.where((n_inliers >= 3)[:, None], inliers, usable)
+    n_core = core.sum(axis=1)
+
+    # Robust (median) correction with conservative cap
+    raw_correction = _row_median(_sorted_rows(errors, core), n_core)
+    max_abs_correction = np.maximum(8.0, _row_std(errors, core, n_core) * 1.5)
+    correction = np.clip(raw_correction, -max_abs_correction, max_abs_correction)
+    with np.errstate(invalid="ignore"):
+        apply = (n_usable >= MIN_POINTS) & (np.abs(correction) >= 0.1)
+    correction = np.where(apply, correction, 0.0)
+
+    global_floor = np.maximum(1.0, _row_quantile(_sorted_rows(actual, usable), n_usable, 0.10) * 0.35)
+    # Keep calibrated predictions within a clinically plausible fraction of the measured value
+    floor = np.where(has_actual, np.maximum(1.0, actual * 0.35), global_floor[:, None])
+
+    cells = apply[:, None] & calibrate & ~(np.isnan(pred) | np.isnan(lo) | np.isnan(hi))
+    pred_adj = np.maximum(pred - correction[:, None], floor)
+    lo_adj = np.maximum(lo - correction[:, None], np.minimum(floor, pred_adj))
+    hi_adj = np.maximum(hi - correction[:, None], pred_adj)
+    pred_adj, lo_adj, hi_adj = sanitize(pred_adj, lo_adj, hi_adj, *GFR_BOUNDS)
+
+    return GFRCalibration(
+        pred=np.where(cells, pred_adj, pred),
+        lo=np.where(cells, lo_adj, lo),
+        hi=np.where(cells, hi_adj, hi),
+        residual=actual - np.where(cells, pred_adj, pred),
+        calibrated=cells,
+        correction=correction,
+    )
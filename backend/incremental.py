@@ -0,0 +1,223 @@
+"""
+Incremental Run - Per-patient change tracking for run_all --incremental
+
+Each patient's raw Excel row is hashed per channel block (meta / KMR / LAB).
+Global artifacts declare which channel of which cohort they read; their input
+digest changes only when one of those inputs changes. A run then retrains,
+rescores and re-exports only dirty patients plus whatever the invalidated
+global stages touch, and reuses everything else from the previous run's state.
+"""
+import hashlib
+import json
+import os
+import pickle
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Set
+
+import pandas as pd
+
+from .config import (
+    PIPELINE_STATE_DIR,
+    TIME_CONFIG,
+    MODEL_CONFIG,
+    ANOMALY_CONFIG,
+    RISK_WEIGHTS,
+    CLINICAL_THRESHOLDS,
+    ALARM_THRESHOLDS,
+    IMPROVED_PROXY_RULE,
+)
+from .time_mapping import KMR_TIME_MAP
+
+
+# Bump when stage outputs change shape/meaning so old state forces a full run
+STATE_VERSION = 1
+STATE_FILE = "state.pkl"
+
+CHANNELS = ("meta", "kmr", "lab")
+
+# Global artifact -> {channel: cohort} it reads ("all" patients or "improved" cohort).
+# reference_band reads LAB of all patients because its LAB cohort falls back to
+# non-improved patients when the improved cohort has too little LAB data.
+GLOBAL_DEPENDENCIES: Dict[str, Dict[str, str]] = {
+    "kmr_forecaster": {"kmr": "all"},  # only used when MODEL_CONFIG kmr_model_mode == "global"
+    "joint_forecaster": {"kmr": "all", "lab": "all"},  # only used when MODEL_CONFIG forecast_engine == "joint"
+    "kmr_anomaly": {"kmr": "all"},
+    "lab_anomaly": {"lab": "all"},
+    "reference_band": {"kmr": "improved", "lab": "all"},
+    "cohort_trajectory": {"kmr": "improved"},
+    "cohort_trajectory_lab": {"lab": "improved"},
+}
+
+
+def _channel_columns(columns: List[str]) -> Dict[str, List[str]]:
+    kmr_cols = [c for c in columns if c in KMR_TIME_MAP]
+    lab_cols = [c for c in columns if c.endswith("_KRE") or c.endswith("_GFR")]
+    used = set(kmr_cols) | set(lab_cols)
+    meta_cols = [c for c in columns if c not in used]
+    return {"meta": meta_cols, "kmr": kmr_cols, "lab": lab_cols}
+
+
+def patient_row_hashes(raw_df: pd.DataFrame) -> Dict[str, Dict[str, str]]:
+    """patient_code -> {channel: hash of that patient's raw cells in the channel block}"""
+    columns = [str(c) for c in raw_df.columns]
+    frame = raw_df.copy()
+    frame.columns = columns
+    codes = frame["patient_code"].astype(str).tolist()
+
+    per_channel = {}
+    for channel, cols in _channel_columns(columns).items():
+        block = frame[cols].astype(str)
+        row_hashes = pd.util.hash_pandas_object(block, index=False).to_numpy()
+        # Column names are part of the hash so a layout change dirties everyone
+        schema = hashlib.sha1("\x1f".join(cols).encode("utf-8")).hexdigest()[:8]
+        per_channel[channel] = [f"{schema}{h:016x}" for h in row_hashes]
+
+    hashes: Dict[str, Dict[str, str]] = {}
+    for i, code in enumerate(codes):
+        entry = {channel: per_channel[channel][i] for channel in CHANNELS}
+        if code in hashes:
+            # Duplicate rows for one patient: combine so any change is still seen
+            entry = {ch: hashes[code][ch] + entry[ch] for ch in CHANNELS}
+        hashes[code] = entry
+    return hashes
+
+
+def config_fingerprint() -> str:
+    """Hash of every setting that changes stage outputs"""
+    payload = json.dumps(
+        {
+            "version": STATE_VERSION,
+            "time": TIME_CONFIG,
+            "model": MODEL_CONFIG,
+            "anomaly": ANOMALY_CONFIG,
+            "risk": RISK_WEIGHTS,
+            "clinical": CLINICAL_THRESHOLDS,
+            "alarm": ALARM_THRESHOLDS,
+            "improved_proxy": IMPROVED_PROXY_RULE,
+        },
+        sort_keys=True,
+        default=str,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:16]
+
+
+def global_input_digests(hashes: Dict[str, Dict[str, str]],
+                         improved_proxy: Dict[str, bool]) -> Dict[str, str]:
+    """Digest of exactly the inputs each global artifact reads"""
+    improved = sorted(str(p) for p, v in improved_proxy.items() if v)
+    cohorts = {"all": sorted(hashes), "improved": [p for p in improved if p in hashes]}
+
+    digests = {}
+    for artifact, deps in GLOBAL_DEPENDENCIES.items():
+        payload = {
+            channel: [(p, hashes[p][channel]) for p in cohorts[cohort]]
+            for channel, cohort in sorted(deps.items())
+        }
+        if "improved" in deps.values():
+            payload["improved"] = improved
+        digests[artifact] = hashlib.sha256(
+            json.dumps(payload, sort_keys=True).encode("utf-8")
+        ).hexdigest()[:16]
+    return digests
+
+
+@dataclass
+class PipelineState:
+    """What the previous run consumed and produced"""
+    fingerprint: str = ""
+    patient_hashes: Dict[str, Dict[str, str]] = field(default_factory=dict)
+    improved_proxy: Dict[str, bool] = field(default_factory=dict)
+    global_digests: Dict[str, str] = field(default_factory=dict)
+    results: Dict[str, Any] = field(default_factory=dict)
+
+    @classmethod
+    def load(cls, state_dir: Path = None) -> Optional["PipelineState"]:
+        path = (state_dir or PIPELINE_STATE_DIR) / STATE_FILE
+        if not path.exists():
+            return None
+        try:
+            with open(path, "rb") as f:
+                state = pickle.load(f)
+            return state if isinstance(state, cls) else None
+        except Exception as e:
+            print(f"⚠️ Ignoring unreadable pipeline state: {e}")
+            return None
+
+    def save(self, state_dir: Path = None) -> None:
+        state_dir = state_dir or PIPELINE_STATE_DIR
+        state_dir.mkdir(parents=True, exist_ok=True)
+        tmp_path = state_dir / f".{STATE_FILE}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, "wb") as f:
+                pickle.dump(self, f, protocol=pickle.HIGHEST_PROTOCOL)
+            tmp_path.replace(state_dir / STATE_FILE)
+        except Exception as e:
+            print(f"⚠️ Could not write pipeline state: {e}")
+            tmp_path.unlink(missing_ok=True)
+
+
+@dataclass
+class RunPlan:
+    """Dirty sets for one run (full=True means nothing is reused)"""
+    full: bool
+    hashes: Dict[str, Dict[str, str]]
+    global_digests: Dict[str, str]
+    dirty: Dict[str, Set[str]]
+    removed: Set[str]
+    stale_globals: Set[str]
+    improved_changed: Set[str]
+    previous: Optional[PipelineState] = None
+
+    def is_dirty(self, patient: str, *channels: str) -> bool:
+        channels = channels or CHANNELS
+        return self.full or any(patient in self.dirty[ch] for ch in channels)
+
+    def cached(self, key: str) -> Dict[str, Any]:
+        """Previous run's per-patient results for `key` (empty on full runs)"""
+        if self.full or self.previous is None:
+            return {}
+        return self.previous.results.get(key, {})
+
+    def reuse_global(self, artifact: str) -> bool:
+        return (not self.full and artifact not in self.stale_globals
+                and self.previous is not None and artifact in self.previous.results)
+
+    def summary(self) -> str:
+        if self.full:
+            return f"full run ({len(self.hashes)} patients)"
+        counts = ", ".join(f"{ch}={len(self.dirty[ch])}" for ch in CHANNELS)
+        stale = ", ".join(sorted(self.stale_globals)) or "none"
+        return f"dirty patients: {counts}; removed={len(self.removed)}; stale global stages: {stale}"
+
+
+def plan_run(raw_df: pd.DataFrame, improved_proxy: Dict[str, bool],
+             incremental: bool, state_dir: Path = None) -> RunPlan:
+    """Compare this run's inputs with the saved state and decide what to recompute"""
+    hashes = patient_row_hashes(raw_df)
+    digests = global_input_digests(hashes, improved_proxy)
+    improved_proxy = {str(p): bool(v) for p, v in improved_proxy.items()}
+
+    previous = PipelineState.load(state_dir) if incremental else None
+    if previous is None or previous.fingerprint != config_fingerprint():
+        return RunPlan(
+            full=True, hashes=hashes, global_digests=digests,
+            dirty={ch: set(hashes) for ch in CHANNELS}, removed=set(),
+            stale_globals=set(GLOBAL_DEPENDENCIES), improved_changed=set(hashes),
+        )
+
+    old = previous.patient_hashes
+    dirty = {
+        ch: {p for p, h in hashes.items() if p not in old or old[p][ch] != h[ch]}
+        for ch in CHANNELS
+    }
+    improved_changed = {
+        p for p in hashes if improved_proxy.get(p, False) != previous.improved_proxy.get(p, False)
+    }
+    stale = {a for a, d in digests.items() if previous.global_digests.get(a) != d}
+
+    return RunPlan(
+        full=False, hashes=hashes, global_digests=digests, dirty=dirty,
+        removed=set(old) - set(hashes), stale_globals=stale,
+        improved_changed=improved_changed, previous=previous,
+    )
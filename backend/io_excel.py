@@ -1,13 +1,29 @@
 """
 Excel I/O - data.xlsx okuma ve temizleme
 """
+import hashlib
+import json
+import os
+import shutil
 import pandas as pd
 import numpy as np
 from pathlib import Path
-from typing import Tuple, Dict, List
+from typing import Tuple, Dict, List, Optional
 
-from .config import EXCEL_FILE, TIME_CONFIG
+from .config import EXCEL_FILE, TIME_CONFIG, INPUT_CACHE_DIR, TENSOR_CONFIG, IMPROVED_PROXY_RULE
 from .time_mapping import KMR_TIME_MAP, LAB_TIME_MAP, get_kmr_time_info, get_lab_time_info
+from .patient_panel import PatientPanel, PatientTensor
+
+
+# Bump when the parsing/reshaping rules change so stale caches are ignored
+INPUT_CACHE_VERSION = 3
+_CACHED_FRAMES = ("meta_df", "kmr_long", "lab_long", "raw_df")
+
+try:
+    import pyarrow  # noqa: F401
+    HAS_PARQUET = True
+except ImportError:
+    HAS_PARQUET = False
 
 
 def load_excel(filepath: Path = None) -> pd.DataFrame:
@@ -30,71 +46,179 @@ def extract_meta(df: pd.DataFrame) -> pd.DataFrame:
     return df[meta_cols].copy()
 
 
+def _time_info_arrays(time_keys: List[str], info_fn) -> Tuple[np.ndarray, np.ndarray]:
+    """Resolve (order, pseudo_days) for a list of time keys as int64 arrays"""
+    infos = [info_fn(tk) for tk in time_keys]
+    orders = np.array([info["order"] for info in infos], dtype=np.int64)
+    pseudo_days = np.array([info["pseudo_days"] for info in infos], dtype=np.int64)
+    return orders, pseudo_days
+
+
+def _value_matrix(df: pd.DataFrame, cols: List[str]) -> np.ndarray:
+    """
+    Wide value block as float64 (patients x cols); absent columns become NaN.
+
+    Non-empty cells that are not numbers (text, typos) raise ValueError naming
+    their columns and patients instead of silently becoming NaN.
+    """
+    values = np.full((len(df), len(cols)), np.nan, dtype=np.float64)
+    malformed = []
+    for j, col in enumerate(cols):
+        if col in df.columns:
+            values[:, j] = pd.to_numeric(df[col], errors="coerce").to_numpy(dtype=np.float64, na_value=np.nan)
+            bad = np.isnan(values[:, j]) & df[col].notna().to_numpy()
+            malformed += [f"{col} (patient {p}): {v!r}" for p, v in zip(df["patient_code"][bad], df[col][bad])]
+    if malformed:
+        raise ValueError(f"Non-numeric values in {len(malformed)} cells: " + "; ".join(malformed))
+    return values
+
+
 def wide_to_long_kmr(df: pd.DataFrame) -> pd.DataFrame:
-    """Convert wide KMR columns to long format"""
+    """
+    Convert wide KMR columns to long format.
+
+    Columnar path: the (patients x time) value block is masked once and the
+    non-null cells are gathered in row-major order, so the output keeps the
+    patient-then-column ordering of the original row walk.
+    """
     kmr_cols = [c for c in df.columns if c in KMR_TIME_MAP]
-    
-    records = []
-    for _, row in df.iterrows():
-        patient = row["patient_code"]
-        for col in kmr_cols:
-            val = row[col]
-            if pd.notna(val):
-                info = get_kmr_time_info(col)
-                records.append({
-                    "patient_code": patient,
-                    "time_key": col,
-                    "time_order": info["order"],
-                    "pseudo_time_days": info["pseudo_days"],
-                    "kmr": float(val)
-                })
-    
-    return pd.DataFrame(records)
+
+    values = _value_matrix(df, kmr_cols)
+    row_idx, col_idx = np.nonzero(~np.isnan(values))
+    orders, pseudo_days = _time_info_arrays(kmr_cols, get_kmr_time_info)
+    patients = df["patient_code"].to_numpy(dtype=object)
+
+    return pd.DataFrame({
+        "patient_code": patients[row_idx],
+        "time_key": np.array(kmr_cols, dtype=object)[col_idx],
+        "time_order": orders[col_idx],
+        "pseudo_time_days": pseudo_days[col_idx],
+        "kmr": values[row_idx, col_idx],
+    })
 
 
 def wide_to_long_lab(df: pd.DataFrame) -> pd.DataFrame:
-    """Convert wide KRE/GFR columns to long format"""
+    """
+    Convert wide KRE/GFR columns to long format.
+
+    KRE and GFR blocks are aligned on the shared base time keys; a row is kept
+    when at least one of the two values exists. Rows are emitted per patient in
+    LAB time order (the previous set-based walk had no stable order).
+    """
     # Find KRE and GFR columns
     kre_cols = [c for c in df.columns if c.endswith("_KRE")]
     gfr_cols = [c for c in df.columns if c.endswith("_GFR")]
-    
-    # Build time_key -> (kre_col, gfr_col) mapping
-    time_keys = set()
-    for c in kre_cols:
-        time_keys.add(c.replace("_KRE", ""))
-    for c in gfr_cols:
-        time_keys.add(c.replace("_GFR", ""))
-    
-    records = []
-    for _, row in df.iterrows():
-        patient = row["patient_code"]
-        for tk in time_keys:
-            kre_col = f"{tk}_KRE"
-            gfr_col = f"{tk}_GFR"
-            
-            kre_val = row.get(kre_col, np.nan)
-            gfr_val = row.get(gfr_col, np.nan)
-            
-            # Only add if at least one value exists
-            if pd.notna(kre_val) or pd.notna(gfr_val):
-                info = get_lab_time_info(tk)
-                records.append({
-                    "patient_code": patient,
-                    "time_key": tk,
-                    "time_order": info["order"],
-                    "pseudo_time_days": info["pseudo_days"],
-                    "kre": float(kre_val) if pd.notna(kre_val) else None,
-                    "gfr": float(gfr_val) if pd.notna(gfr_val) else None
-                })
-    
-    return pd.DataFrame(records)
 
+    # Base time keys present in either block
+    time_keys = {c.replace("_KRE", "") for c in kre_cols} | {c.replace("_GFR", "") for c in gfr_cols}
+    time_keys = sorted(time_keys, key=lambda tk: (get_lab_time_info(tk)["order"], tk))
 
-def calculate_improved_proxy(df: pd.DataFrame) -> Dict[str, bool]:
+    kre_values = _value_matrix(df, [f"{tk}_KRE" for tk in time_keys])
+    gfr_values = _value_matrix(df, [f"{tk}_GFR" for tk in time_keys])
+
+    # Only add if at least one value exists
+    row_idx, col_idx = np.nonzero(~(np.isnan(kre_values) & np.isnan(gfr_values)))
+    orders, pseudo_days = _time_info_arrays(time_keys, get_lab_time_info)
+    patients = df["patient_code"].to_numpy(dtype=object)
+
+    return pd.DataFrame({
+        "patient_code": patients[row_idx],
+        "time_key": np.array(time_keys, dtype=object)[col_idx],
+        "time_order": orders[col_idx],
+        "pseudo_time_days": pseudo_days[col_idx],
+        "kre": kre_values[row_idx, col_idx],
+        "gfr": gfr_values[row_idx, col_idx],
+    })
+
+
+def _first_last_valid(values: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """First/last non-NaN value per row of a (patients, time) matrix (NaN if none)"""
+    n_rows, n_cols = values.shape
+    if n_cols == 0:
+        return np.full(n_rows, np.nan), np.full(n_rows, np.nan)
+
+    valid = ~np.isnan(values)
+    rows = np.arange(n_rows)
+    first = values[rows, valid.argmax(axis=1)]
+    last = values[rows, n_cols - 1 - valid[:, ::-1].argmax(axis=1)]
+    # argmax of an all-False row is 0, which already points at a NaN
+    return first, last
+
+
+def improved_proxy_masks(df: pd.DataFrame, rules: Dict[str, Dict] = None) -> pd.DataFrame:
+    """
+    Evaluate one or more improved-proxy rule variants in a single pass.
+
+    Args:
+        df: Wide dataframe (data.xlsx layout)
+        rules: name -> rule dict; missing keys default to IMPROVED_PROXY_RULE.
+               Defaults to {"default": IMPROVED_PROXY_RULE}.
+
+    Returns:
+        DataFrame aligned with df rows: "patient_code", one "candidate:<name>"
+        column (late follow-up present) and one "strict:<name>" column per rule.
+    """
+    rules = rules or {"default": {}}
+    kmr_keys = sorted(KMR_TIME_MAP.keys(), key=lambda k: KMR_TIME_MAP[k]["order"])
+    lab_keys = sorted(LAB_TIME_MAP.keys(), key=lambda k: LAB_TIME_MAP[k]["order"])
+
+    # First/last values are rule independent: compute once for all variants
+    kmr_values = _value_matrix(df, kmr_keys)
+    first_kmr, last_kmr = _first_last_valid(kmr_values)
+    first_kre, last_kre = _first_last_valid(_value_matrix(df, [f"{k}_KRE" for k in lab_keys]))
+    first_gfr, last_gfr = _first_last_valid(_value_matrix(df, [f"{k}_GFR" for k in lab_keys]))
+    no_kre = np.isnan(last_kre)
+    no_gfr = np.isnan(last_gfr)
+
+    out = {"patient_code": df["patient_code"].to_numpy()}
+    with np.errstate(invalid="ignore"):
+        for name, overrides in rules.items():
+            rule = {**IMPROVED_PROXY_RULE, **overrides}
+            late_cols = [c for c in df.columns if c in rule["late_months"]]
+            has_late = ~np.isnan(_value_matrix(df, late_cols)).all(axis=1) if late_cols \
+                else np.zeros(len(df), dtype=bool)
+
+            # NaN comparisons are False, so patients without KMR never improve
+            kmr_improved = (
+                (last_kmr < rule["kmr_last_lt"])
+                | ((first_kmr > 0) & (last_kmr <= first_kmr * rule["kmr_reduction_ratio"]))
+            )
+            # Missing KRE/GFR does not block improvement
+            kre_improved = no_kre | (last_kre < rule["kre_last_lt"]) | (last_kre <= first_kre)
+            gfr_improved = no_gfr | (last_gfr >= rule["gfr_last_ge"]) | (last_gfr >= first_gfr)
+
+            out[f"candidate:{name}"] = has_late
+            out[f"strict:{name}"] = has_late & kmr_improved & kre_improved & gfr_improved
+
+    return pd.DataFrame(out, index=df.index)
+
+
+def _select_improved_proxy(masks: pd.DataFrame, name: str, rule: Dict,
+                           verbose: bool = True) -> Dict[str, bool]:
+    """Strict cohort for one rule, or the late-follow-up cohort if it is too small"""
+    patients = masks["patient_code"].tolist()
+    strict = masks[f"strict:{name}"].to_numpy()
+    candidate = masks[f"candidate:{name}"].to_numpy()
+
+    strict_count = int(strict.sum())
+    min_required = max(rule["min_strict_count"], int(len(masks) * rule["min_strict_fraction"]))
+
+    if strict_count < min_required:
+        if verbose:
+            print(
+                f"   Improved proxy strict cohort too small ({strict_count}); "
+                f"fallback to late-follow-up cohort ({int(candidate.sum())})"
+            )
+        return dict(zip(patients, candidate.tolist()))
+
+    return dict(zip(patients, strict.tolist()))
+
+
+def calculate_improved_proxy(df: pd.DataFrame, rule: Dict = None) -> Dict[str, bool]:
     """
     Determine improved_proxy using late follow-up + clinical trend criteria.
 
-    Rule set:
+    Rule set (thresholds in config.IMPROVED_PROXY_RULE, overridable via `rule`):
     - Candidate cohort: has at least one KMR value in Month_9..Month_12
     - Clinical improvement:
       - KMR improves (last < 0.5 OR strong reduction vs first value)
@@ -104,106 +228,211 @@ def calculate_improved_proxy(df: pd.DataFrame) -> Dict[str, bool]:
     If the strict cohort becomes too small, fallback to candidate cohort to keep
     training stable.
     """
-    kmr_keys = sorted(KMR_TIME_MAP.keys(), key=lambda k: KMR_TIME_MAP[k]["order"])
-    lab_keys = sorted(LAB_TIME_MAP.keys(), key=lambda k: LAB_TIME_MAP[k]["order"])
+    rule = {**IMPROVED_PROXY_RULE, **(rule or {})}
+    masks = improved_proxy_masks(df, {"default": rule})
+    return _select_improved_proxy(masks, "default", rule)
+
 
-    late_months = ["Month_9", "Month_10", "Month_11", "Month_12"]
-    late_cols = [c for c in df.columns if c in late_months]
+def calculate_improved_proxy_variants(df: pd.DataFrame, rules: Dict[str, Dict]
+                                      ) -> Dict[str, Dict[str, bool]]:
+    """
+    improved_proxy for several rule variants at once (cohort sensitivity studies).
 
-    strict_result: Dict[str, bool] = {}
-    candidate_result: Dict[str, bool] = {}
+    Each variant gets the same strict/fallback selection as calculate_improved_proxy.
+    """
+    masks = improved_proxy_masks(df, rules)
+    return {
+        name: _select_improved_proxy(masks, name, {**IMPROVED_PROXY_RULE, **overrides}, verbose=False)
+        for name, overrides in rules.items()
+    }
 
-    for _, row in df.iterrows():
-        patient = row["patient_code"]
-        has_late = False
-        for col in late_cols:
-            if pd.notna(row.get(col)):
-                has_late = True
-                break
 
-        candidate_result[patient] = has_late
-        if not has_late:
-            strict_result[patient] = False
-            continue
+def build_patient_tensor(kmr_long: pd.DataFrame, lab_long: pd.DataFrame,
+                         patient_codes: List[str] = None) -> PatientTensor:
+    """
+    Dense (n_patients, 21, 3) KMR/KRE/GFR tensor on the unified time grid
 
-        # KMR first/last
-        kmr_vals = [float(row.get(k)) for k in kmr_keys if pd.notna(row.get(k))]
-        first_kmr = kmr_vals[0] if kmr_vals else None
-        last_kmr = kmr_vals[-1] if kmr_vals else None
+    Missing measurements are NaN (tensor.mask gives the observed mask);
+    tensor.patient_index / tensor.time_index map codes and time keys to axes.
+    """
+    return PatientTensor.from_long(kmr_long, lab_long, patient_codes,
+                                   dtype=np.dtype(TENSOR_CONFIG["dtype"]))
 
-        kmr_improved = False
-        if last_kmr is not None:
-            kmr_improved = (
-                last_kmr < 0.5
-                or (first_kmr is not None and first_kmr > 0 and last_kmr <= first_kmr * 0.35)
-            )
 
-        # KRE first/last
-        kre_vals = [float(row.get(f"{k}_KRE")) for k in lab_keys if pd.notna(row.get(f"{k}_KRE"))]
-        first_kre = kre_vals[0] if kre_vals else None
-        last_kre = kre_vals[-1] if kre_vals else None
-        kre_improved = (
-            last_kre is None
-            or last_kre < 1.2
-            or (first_kre is not None and last_kre <= first_kre)
-        )
-
-        # GFR first/last
-        gfr_vals = [float(row.get(f"{k}_GFR")) for k in lab_keys if pd.notna(row.get(f"{k}_GFR"))]
-        first_gfr = gfr_vals[0] if gfr_vals else None
-        last_gfr = gfr_vals[-1] if gfr_vals else None
-        gfr_improved = (
-            last_gfr is None
-            or last_gfr >= 90
-            or (first_gfr is not None and last_gfr >= first_gfr)
-        )
-
-        strict_result[patient] = kmr_improved and kre_improved and gfr_improved
-
-    strict_count = sum(strict_result.values())
-    min_required = max(5, int(len(df) * 0.15))
+def file_digest(filepath: Path, chunk_size: int = 1 << 20) -> str:
+    """SHA-256 of a file's content"""
+    digest = hashlib.sha256()
+    with open(filepath, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
 
-    if strict_count < min_required:
-        print(
-            f"   Improved proxy strict cohort too small ({strict_count}); "
-            f"fallback to late-follow-up cohort ({sum(candidate_result.values())})"
-        )
-        return candidate_result
 
-    return strict_result
+def input_cache_key(filepath: Path = None) -> str:
+    """Cache key: workbook content hash + time mapping/proxy rule settings + cache format version"""
+    filepath = filepath or EXCEL_FILE
+    payload = json.dumps(
+        {
+            "workbook": file_digest(filepath),
+            "time_config": TIME_CONFIG,
+            "improved_proxy_rule": IMPROVED_PROXY_RULE,
+            "version": INPUT_CACHE_VERSION,
+        },
+        sort_keys=True,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:32]
+
+
+def _write_frame(df: pd.DataFrame, stem: Path) -> str:
+    """Write frame as Parquet when possible, pickle otherwise (e.g. mixed object columns)"""
+    if HAS_PARQUET:
+        try:
+            df.to_parquet(stem.with_suffix(".parquet"), index=False)
+            return "parquet"
+        except Exception:
+            pass
+    df.to_pickle(stem.with_suffix(".pkl"))
+    return "pickle"
+
 
+def _read_frame(stem: Path, fmt: str) -> pd.DataFrame:
+    if fmt == "parquet":
+        return pd.read_parquet(stem.with_suffix(".parquet"))
+    return pd.read_pickle(stem.with_suffix(".pkl"))
 
-def load_all_data() -> Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame, Dict[str, bool], pd.DataFrame]:
+
+def load_cached_input(cache_key: str, cache_dir: Path = None) -> Optional[tuple]:
+    """Load parsed input for cache_key; returns None on miss or unreadable entry"""
+    entry_dir = (cache_dir or INPUT_CACHE_DIR) / cache_key
+    manifest_path = entry_dir / "manifest.json"
+    if not manifest_path.exists():
+        return None
+
+    try:
+        with open(manifest_path, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+        frames = {
+            name: _read_frame(entry_dir / name, manifest["formats"][name])
+            for name in _CACHED_FRAMES
+        }
+        improved_proxy = {str(k): bool(v) for k, v in manifest["improved_proxy"].items()}
+    except Exception as e:
+        print(f"⚠️ Ignoring unreadable input cache {entry_dir.name}: {e}")
+        return None
+
+    return frames["meta_df"], frames["kmr_long"], frames["lab_long"], improved_proxy, frames["raw_df"]
+
+
+def load_cached_tensor(cache_key: str, cache_dir: Path = None) -> Optional[PatientTensor]:
+    """Load the cached patient tensor (memory-mapped for large cohorts); None on miss"""
+    tensor_dir = (cache_dir or INPUT_CACHE_DIR) / cache_key / "tensor"
+    if not (tensor_dir / "values.npy").exists():
+        return None
+
+    try:
+        tensor = PatientTensor.load(tensor_dir, mmap=True)
+        if len(tensor.patient_codes) < TENSOR_CONFIG["mmap_min_patients"]:
+            # Small cohorts: read into memory, the mapping is not worth keeping open
+            tensor = PatientTensor(np.array(tensor.values), tensor.patient_codes,
+                                   tensor.time_keys, tensor.metrics)
+        return tensor
+    except Exception as e:
+        print(f"⚠️ Ignoring unreadable tensor cache {cache_key}: {e}")
+        return None
+
+
+def store_cached_input(cache_key: str, meta_df: pd.DataFrame, kmr_long: pd.DataFrame,
+                       lab_long: pd.DataFrame, improved_proxy: Dict[str, bool],
+                       raw_df: pd.DataFrame, cache_dir: Path = None,
+                       tensor: PatientTensor = None) -> None:
+    """Persist parsed input under cache_key (written to a temp dir, then renamed)"""
+    cache_dir = cache_dir or INPUT_CACHE_DIR
+    entry_dir = cache_dir / cache_key
+    tmp_dir = cache_dir / f".{cache_key}.{os.getpid()}.tmp"
+
+    try:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        tmp_dir.mkdir(parents=True, exist_ok=True)
+
+        frames = {"meta_df": meta_df, "kmr_long": kmr_long, "lab_long": lab_long, "raw_df": raw_df}
+        formats = {name: _write_frame(df, tmp_dir / name) for name, df in frames.items()}
+        if tensor is not None:
+            tensor.save(tmp_dir / "tensor")
+
+        manifest = {
+            "cache_key": cache_key,
+            "version": INPUT_CACHE_VERSION,
+            "formats": formats,
+            "improved_proxy": {str(k): bool(v) for k, v in improved_proxy.items()},
+        }
+        with open(tmp_dir / "manifest.json", "w", encoding="utf-8") as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=2)
+
+        shutil.rmtree(entry_dir, ignore_errors=True)
+        tmp_dir.replace(entry_dir)
+    except Exception as e:
+        # Cache is an optimization only; never fail the load because of it
+        print(f"⚠️ Could not write input cache: {e}")
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+def load_all_data(filepath: Path = None, use_cache: bool = True
+                  ) -> Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame, Dict[str, bool], pd.DataFrame, PatientPanel]:
     """
     Load all data from Excel
     
+    Parsed results are cached (Parquet/pickle) under INPUT_CACHE_DIR keyed by the
+    workbook content hash and TIME_CONFIG, so repeat runs on unchanged data skip
+    read_excel, reshaping and the improved-proxy rules.
+    
     Returns:
         meta_df: Patient metadata
         kmr_long: KMR long format
         lab_long: LAB (KRE/GFR) long format
         improved_proxy: Dict of patient -> bool
         raw_df: Original wide dataframe
+        panel: PatientPanel over kmr_long/lab_long (O(1) per-patient slices);
+               panel.tensor is the dense patient x time x metric tensor
     """
-    df = load_excel()
-    
-    meta_df = extract_meta(df)
-    kmr_long = wide_to_long_kmr(df)
-    lab_long = wide_to_long_lab(df)
-    improved_proxy = calculate_improved_proxy(df)
-    
-    # Add improved_proxy to meta
-    meta_df["improved_proxy"] = meta_df["patient_code"].map(improved_proxy)
+    filepath = filepath or EXCEL_FILE
+    cache_key = input_cache_key(filepath) if use_cache else None
+    cached = load_cached_input(cache_key) if cache_key else None
+
+    tensor = None
+
+    if cached is not None:
+        meta_df, kmr_long, lab_long, improved_proxy, df = cached
+        tensor = load_cached_tensor(cache_key)
+        print(f"Input cache hit ({cache_key})")
+    else:
+        df = load_excel(filepath)
+        
+        meta_df = extract_meta(df)
+        kmr_long = wide_to_long_kmr(df)
+        lab_long = wide_to_long_lab(df)
+        improved_proxy = calculate_improved_proxy(df)
+        
+        # Add improved_proxy to meta
+        meta_df["improved_proxy"] = meta_df["patient_code"].map(improved_proxy)
+
+        if cache_key:
+            tensor = build_patient_tensor(kmr_long, lab_long)
+            store_cached_input(cache_key, meta_df, kmr_long, lab_long, improved_proxy, df, tensor=tensor)
     
     print(f"Loaded {len(meta_df)} patients")
     print(f"   KMR measurements: {len(kmr_long)}")
     print(f"   LAB measurements: {len(lab_long)}")
     print(f"   Improved proxy count: {sum(improved_proxy.values())}")
     
-    return meta_df, kmr_long, lab_long, improved_proxy, df
+    panel = PatientPanel(kmr_long, lab_long)
+    if tensor is not None and tensor.patient_codes == panel.patients:
+        panel.tensor = tensor
+    
+    return meta_df, kmr_long, lab_long, improved_proxy, df, panel
 
 
 if __name__ == "__main__":
-    meta, kmr, lab, improved, raw = load_all_data()
+    meta, kmr, lab, improved, raw, panel = load_all_data()
     print("\nKMR sample:")
     print(kmr.head(10))
     print("\nLAB sample:")
@@ -0,0 +1,163 @@
+"""
+Joint Model - One masked multi-output sequence model for KMR, KRE and GFR
+
+MODEL_CONFIG forecast_engine "joint": instead of a KMR model plus KRE/GFR
+models per patient, a single LSTM runs over every patient's unified grid
+(PatientTensor, 21 slots) and predicts all three metrics at each slot from
+the slots before it. Each metric is z-scored per patient, missing cells are
+zero-filled and flagged by an observed-mask input, and the loss only counts
+observed cells, so KMR-only and LAB-only slots train the same network. It is
+fitted once on the whole cohort and shared by KMRPredictor and LABPredictor.
+
+Status semantics follow the NumPy engine: the first measurement is copied
+(warmup_copy), later measured points are one-step-ahead predictions (ok),
+everything else is a forecast; before the first measurement the series mean
+is used. Intervals scale a cohort quantile of the absolute normalized
+residuals by each patient's spread.
+"""
+import time
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+
+from .config import MODEL_CONFIG
+from .forecast_engine import GridForecast
+from .patient_panel import TENSOR_METRICS, PatientPanel
+from .tf_backend import EarlyStopping, keras, layers, Model, set_random_seed
+from .time_mapping import UNIFIED_TIME_MAP
+
+# Same clinical thresholds as LABPredictor._winsorize_values
+WINSOR_LIMITS = {"kmr": (None, None), "kre": (None, 10.0), "gfr": (5.0, None)}
+# Relative (in-sample, forecast) half-widths where a patient has no spread estimate, as in the per-patient paths
+REL_BANDS = {"kmr": (0.15, 0.25), "kre": (0.15, 0.25), "gfr": (0.10, 0.15)}
+
+
+def masked_mse(y_true: Any, y_pred: Any) -> Any:
+    """MSE over observed cells; y_true packs (targets, observed mask) on the last axis"""
+    n_metrics = y_pred.shape[-1]
+    target, mask = y_true[..., :n_metrics], y_true[..., n_metrics:]
+    sq = keras.ops.square(y_pred - target) * mask
+    return keras.ops.sum(sq) / keras.ops.maximum(keras.ops.sum(mask), 1.0)
+
+
+class JointForecaster:
+    """Cohort-wide KMR/KRE/GFR forecaster on the unified grid (fitted once per panel)"""
+
+    def __init__(self, config: dict = None):
+        self.config = config or MODEL_CONFIG
+        self.params = self.config.get("joint_engine", {})
+        self.model: Any = None
+        self._panel: Optional[PatientPanel] = None
+        self._forecasts: Dict[str, GridForecast] = {}
+        self.train_seconds = 0.0
+
+    def _standardize(self, values: np.ndarray):
+        """Per patient/metric z-scores of (patients, time, metric) values (winsorized first)"""
+        values = values.copy()
+        for m, metric in enumerate(TENSOR_METRICS):
+            lower, upper = WINSOR_LIMITS[metric]
+            if lower is not None or upper is not None:
+                values[:, :, m] = np.clip(values[:, :, m], lower, upper)
+        observed = ~np.isnan(values)
+        counts = observed.sum(axis=1)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            mean = np.nansum(values, axis=1) / counts
+            std = np.sqrt(np.nansum((values - mean[:, None, :]) ** 2, axis=1) / counts)
+        # One measurement (or a flat series) has no spread: scale by a fraction of its level
+        fallback = np.maximum(0.1 * np.abs(np.nan_to_num(mean)), 1e-6)
+        scale = np.where((counts >= 2) & (std > 1e-6), std, fallback)
+        z = (values - mean[:, None, :]) / scale[:, None, :]
+        return values, observed, z, mean, scale
+
+    @staticmethod
+    def _inputs(z: np.ndarray, observed: np.ndarray, days: np.ndarray) -> np.ndarray:
+        """Step t sees the previous slot's z-scores (0 where missing), its mask and the gap to it"""
+        n_patients, n_time, _ = z.shape
+        prev_z = np.zeros_like(z)
+        prev_obs = np.zeros_like(z)
+        prev_z[:, 1:] = np.where(observed[:, :-1], z[:, :-1], 0.0)
+        prev_obs[:, 1:] = observed[:, :-1]
+        gaps = np.diff(days, prepend=days[0])
+        gap = np.broadcast_to((np.log1p(gaps) / np.log1p(gaps.max()))[None, :, None], (n_patients, n_time, 1))
+        return np.concatenate([prev_z, prev_obs, gap], axis=-1).astype(np.float32)
+
+    def _build_model(self, n_time: int, n_features: int, n_metrics: int) -> Any:
+        inputs = layers.Input(shape=(n_time, n_features))
+        x = layers.LSTM(int(self.params.get("units", 32)), return_sequences=True,
+                        dropout=float(self.params.get("dropout", 0.1)))(inputs)
+        x = layers.Dense(16, activation="relu")(x)
+        outputs = layers.Dense(n_metrics)(x)
+
+        model = Model(inputs, outputs)
+        model.compile(optimizer=keras.optimizers.Adam(float(self.params.get("learning_rate", 0.005))),
+                      loss=masked_mse)
+        return model
+
+    def fit(self, panel: PatientPanel) -> "JointForecaster":
+        """Train on every patient of the panel and forecast the whole grid (no-op if already fitted on it)"""
+        if self._panel is panel:
+            return self
+
+        tensor = panel.tensor
+        time_keys = tensor.time_keys
+        days = np.array([UNIFIED_TIME_MAP[tk]["pseudo_days"] for tk in time_keys], dtype=np.float64)
+        values, observed, z, mean, scale = self._standardize(tensor.values.astype(np.float64))
+        X = self._inputs(z, observed, days)
+        y = np.concatenate([np.where(observed, z, 0.0), observed], axis=-1).astype(np.float32)
+
+        n_metrics = len(TENSOR_METRICS)
+        print(f"🧠 Training joint KMR/KRE/GFR model on {len(X)} patients "
+              f"({int(observed.sum())} observed cells)...")
+        start = time.perf_counter()
+        set_random_seed(int(self.config.get("random_seed", 42)))
+        model = self._build_model(X.shape[1], X.shape[2], n_metrics)
+        callbacks = [EarlyStopping(monitor="loss", patience=int(self.params.get("patience", 15)),
+                                   restore_best_weights=True, verbose=0)]
+        model.fit(X, y, epochs=int(self.params.get("epochs", 300)),
+                  batch_size=min(int(self.params.get("batch_size", 8)), len(X)),
+                  callbacks=callbacks, verbose=0, shuffle=True)
+        z_hat = np.asarray(model.predict_on_batch(X), dtype=np.float64)
+        self.train_seconds = time.perf_counter() - start
+
+        self.model = model
+        self._panel = panel
+        self._forecasts = {
+            metric: self._grid_forecast(metric, values[:, :, m], observed[:, :, m], z[:, :, m],
+                                        z_hat[:, :, m], mean[:, m], scale[:, m])
+            for m, metric in enumerate(TENSOR_METRICS)
+        }
+        print(f"✅ Joint model trained in {self.train_seconds:.1f}s")
+        return self
+
+    def _grid_forecast(self, metric: str, values: np.ndarray, observed: np.ndarray, z: np.ndarray,
+                       z_hat: np.ndarray, mean: np.ndarray, scale: np.ndarray) -> GridForecast:
+        """Predictions, intervals and status of one metric on the (patients x time) grid"""
+        started = np.cumsum(observed, axis=1) > 0
+        first = observed & (np.cumsum(observed, axis=1) == 1)
+        no_history = ~started | first
+        ok = observed & ~no_history
+
+        pred = z_hat * scale[:, None] + mean[:, None]
+        pred = np.where(no_history, mean[:, None], pred)
+        pred = np.where(first, values, pred)
+        status = np.where(first, "warmup_copy", np.where(ok, "ok", "forecast")).astype(object)
+
+        in_band, out_band = REL_BANDS[metric]
+        abs_resid = np.abs(z - z_hat)[ok]
+        q = (float(np.quantile(abs_resid, float(self.params.get("interval_quantile", 0.9))))
+             if abs_resid.size else np.nan)
+        widen = float(self.params.get("forecast_widen", out_band / in_band))
+        half = q * scale[:, None] * np.where(observed, 1.0, widen)
+        rel = np.where(observed, in_band, out_band) * np.abs(pred)
+        half = np.where(np.isnan(half) | no_history, rel, half)
+        return GridForecast(pred=pred, lo=pred - half, hi=pred + half, status=status)
+
+    def forecast(self, panel: PatientPanel, patients: Sequence[str], metric: str,
+                 time_keys: List[str]) -> GridForecast:
+        """(patients x time_keys) block of one metric's forecast (fits on the panel first if needed)"""
+        self.fit(panel)
+        tensor = panel.tensor
+        index = np.ix_([tensor.patient_index[str(p)] for p in patients], tensor.time_slice(time_keys))
+        full = self._forecasts[metric]
+        return GridForecast(pred=full.pred[index], lo=full.lo[index], hi=full.hi[index],
+                            status=full.status[index])
@@ -3,32 +3,50 @@ KMR Model - LSTM prediction for KMR time series
 """
 import numpy as np
 import pandas as pd
+from bisect import bisect_left
 from typing import Dict, List, Tuple, Optional, TYPE_CHECKING, Any
 import warnings
 warnings.filterwarnings('ignore')
 
-try:
-    import tensorflow as tf
-    from tensorflow import keras
-    from tensorflow.keras import layers, Model
-    from tensorflow.keras.callbacks import EarlyStopping, ReduceLROnPlateau
-    HAS_TF = True
-except ImportError:
-    HAS_TF = False
-    Model = Any  # Type hint fallback when TensorFlow is not available
-    print("⚠️ TensorFlow not available, using simple prediction fallback")
+from .tf_backend import HAS_TF, tf, keras, layers, Model, EarlyStopping, ReduceLROnPlateau
 
 from .config import MODEL_CONFIG
 from .time_mapping import UNIFIED_TIME_MAP
+from .patient_panel import PatientPanel
+from .parallel_training import seed_patient, train_patients_parallel
+from .model_store import ModelStore, data_digest
+from .model_templates import ModelTemplateCache
+from .training_budget import COMPLEXITY_COST, TrainingBudget, combine_paths, fit_model
+from .uncertainty import mc_dropout_predict, use_mc_dropout
+from .windowing import sequence_windows
+from .forecast_engine import numpy_engine, resolve_engine, sanitize
+from .joint_model import JointForecaster
+from .feature_kernel import (FEATURE_COLUMNS, early_median_baseline, pad, series_features, split_frames,
+                             stack_frames, unpad)
 
 
 class KMRPredictor:
     """LSTM-based KMR prediction model"""
     
-    def __init__(self, config: dict = None):
+    FEATURE_COLS = ["kmr", "delta_from_baseline", "ratio_from_baseline", "ewma", "rolling_cv", "slope_short"]
+    
+    def __init__(self, config: dict = None, model_store: Optional[ModelStore] = None,
+                 joint: Optional[JointForecaster] = None):
         self.config = config or MODEL_CONFIG
         self.models: Dict[str, Any] = {}  # Model type when TF available
         self.scalers: Dict[str, dict] = {}
+        self.model_store = model_store  # Reuse weights of patients whose data did not change
+        self.global_model: Any = None  # Shared model in "global" mode
+        self.joint = joint  # Cohort-wide forecaster of the "joint" engine (may be shared with LABPredictor)
+        template_config = self.config.get("model_templates", {})
+        self.templates = (ModelTemplateCache(template_config.get("max_templates", 16))
+                          if template_config.get("enabled", False) else None)
+        self.budget: Optional[TrainingBudget] = None  # Set by train_patients for one run
+        self._fit_paths: List[str] = []  # train_path of each model fitted for the current patient
+    
+    def _use_numpy_engine(self) -> bool:
+        """MODEL_CONFIG forecast_engine (keras runs the NumPy engine when TensorFlow is missing)"""
+        return resolve_engine(self.config, HAS_TF) == "numpy"
     
     def _determine_complexity(self, n_points: int) -> str:
         """Determine model complexity based on data points"""
@@ -60,38 +78,28 @@ class KMRPredictor:
         
         Input: DataFrame with columns [time_order, pseudo_time_days, kmr]
         """
-        df = kmr_series.sort_values("time_order").copy()
+        return self.batch_feature_engineering([kmr_series])[0]
+    
+    def batch_feature_engineering(self, kmr_frames: List[pd.DataFrame]) -> List[pd.DataFrame]:
+        """
+        Feature engineering for many KMR series at once
+        
+        All series are padded into one array and run through feature_kernel; each
+        returned frame equals the per-patient pandas/polyfit computation.
+        """
+        if not kmr_frames:
+            return []
+        long_df, lengths = stack_frames(kmr_frames)
+        values = pad(long_df["kmr"].to_numpy(dtype=np.float64), lengths)
+        days = pad(long_df["pseudo_time_days"].to_numpy(dtype=np.float64), lengths)
         
         # Baseline (first week values, ~48h proxy)
-        early_mask = df["pseudo_time_days"] <= 7
-        baseline = df.loc[early_mask, "kmr"].median() if early_mask.any() else df["kmr"].iloc[0]
-        
-        # Delta and ratio from baseline
-        df["delta_from_baseline"] = df["kmr"] - baseline
-        df["ratio_from_baseline"] = df["kmr"] / (baseline + 1e-6)
-        
-        # EWMA
-        df["ewma"] = df["kmr"].ewm(span=3, min_periods=1).mean()
-        
-        # Rolling CV (coefficient of variation)
-        rolling_std = df["kmr"].rolling(window=3, min_periods=1).std()
-        rolling_mean = df["kmr"].rolling(window=3, min_periods=1).mean()
-        df["rolling_cv"] = rolling_std / (rolling_mean + 1e-6)
-        
-        # Short-term slope (last 3 points)
-        df["slope_short"] = 0.0
-        if len(df) >= 3:
-            for i in range(2, len(df)):
-                y = df["kmr"].iloc[i-2:i+1].values
-                x = np.arange(3)
-                if len(y) == 3:
-                    slope = np.polyfit(x, y, 1)[0]
-                    df.iloc[i, df.columns.get_loc("slope_short")] = slope
-        
-        # Fill NaN
-        df = df.fillna(0)
-        
-        return df
+        baseline = early_median_baseline(values, days <= 7)
+        features = series_features(values, baseline, slope_min_points=3)
+        
+        for col in FEATURE_COLUMNS:
+            long_df[col] = unpad(features[col], lengths)
+        return split_frames(long_df.fillna(0), lengths)
     
     def _build_simple_model(self, seq_len: int, n_features: int) -> Any:
         """Build simple GRU model for small datasets"""
@@ -129,26 +137,58 @@ class KMRPredictor:
         model.compile(optimizer=keras.optimizers.Adam(0.001), loss="mse")
         return model
     
+    def _build_model(self, complexity: str, seq_len: int, n_features: int) -> Any:
+        """Per-patient model for `complexity`, from the template cache when enabled"""
+        builder = {
+            "simple": self._build_simple_model,
+            "medium": self._build_medium_model,
+            "complex": self._build_complex_model,
+        }[complexity]
+        if self.templates is None:
+            return builder(seq_len, n_features)
+        return self.templates.get((f"kmr_{complexity}", seq_len, n_features),
+                                  lambda: builder(seq_len, n_features))
+    
+    def _build_global_model(self, seq_len: int, n_features: int) -> Any:
+        """Build shared LSTM model trained on windows from every patient"""
+        inputs = layers.Input(shape=(seq_len, n_features))
+        x = layers.LSTM(64, return_sequences=True, dropout=0.15)(inputs)
+        x = layers.LSTM(32, dropout=0.15)(x)
+        x = layers.Dense(16, activation="relu")(x)
+        outputs = layers.Dense(1)(x)
+        
+        model = Model(inputs, outputs)
+        model.compile(optimizer=keras.optimizers.Adam(0.001), loss="mse")
+        return model
+    
+    def _normalized_features(self, kmr_df: pd.DataFrame,
+                             features_df: Optional[pd.DataFrame] = None) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Engineered features normalized per patient: (features_norm, mean, std)"""
+        if features_df is None:
+            features_df = self._feature_engineering(kmr_df)
+        features = features_df[self.FEATURE_COLS].values
+        mean = features.mean(axis=0)
+        std = features.std(axis=0) + 1e-6
+        return (features - mean) / std, mean, std
+    
     def _prepare_sequences(self, features: np.ndarray, seq_len: int) -> Tuple[np.ndarray, np.ndarray]:
         """Prepare sequences for training"""
-        X, y = [], []
-        for i in range(len(features) - seq_len):
-            X.append(features[i:i+seq_len])
-            y.append(features[i+seq_len, 0])  # Target is kmr (first column)
-        return np.array(X), np.array(y)
+        X, targets = sequence_windows(features, seq_len)
+        return X, features[targets, 0]  # Target is kmr (first column)
     
-    def train_patient_model(self, patient_code: str, kmr_df: pd.DataFrame) -> Optional[dict]:
+    def train_patient_model(self, patient_code: str, kmr_df: pd.DataFrame,
+                            features_df: Optional[pd.DataFrame] = None) -> Optional[dict]:
         """
         Train model for a single patient
         
+        features_df: precomputed _feature_engineering(kmr_df) (see batch_feature_engineering)
         Returns dict with predictions and residuals
         """
-        if not HAS_TF:
-            return self._simple_prediction(kmr_df)
+        if self._use_numpy_engine():
+            return self.bulk_forecast(PatientPanel(kmr_long=kmr_df.assign(patient_code=patient_code)),
+                                      [patient_code])[patient_code]
         
-        # Feature engineering
-        features_df = self._feature_engineering(kmr_df)
-        n_points = len(features_df)
+        n_points = len(kmr_df)
         
         if n_points < 5:
             return self._simple_prediction(kmr_df)
@@ -157,14 +197,8 @@ class KMRPredictor:
         complexity = self._determine_complexity(n_points)
         seq_len = self._calculate_seq_len(n_points)
         
-        # Feature columns
-        feature_cols = ["kmr", "delta_from_baseline", "ratio_from_baseline", "ewma", "rolling_cv", "slope_short"]
-        features = features_df[feature_cols].values
-        
-        # Normalize
-        mean = features.mean(axis=0)
-        std = features.std(axis=0) + 1e-6
-        features_norm = (features - mean) / std
+        # Feature engineering + per-patient normalization
+        features_norm, mean, std = self._normalized_features(kmr_df, features_df)
         
         self.scalers[patient_code] = {"mean": mean, "std": std}
         
@@ -178,29 +212,33 @@ class KMRPredictor:
             return self._simple_prediction(kmr_df)
         
         # Build model
-        n_features = len(feature_cols)
-        if complexity == "simple":
-            model = self._build_simple_model(seq_len, n_features)
-        elif complexity == "medium":
-            model = self._build_medium_model(seq_len, n_features)
-        else:
-            model = self._build_complex_model(seq_len, n_features)
+        model = self._build_model(complexity, seq_len, len(self.FEATURE_COLS))
         
-        # Callbacks
-        callbacks = [
-            EarlyStopping(patience=5, restore_best_weights=True, verbose=0),
-            ReduceLROnPlateau(factor=0.7, patience=3, min_lr=0.0001, verbose=0)
-        ]
+        # Unchanged patient: reload stored weights + scaler instead of retraining
+        store_key, stored_scaler = None, None
+        if self.model_store is not None:
+            store_key = self.model_store.key("kmr", patient_code, data_digest(X, y), complexity, seq_len)
+            stored_scaler = self.model_store.load(store_key, model)
         
-        # Train
-        try:
-            model.fit(X, y, epochs=50, batch_size=min(8, len(X)), 
-                     validation_split=0.2, callbacks=callbacks, verbose=0, shuffle=False)
-        except Exception as e:
-            print(f"⚠️ Training failed for {patient_code}: {e}")
-            return self._simple_prediction(kmr_df)
+        if stored_scaler is not None:
+            self.scalers[patient_code] = stored_scaler
+            self._fit_paths.append("model_store")
+        else:
+            # Train (early stopping; epochs/time capped by the training budget, if any)
+            try:
+                self._fit_paths.append(fit_model(model, X, y, self.budget))
+            except Exception as e:
+                print(f"⚠️ Training failed for {patient_code}: {e}")
+                return self._simple_prediction(kmr_df)
+            
+            # Fits cut short by the budget (keras_budget / keras_plateau) are not final weights:
+            # storing them would let a later unbudgeted run reload them as fully trained
+            if store_key is not None and self._fit_paths[-1] == "keras":
+                self.model_store.save(store_key, model, self.scalers[patient_code])
         
-        self.models[patient_code] = model
+        if self.templates is None:
+            # Templates are shared across patients; only keep models owned by one patient
+            self.models[patient_code] = model
         
         # Generate predictions for unified grid (order 1-22, has_kmr=True)
         # Unified grid için forecast üret
@@ -265,77 +303,78 @@ class KMRPredictor:
         ]
         
         # Create lookup for actual KMR values and features by time_order
-        kmr_lookup = {}
-        order_to_idx = {}  # Map time_order to features_norm index
-        for i, (_, row) in enumerate(kmr_df.iterrows()):
-            order = row.get("time_order")
-            if order is not None:
-                kmr_lookup[order] = row.get("kmr")
-                if i < len(features_norm):
-                    order_to_idx[order] = i
+        # (row position in kmr_df order, as before; later duplicates win)
+        orders = kmr_df["time_order"].tolist()
+        kmr_lookup = dict(zip(orders, kmr_df["kmr"].tolist()))
+        order_to_idx = {order: i for i, order in enumerate(orders) if i < len(features_norm)}
+        known_orders = sorted(order_to_idx)
         
-        predictions = []
-        forecast_features = None  # For forecast beyond last data point
+        def last_known_before(time_order: int) -> Optional[int]:
+            pos = bisect_left(known_orders, time_order)
+            return known_orders[pos - 1] if pos > 0 else None
+        
+        # Pass 1: decide every grid point and collect the model windows it needs
+        plan = []           # (time_key, time_order, actual_kmr, kind, value)
+        window_starts = []  # start index into features_norm, one per model call
+        seen_data = False   # a grid point with actual data has been passed
         
-        # Generate predictions for unified grid (order 1-22)
         for time_key in unified_kmr_time_keys:
-            info = UNIFIED_TIME_MAP[time_key]
-            time_order = info["order"]
-            
-            # Check if we have actual data for this time point
+            time_order = UNIFIED_TIME_MAP[time_key]["order"]
             actual_kmr = kmr_lookup.get(time_order)
             idx = order_to_idx.get(time_order)
             
-            if idx is not None and idx < len(features_norm):
+            if idx is not None:
                 # We have actual data - use model prediction
-                features_vec = features_norm[idx]
-                forecast_features = features_vec  # Update for future forecasts
-                
+                seen_data = True
                 if idx >= seq_len and len(features_norm) > seq_len:
-                    # Use model
-                    seq = features_norm[idx-seq_len:idx].reshape(1, seq_len, -1)
-                    pred_norm = model.predict(seq, verbose=0)[0, 0]
-                    pred = pred_norm * kmr_std + kmr_mean
-                    pred_status = "ok"
+                    plan.append((time_key, time_order, actual_kmr, "ok", len(window_starts)))
+                    window_starts.append(idx - seq_len)
+                elif actual_kmr is not None:
+                    # Not enough history, use actual value
+                    plan.append((time_key, time_order, actual_kmr, "warmup_copy", actual_kmr))
                 else:
-                    # Not enough history, use actual value or simple extrapolation
-                    if actual_kmr is not None:
-                        pred = actual_kmr
-                        pred_status = "warmup_copy"
-                    else:
-                        pred = features_vec[0] * kmr_std + kmr_mean
-                        pred_status = "warmup_bootstrap"
-            else:
+                    pred = features_norm[idx][0] * kmr_std + kmr_mean
+                    plan.append((time_key, time_order, actual_kmr, "warmup_bootstrap", pred))
+            elif seen_data and len(features_norm) >= seq_len:
                 # Forecast: no actual data, use model with last known sequence
-                if forecast_features is not None and len(features_norm) >= seq_len:
-                    # Use last known sequence for multi-step forecast
-                    # Find last known index
-                    last_idx = None
-                    for o in sorted(order_to_idx.keys(), reverse=True):
-                        if o < time_order:
-                            last_idx = order_to_idx[o]
-                            break
-                    
-                    if last_idx is not None and last_idx >= seq_len - 1:
-                        # Use last seq_len features for forecast
-                        seq = features_norm[last_idx-seq_len+1:last_idx+1].reshape(1, seq_len, -1)
-                        pred_norm = model.predict(seq, verbose=0)[0, 0]
-                        pred = pred_norm * kmr_std + kmr_mean
-                    else:
-                        # Fallback: use last known KMR value or mean
-                        last_kmr = None
-                        for o in sorted(kmr_lookup.keys(), reverse=True):
-                            if o < time_order:
-                                last_kmr = kmr_lookup[o]
-                                break
-                        pred = last_kmr if last_kmr is not None else kmr_mean
+                last_order = last_known_before(time_order)
+                last_idx = order_to_idx[last_order] if last_order is not None else None
+                if last_idx is not None and last_idx >= seq_len - 1:
+                    plan.append((time_key, time_order, actual_kmr, "forecast", len(window_starts)))
+                    window_starts.append(last_idx - seq_len + 1)
                 else:
-                    # No history, use mean
-                    pred = kmr_mean
-                pred_status = "forecast"
+                    # Fallback: use last known KMR value or mean
+                    last_kmr = kmr_lookup[last_order] if last_order is not None else None
+                    pred = last_kmr if last_kmr is not None else kmr_mean
+                    plan.append((time_key, time_order, actual_kmr, "forecast_value", pred))
+            else:
+                # No history, use mean
+                plan.append((time_key, time_order, actual_kmr, "forecast_value", kmr_mean))
+        
+        # Pass 2: all in-sample and forecast windows in one batched model call
+        # (MC dropout: the deterministic pass and every dropout sample in that one call)
+        windows = self._windows(features_norm, window_starts, seq_len)
+        mc_dropout = use_mc_dropout(self.config) and len(windows) > 0
+        if mc_dropout:
+            model_preds, mc_lo, mc_hi = (a[:, 0] * kmr_std + kmr_mean
+                                         for a in mc_dropout_predict(model, windows, self.config))
+        else:
+            model_preds = self._predict_windows(model, windows) * kmr_std + kmr_mean
+        
+        predictions = []
+        for time_key, time_order, actual_kmr, kind, value in plan:
+            if kind in ("ok", "forecast"):
+                pred = model_preds[value]
+            else:
+                pred = value
+            pred_status = "forecast" if kind.startswith("forecast") else kind
             
             # Confidence intervals (wider for forecasts)
-            if actual_kmr is None:
+            if mc_dropout and kind in ("ok", "forecast"):
+                # MC dropout quantiles, widened to contain the deterministic prediction
+                pred_lo = min(mc_lo[value], pred)
+                pred_hi = max(mc_hi[value], pred)
+            elif actual_kmr is None:
                 # Forecast: wider confidence interval
                 pred_lo = pred * 0.75
                 pred_hi = pred * 1.25
@@ -361,6 +400,22 @@ class KMRPredictor:
         
         return predictions
     
+    @staticmethod
+    def _windows(features_norm: np.ndarray, window_starts: List[int], seq_len: int) -> np.ndarray:
+        """(n_windows, seq_len, n_features) float32 windows starting at window_starts"""
+        if not window_starts:
+            return np.empty((0, seq_len, features_norm.shape[1]), dtype=np.float32)
+        idx = np.asarray(window_starts)[:, None] + np.arange(seq_len)
+        return features_norm[idx].astype(np.float32)
+    
+    @staticmethod
+    def _predict_windows(model: Any, windows: np.ndarray) -> np.ndarray:
+        """Run all windows through the model at once"""
+        if len(windows) == 0:
+            return np.empty(0)
+        # predict_on_batch: one compiled call, none of predict()'s per-call setup
+        return np.asarray(model.predict_on_batch(windows)).reshape(-1)
+    
     def _simple_prediction(self, kmr_df: pd.DataFrame) -> dict:
         """Simple prediction for unified grid (order 1-22, has_kmr=True)"""
         # Get unified time keys with KMR data (has_kmr=True)
@@ -424,32 +479,226 @@ class KMRPredictor:
             "seq_len": 0
         }
     
-    def bulk_train(self, kmr_long: pd.DataFrame) -> Dict[str, dict]:
-        """Train models for all patients"""
-        results = {}
-        patients = kmr_long["patient_code"].unique()
+    def bulk_train(self, kmr_long: pd.DataFrame, panel: PatientPanel = None,
+                   patients: Optional[List[str]] = None, workers: int = 1,
+                   budget: Optional[TrainingBudget] = None) -> Dict[str, dict]:
+        """
+        Train models for all patients (or only `patients`, e.g. the dirty ones of an incremental run)
+        
+        Each patient is trained under its own seed (parallel_training.patient_seed), so
+        workers > 1 shards patients across processes with the same results.
+        budget: wall-clock TrainingBudget for the per-patient models (see train_patients).
+        """
+        if panel is None:
+            panel = PatientPanel(kmr_long=kmr_long)
+        wanted = None if patients is None else set(patients)
+        patients = [p for p in panel.kmr_patients if wanted is None or p in wanted]
+        
+        if self._use_numpy_engine():
+            print(f"🧮 Forecasting KMR for {len(patients)} patients with the NumPy engine...")
+            return self.bulk_forecast(panel, patients)
+        
+        if resolve_engine(self.config, HAS_TF) == "joint":
+            self.joint = self.joint or JointForecaster(self.config)
+            return self.bulk_forecast(panel, patients, joint=self.joint)
+        
+        if self.config.get("kmr_model_mode", "per_patient") == "global":
+            return self.bulk_train_global(panel, patients)
         
         print(f"🧠 Training KMR models for {len(patients)} patients...")
         
+        if workers > 1 and HAS_TF and len(patients) > 1:
+            costs = {p: self.training_cost(panel.kmr(p)) for p in patients}
+            results = train_patients_parallel("kmr", self.config, panel, patients, workers,
+                                              self.model_store, budget, costs)
+        else:
+            results = self.train_patients(panel, patients, budget=budget)
+        
+        print(f"✅ All KMR models trained")
+        return results
+    
+    def training_cost(self, kmr_df: pd.DataFrame) -> float:
+        """Relative training cost (windows x complexity) used to share a training budget; 0 = no model"""
+        n_points = len(kmr_df)
+        seq_len = self._calculate_seq_len(n_points)
+        if n_points < 5 or n_points - seq_len < 2:
+            return 0.0
+        return (n_points - seq_len) * COMPLEXITY_COST[self._determine_complexity(n_points)]
+    
+    def train_patients(self, panel: PatientPanel, patients: List[str], report_every: int = 10,
+                       budget: Optional[TrainingBudget] = None) -> Dict[str, dict]:
+        """
+        Train `patients` one after another in this process (features computed in one batch)
+        
+        With a budget, patients whose training no longer fits get the NumPy engine;
+        every result records its "train_path".
+        """
+        patient_dfs = [panel.kmr(patient).copy() for patient in patients]
+        features = self.batch_feature_engineering(patient_dfs)
+        costs = [self.training_cost(df) for df in patient_dfs]
+        if budget is not None:
+            budget.plan(costs)
+        
+        results, over_budget = {}, []
+        self.budget = budget
+        try:
+            for i, patient in enumerate(patients):
+                seed_patient(self.config, patient)
+                if budget is not None and not budget.begin(costs[i]):
+                    over_budget.append(patient)
+                    continue
+                self._fit_paths = []
+                result = self.train_patient_model(patient, patient_dfs[i], features[i])
+                if budget is not None:
+                    budget.end()
+                if result is not None:
+                    result.setdefault("train_path", combine_paths(self._fit_paths))
+                results[patient] = result
+                
+                if report_every and (i + 1) % report_every == 0:
+                    print(f"   Trained {i+1}/{len(patients)} models")
+        finally:
+            self.budget = None
+        
+        if over_budget:
+            print(f"   Training budget used up: {len(over_budget)} patients fall back to the NumPy engine")
+            for patient, result in self.bulk_forecast(panel, over_budget).items():
+                result["train_path"] = "budget_fallback"
+                results[patient] = result
+        return {p: results[p] for p in patients}
+    
+    def bulk_forecast(self, panel: PatientPanel, patients: List[str],
+                      joint: Optional[JointForecaster] = None) -> Dict[str, dict]:
+        """
+        Forecast every patient's unified KMR grid with the NumPy engine in one pass
+        
+        Same prediction dicts as the Keras path: first measurement is copied
+        (warmup_copy), later measured points get one-step-ahead predictions (ok),
+        unmeasured points are forecasts. With `joint`, the grid forecast comes
+        from the cohort-wide JointForecaster instead (fitted on the panel on first use).
+        """
+        grid_keys = [
+            tk for tk, info in sorted(UNIFIED_TIME_MAP.items(), key=lambda x: x[1]["order"])
+            if info.get("has_kmr", False)
+        ]
+        tensor = panel.tensor
+        rows = [tensor.patient_index[str(p)] for p in patients]
+        values = tensor.metric("kmr")[np.ix_(rows, tensor.time_slice(grid_keys))].astype(np.float64)
+        
+        if joint is None:
+            forecast = numpy_engine(self.config).forecast(values, rel_band=(0.15, 0.25))
+            complexity, train_path = "local_level", "numpy"
+        else:
+            forecast = joint.forecast(panel, patients, "kmr", grid_keys)
+            complexity, train_path = "joint", "joint"
+        pred, pred_lo, pred_hi = sanitize(forecast.pred, forecast.lo, forecast.hi, 0.0, 100.0)
+        residual = values - pred
+        
+        orders = [UNIFIED_TIME_MAP[tk]["order"] for tk in grid_keys]
+        pred, pred_lo, pred_hi, residual = (
+            np.where(np.isnan(a), None, np.round(a, 4)).tolist() for a in (pred, pred_lo, pred_hi, residual)
+        )
+        status = forecast.status.tolist()
+        
+        results = {}
         for i, patient in enumerate(patients):
-            patient_df = kmr_long[kmr_long["patient_code"] == patient].copy()
-            result = self.train_patient_model(patient, patient_df)
-            results[patient] = result
+            results[patient] = {
+                "predictions": [
+                    {
+                        "time_order": orders[j],
+                        "time_key": grid_keys[j],
+                        "kmr_pred": pred[i][j],
+                        "kmr_pred_lo": pred_lo[i][j],
+                        "kmr_pred_hi": pred_hi[i][j],
+                        "kmr_pred_status": status[i][j],
+                        "residual": residual[i][j],
+                    }
+                    for j in range(len(grid_keys))
+                ],
+                "complexity": complexity,
+                "seq_len": 0,
+                "train_path": train_path,
+            }
+        return results
+    
+    def bulk_train_global(self, panel: PatientPanel, patients: Optional[List[str]] = None) -> Dict[str, dict]:
+        """
+        Train one shared model on windows from every KMR patient, then predict per patient.
+        
+        Each patient's features keep their own normalization, so the network learns
+        trajectory shape rather than absolute level. The model is always fitted on the
+        whole panel; `patients` only limits which predictions are returned.
+        """
+        if not HAS_TF:
+            return {p: self._simple_prediction(panel.kmr(p)) for p in (patients or panel.kmr_patients)}
+        
+        seq_len = int(self.config.get("global_seq_len", self.config["seq_len_min"]))
+        patients = panel.kmr_patients if patients is None else patients
+        
+        # Pool windows from every patient with enough history
+        prepared = {}
+        X_parts, y_parts = [], []
+        eligible = [p for p in panel.kmr_patients if len(panel.kmr(p)) >= 5 and len(panel.kmr(p)) > seq_len + 1]
+        kmr_dfs = [panel.kmr(patient).copy() for patient in eligible]
+        for patient, kmr_df, features_df in zip(eligible, kmr_dfs, self.batch_feature_engineering(kmr_dfs)):
+            features_norm, mean, std = self._normalized_features(kmr_df, features_df)
+            X_p, y_p = self._prepare_sequences(features_norm, seq_len)
+            prepared[patient] = (kmr_df, features_norm, mean, std)
+            X_parts.append(X_p)
+            y_parts.append(y_p)
+        
+        print(f"🧠 Training global KMR model on {sum(len(x) for x in X_parts)} windows "
+              f"from {len(prepared)} patients...")
+        
+        model = None
+        if X_parts and sum(len(x) for x in X_parts) >= 2:
+            X = np.concatenate(X_parts)
+            y = np.concatenate(y_parts)
+            # Shuffle so the validation split is not just the last patients
+            order = np.random.default_rng(self.config.get("random_seed", 42)).permutation(len(X))
+            X, y = X[order], y[order]
             
-            if (i + 1) % 10 == 0:
-                print(f"   Trained {i+1}/{len(patients)} models")
+            model = self._build_global_model(seq_len, len(self.FEATURE_COLS))
+            callbacks = [
+                EarlyStopping(patience=5, restore_best_weights=True, verbose=0),
+                ReduceLROnPlateau(factor=0.7, patience=3, min_lr=0.0001, verbose=0)
+            ]
+            try:
+                model.fit(X, y, epochs=50, batch_size=min(int(self.config.get("global_batch_size", 32)), len(X)),
+                          validation_split=0.2, callbacks=callbacks, verbose=0, shuffle=True)
+            except Exception as e:
+                print(f"⚠️ Global KMR training failed: {e}")
+                model = None
+        
+        self.global_model = model
         
-        print(f"✅ All KMR models trained")
+        results = {}
+        for patient in patients:
+            if model is None or patient not in prepared:
+                results[patient] = self._simple_prediction(panel.kmr(patient).copy())
+                continue
+            kmr_df, features_norm, mean, std = prepared[patient]
+            self.scalers[patient] = {"mean": mean, "std": std}
+            results[patient] = {
+                "predictions": self._generate_predictions_unified_grid(
+                    model, features_norm, seq_len, mean[0], std[0], kmr_df
+                ),
+                "complexity": "global",
+                "seq_len": seq_len,
+                "train_path": "global"
+            }
+        
+        print(f"✅ Global KMR model trained, predictions for {len(results)} patients")
         return results
 
 
 if __name__ == "__main__":
     from io_excel import load_all_data
     
-    meta, kmr_long, lab_long, improved, raw = load_all_data()
+    meta, kmr_long, lab_long, improved, raw, panel = load_all_data()
     
     predictor = KMRPredictor()
-    results = predictor.bulk_train(kmr_long)
+    results = predictor.bulk_train(kmr_long, panel)
     
     print("\nSample result:")
     sample_patient = list(results.keys())[0]
@@ -1,5 +1,12 @@
 """
 LAB Anomaly Detection - VAE for KRE/GFR anomaly scoring
+
+KRE and GFR are scored on each patient's measured values in time order, by
+the reconstruction error of the window ending at each point. bulk_score
+gathers the windows of every patient per metric and runs each autoencoder
+once for the whole cohort (windows from backend/windowing.py). update()
+scores a single newly arrived LAB row in O(window) from per-patient running
+statistics, like KMRAnomalyDetector.update.
 """
 import numpy as np
 import pandas as pd
@@ -7,16 +14,14 @@ from typing import Dict, List, Optional
 import warnings
 warnings.filterwarnings('ignore')
 
-try:
-    import tensorflow as tf
-    from tensorflow import keras
-    from tensorflow.keras import layers, Model
-    HAS_TF = True
-except ImportError:
-    HAS_TF = False
+from .tf_backend import HAS_TF, tf, keras, layers, Model
 
 from .config import ANOMALY_CONFIG
-from .time_mapping import UNIFIED_TIME_MAP
+from .time_mapping import UNIFIED_TIME_MAP, get_lab_time_info
+from .patient_panel import PatientPanel
+from .anomaly_vae import reconstruction_errors
+from .feature_kernel import stack_frames
+from .windowing import RunningSeries, paired_training_windows, point_windows, training_windows, zscore
 
 
 class LABAnomalyDetector:
@@ -28,6 +33,7 @@ class LABAnomalyDetector:
         self.thresholds: Dict[str, float] = {}
         self.global_threshold_kre: float = 0.0
         self.global_threshold_gfr: float = 0.0
+        self._streams: Dict[tuple, RunningSeries] = {}
     
     def _build_vae(self, input_dim: int, latent_dim: int = 4) -> tuple:
         """Build simple VAE encoder/decoder"""
@@ -82,41 +88,7 @@ class LABAnomalyDetector:
         
         return autoencoder, encoder, None
     
-    def _prepare_windows(self, series: np.ndarray, window_size: int = 5) -> np.ndarray:
-        """Prepare sliding windows from series"""
-        if len(series) < window_size:
-            pad_size = window_size - len(series)
-            padding = np.full(pad_size, np.nanmean(series))
-            series = np.concatenate([padding, series])
-        
-        windows = []
-        for i in range(len(series) - window_size + 1):
-            windows.append(series[i:i+window_size])
-        
-        return np.array(windows)
-    
-    def _prepare_multi_windows(self, kre_series: np.ndarray, gfr_series: np.ndarray, 
-                               window_size: int = 5) -> np.ndarray:
-        """Prepare multi-variable windows"""
-        # Pad if needed
-        max_len = max(len(kre_series), len(gfr_series))
-        if len(kre_series) < max_len:
-            kre_series = np.pad(kre_series, (0, max_len - len(kre_series)), 
-                               constant_values=np.nanmean(kre_series))
-        if len(gfr_series) < max_len:
-            gfr_series = np.pad(gfr_series, (0, max_len - len(gfr_series)), 
-                               constant_values=np.nanmean(gfr_series))
-        
-        windows = []
-        for i in range(max_len - window_size + 1):
-            kre_window = kre_series[i:i+window_size]
-            gfr_window = gfr_series[i:i+window_size]
-            combined = np.concatenate([kre_window, gfr_window])
-            windows.append(combined)
-        
-        return np.array(windows)
-    
-    def fit_global(self, lab_long: pd.DataFrame) -> None:
+    def fit_global(self, lab_long: pd.DataFrame, panel: PatientPanel = None) -> None:
         """Fit global VAE on all patient data"""
         if not HAS_TF:
             self._fit_simple_threshold(lab_long)
@@ -124,66 +96,39 @@ class LABAnomalyDetector:
         
         print("🔍 Training global LAB anomaly detector...")
         
-        # Collect windows for KRE and GFR
-        all_kre_windows = []
-        all_gfr_windows = []
-        all_multi_windows = []
         window_size = 5
         
-        for patient in lab_long["patient_code"].unique():
-            patient_df = lab_long[lab_long["patient_code"] == patient].sort_values("time_order")
-            
-            # Extract KRE and GFR values
-            kre_values = patient_df["kre"].dropna().values
-            gfr_values = patient_df["gfr"].dropna().values
-            
-            kre_values = np.array([v for v in kre_values if v is not None and not np.isnan(v)])
-            gfr_values = np.array([v for v in gfr_values if v is not None and not np.isnan(v)])
-            
-            # Single-variable windows
-            if len(kre_values) >= 3:
-                mean_val = float(np.nanmean(kre_values))
-                std_val = float(np.nanstd(kre_values)) + 1e-6
-                normalized = (kre_values - mean_val) / std_val
-                normalized = np.nan_to_num(normalized, nan=0.0)
-                windows = self._prepare_windows(normalized, window_size)
-                for w in windows:
-                    if not np.any(np.isnan(w)):
-                        all_kre_windows.append(w.astype(np.float32))
-            
-            if len(gfr_values) >= 3:
-                mean_val = float(np.nanmean(gfr_values))
-                std_val = float(np.nanstd(gfr_values)) + 1e-6
-                normalized = (gfr_values - mean_val) / std_val
-                normalized = np.nan_to_num(normalized, nan=0.0)
-                windows = self._prepare_windows(normalized, window_size)
-                for w in windows:
-                    if not np.any(np.isnan(w)):
-                        all_gfr_windows.append(w.astype(np.float32))
-            
-            # Multi-variable windows (both KRE and GFR)
-            if len(kre_values) >= 3 and len(gfr_values) >= 3:
-                kre_mean = float(np.nanmean(kre_values))
-                kre_std = float(np.nanstd(kre_values)) + 1e-6
-                gfr_mean = float(np.nanmean(gfr_values))
-                gfr_std = float(np.nanstd(gfr_values)) + 1e-6
-                
-                kre_norm = np.nan_to_num((kre_values - kre_mean) / kre_std, nan=0.0)
-                gfr_norm = np.nan_to_num((gfr_values - gfr_mean) / gfr_std, nan=0.0)
-                
-                windows = self._prepare_multi_windows(kre_norm, gfr_norm, window_size)
-                for w in windows:
-                    if not np.any(np.isnan(w)):
-                        all_multi_windows.append(w.astype(np.float32))
+        if panel is None:
+            panel = PatientPanel(lab_long=lab_long)
+        # KRE/GFR of every patient on the unified LAB grid (time order), one aligned pass;
+        # each metric's measured values concatenated patient by patient
+        kre_grid, gfr_grid = panel.lab_grid()
+        series = {}
+        for metric, grid in (("kre", kre_grid), ("gfr", gfr_grid)):
+            measured = ~np.isnan(grid)
+            counts = measured.sum(axis=1)
+            series[metric] = (zscore(grid[measured], counts), counts)
+        
+        def selected(metric: str, patients: np.ndarray) -> tuple:
+            """(normalized values, counts) of the selected patients only"""
+            normalized, counts = series[metric]
+            return normalized[np.repeat(patients, counts)], counts[patients]
+        
+        kre_ok, gfr_ok = series["kre"][1] >= 3, series["gfr"][1] >= 3
+        # Single-variable windows
+        all_kre_windows = training_windows(*selected("kre", kre_ok), window_size)
+        all_gfr_windows = training_windows(*selected("gfr", gfr_ok), window_size)
+        # Multi-variable windows (both KRE and GFR)
+        both = kre_ok & gfr_ok
+        all_multi_windows = paired_training_windows(*selected("kre", both), *selected("gfr", both), window_size)
         
         # Train KRE VAE
         if len(all_kre_windows) >= 10:
             try:
-                all_kre_windows = np.array(all_kre_windows, dtype=np.float32)
                 all_kre_windows = np.nan_to_num(all_kre_windows, nan=0.0, posinf=0.0, neginf=0.0)
                 
                 vae_kre, encoder_kre, _ = self._build_vae(window_size)
-                vae_kre.fit(all_kre_windows, epochs=30, batch_size=min(32, len(all_kre_windows)), verbose=0)
+                vae_kre.fit(all_kre_windows, all_kre_windows, epochs=30, batch_size=min(32, len(all_kre_windows)), verbose=0)
                 
                 reconstructed = vae_kre.predict(all_kre_windows, verbose=0)
                 errors = np.mean((all_kre_windows - reconstructed) ** 2, axis=1)
@@ -205,11 +150,10 @@ class LABAnomalyDetector:
         # Train GFR VAE
         if len(all_gfr_windows) >= 10:
             try:
-                all_gfr_windows = np.array(all_gfr_windows, dtype=np.float32)
                 all_gfr_windows = np.nan_to_num(all_gfr_windows, nan=0.0, posinf=0.0, neginf=0.0)
                 
                 vae_gfr, encoder_gfr, _ = self._build_vae(window_size)
-                vae_gfr.fit(all_gfr_windows, epochs=30, batch_size=min(32, len(all_gfr_windows)), verbose=0)
+                vae_gfr.fit(all_gfr_windows, all_gfr_windows, epochs=30, batch_size=min(32, len(all_gfr_windows)), verbose=0)
                 
                 reconstructed = vae_gfr.predict(all_gfr_windows, verbose=0)
                 errors = np.mean((all_gfr_windows - reconstructed) ** 2, axis=1)
@@ -231,17 +175,18 @@ class LABAnomalyDetector:
         # Train multi-output VAE
         if len(all_multi_windows) >= 10:
             try:
-                all_multi_windows = np.array(all_multi_windows, dtype=np.float32)
                 all_multi_windows = np.nan_to_num(all_multi_windows, nan=0.0, posinf=0.0, neginf=0.0)
                 
                 vae_multi, encoder_multi, _ = self._build_multi_vae(window_size * 2)
-                vae_multi.fit(all_multi_windows, epochs=30, batch_size=min(32, len(all_multi_windows)), verbose=0)
+                vae_multi.fit(all_multi_windows, all_multi_windows, epochs=30, batch_size=min(32, len(all_multi_windows)), verbose=0)
                 
                 self.vae_multi = vae_multi
                 self.encoder_multi = encoder_multi
                 print("✅ Multi-output LAB anomaly detector trained")
             except Exception as e:
                 print(f"⚠️ Multi-output VAE training failed: {e}")
+        
+        self.window_size = window_size
     
     def _fit_simple_threshold_kre(self, lab_long: pd.DataFrame) -> None:
         """Simple threshold for KRE"""
@@ -270,86 +215,106 @@ class LABAnomalyDetector:
         self._fit_simple_threshold_kre(lab_long)
         self._fit_simple_threshold_gfr(lab_long)
     
+    def export_state(self) -> dict:
+        """Fitted state for the detector store (autoencoder weights as arrays)"""
+        weights = {}
+        for name in ("kre", "gfr", "multi"):
+            vae = getattr(self, f"vae_{name}", None)
+            weights[name] = [np.asarray(w) for w in vae.get_weights()] if vae is not None else None
+        return {
+            "window_size": getattr(self, "window_size", 5),
+            "global_threshold_kre": self.global_threshold_kre,
+            "global_threshold_gfr": self.global_threshold_gfr,
+            "use_simple_kre": getattr(self, "use_simple_kre", False),
+            "use_simple_gfr": getattr(self, "use_simple_gfr", False),
+            "weights": weights,
+        }
+    
+    def load_state(self, state: dict) -> bool:
+        """Restore an exported state; False if it holds autoencoder weights and TensorFlow is missing"""
+        weights = state["weights"]
+        if any(w is not None for w in weights.values()) and not HAS_TF:
+            return False
+        window_size = state["window_size"]
+        builders = {"kre": (self._build_vae, window_size), "gfr": (self._build_vae, window_size),
+                    "multi": (self._build_multi_vae, window_size * 2)}
+        for name, (build, input_dim) in builders.items():
+            if weights[name] is not None:
+                vae, encoder, _ = build(input_dim)
+                vae.set_weights(weights[name])
+                setattr(self, f"vae_{name}", vae)
+                setattr(self, f"encoder_{name}", encoder)
+        self.window_size = window_size
+        for key in ("global_threshold_kre", "global_threshold_gfr", "use_simple_kre", "use_simple_gfr"):
+            setattr(self, key, state[key])
+        return True
+    
     def score_patient(self, lab_df: pd.DataFrame) -> List[dict]:
         """Calculate anomaly scores for a patient's LAB series"""
-        df = lab_df.sort_values("time_order").copy()
-        kre_values = df["kre"].dropna().values
-        gfr_values = df["gfr"].dropna().values
-        
-        n_points = len(df)
-        
-        # Simple approach if no TF or too few points
-        if not HAS_TF or getattr(self, "use_simple_kre", False) or len(kre_values) < 3:
-            kre_scores = self._simple_scoring(kre_values, "kre")
-        else:
-            kre_scores = self._vae_scoring(kre_values, "kre")
-        
-        if not HAS_TF or getattr(self, "use_simple_gfr", False) or len(gfr_values) < 3:
-            gfr_scores = self._simple_scoring(gfr_values, "gfr")
-        else:
-            gfr_scores = self._vae_scoring(gfr_values, "gfr")
-        
-        # Combine scores by time point
-        scores = []
-        kre_idx = 0
-        gfr_idx = 0
-        
-        for _, row in df.iterrows():
-            kre_score = None
-            gfr_score = None
-            
-            if not pd.isna(row["kre"]) and kre_idx < len(kre_scores):
-                kre_score = kre_scores[kre_idx]
-                kre_idx += 1
-            
-            if not pd.isna(row["gfr"]) and gfr_idx < len(gfr_scores):
-                gfr_score = gfr_scores[gfr_idx]
-                gfr_idx += 1
-            
-            scores.append({
-                "kre_anomaly_score": kre_score["score"] if kre_score else None,
-                "kre_anomaly_flag": kre_score["flag"] if kre_score else False,
-                "gfr_anomaly_score": gfr_score["score"] if gfr_score else None,
-                "gfr_anomaly_flag": gfr_score["flag"] if gfr_score else False
-            })
-        
-        return scores
+        return self._score_frames([lab_df])[0]
     
-    def _vae_scoring(self, values: np.ndarray, metric: str) -> List[dict]:
-        """VAE-based anomaly scoring"""
-        mean_val = values.mean()
-        std_val = values.std() + 1e-6
-        normalized = (values - mean_val) / std_val
-        
-        window_size = 5
+    def _score_frames(self, lab_frames: List[pd.DataFrame]) -> List[List[dict]]:
+        """
+        Per-row KRE/GFR scores of many patients' LAB frames (rows in time order)
+        
+        Each metric is scored on the measured values only; a row without a
+        value of a metric gets score None / flag False for it.
+        """
+        long_df, lengths = stack_frames(lab_frames)
+        series_id = np.repeat(np.arange(len(lab_frames)), lengths)
+        per_row = {}
+        for metric in ("kre", "gfr"):
+            values = pd.to_numeric(long_df[metric], errors="coerce").to_numpy(dtype=np.float64)
+            measured = ~np.isnan(values)
+            counts = np.bincount(series_id[measured], minlength=len(lab_frames))
+            scores = [s for series in self._metric_scores(values[measured], counts, metric) for s in series]
+            per_row[metric] = [None] * len(values)
+            for row, score in zip(np.flatnonzero(measured).tolist(), scores):
+                per_row[metric][row] = score
+        
+        rows = [
+            {
+                "kre_anomaly_score": kre["score"] if kre else None,
+                "kre_anomaly_flag": kre["flag"] if kre else False,
+                "gfr_anomaly_score": gfr["score"] if gfr else None,
+                "gfr_anomaly_flag": gfr["flag"] if gfr else False
+            }
+            for kre, gfr in zip(per_row["kre"], per_row["gfr"])
+        ]
+        bounds = np.concatenate([[0], np.cumsum(lengths)])
+        return [rows[bounds[i]:bounds[i + 1]] for i in range(len(lab_frames))]
+    
+    def _metric_scores(self, values: np.ndarray, lengths: np.ndarray, metric: str) -> List[List[dict]]:
+        """
+        Scores of concatenated per-patient series of one metric
+        
+        Series with >= 3 values are windowed together and run through the
+        metric's autoencoder in one call; the rest (and the simple-threshold
+        mode) use the z-score rule.
+        """
         vae = getattr(self, f"vae_{metric}", None)
         threshold = getattr(self, f"global_threshold_{metric}", 1.0)
-        
-        if vae is None:
-            return self._simple_scoring(values, metric)
-        
-        scores = []
-        for i in range(len(values)):
-            start_idx = max(0, i - window_size + 1)
-            window = normalized[start_idx:i+1]
-            
-            if len(window) < window_size:
-                pad = np.full(window_size - len(window), window.mean())
-                window = np.concatenate([pad, window])
+        use_vae = HAS_TF and not getattr(self, f"use_simple_{metric}", False) and vae is not None
+        eligible = (lengths >= 3) & use_vae
+        
+        bounds = np.concatenate([[0], np.cumsum(lengths)])
+        scores: List[Optional[List[dict]]] = [None] * len(lengths)
+        for i in np.flatnonzero(~eligible):
+            scores[i] = self._simple_scoring(values[bounds[i]:bounds[i + 1]], metric)
+        
+        if eligible.any():
+            vae_lengths = lengths[eligible]
+            normalized = zscore(values[np.repeat(eligible, lengths)], vae_lengths)
+            errors = reconstruction_errors(vae, point_windows(normalized, vae_lengths, getattr(self, "window_size", 5)))
             
-            window = window.reshape(1, -1)
-            
-            try:
-                reconstructed = vae.predict(window, verbose=0)
-                error = float(np.mean((window - reconstructed) ** 2))
-            except:
-                error = 0.0
-            
-            score = min(100, (error / (threshold + 1e-6)) * 50)
-            flag = error > threshold
-            
-            scores.append({"score": round(score, 2), "flag": flag})
-        
+            point_scores = (errors / (threshold + 1e-6)) * 50
+            flat = [
+                {"score": round(min(100, score), 2), "flag": flag}
+                for score, flag in zip(point_scores, (errors > threshold).tolist())
+            ]
+            vae_bounds = np.concatenate([[0], np.cumsum(vae_lengths)])
+            for k, i in enumerate(np.flatnonzero(eligible)):
+                scores[i] = flat[vae_bounds[k]:vae_bounds[k + 1]]
         return scores
     
     def _simple_scoring(self, values: np.ndarray, metric: str) -> List[dict]:
@@ -370,29 +335,95 @@ class LABAnomalyDetector:
         
         return scores
     
-    def bulk_score(self, lab_long: pd.DataFrame) -> Dict[str, List[dict]]:
-        """Score all patients"""
-        results = {}
-        patients = lab_long["patient_code"].unique()
+    def bulk_score(self, lab_long: pd.DataFrame, panel: PatientPanel = None,
+                   patients: List[str] = None) -> Dict[str, List[dict]]:
+        """
+        Score all patients (or only `patients`)
+        
+        Windows of all patients are gathered per metric, so the KRE and GFR
+        autoencoders each run one inference for the whole cohort.
+        """
+        if panel is None:
+            panel = PatientPanel(lab_long=lab_long)
+        patients = panel.lab_patients if patients is None else list(patients)
         
         print(f"🔍 Scoring LAB anomalies for {len(patients)} patients...")
         
-        for patient in patients:
-            patient_df = lab_long[lab_long["patient_code"] == patient]
-            results[patient] = self.score_patient(patient_df)
+        scores = self._score_frames([panel.lab(patient) for patient in patients]) if patients else []
+        results = dict(zip(patients, scores))
         
         print("✅ LAB anomaly scoring complete")
         return results
+    
+    def start_stream(self, lab_long: pd.DataFrame, panel: PatientPanel = None) -> None:
+        """Seed the running per-patient/metric state of update() from the measurements so far"""
+        if panel is None:
+            panel = PatientPanel(lab_long=lab_long)
+        window_size = getattr(self, "window_size", 5)
+        self._streams = {}
+        for patient in panel.lab_patients:
+            df = panel.lab(patient).sort_values("time_order")
+            for metric in ("kre", "gfr"):
+                values = pd.to_numeric(df[metric], errors="coerce").to_numpy(dtype=np.float64)
+                measured = ~np.isnan(values)
+                if measured.any():
+                    last_order = int(df["time_order"].to_numpy()[measured][-1])
+                    self._streams[(str(patient), metric)] = RunningSeries.from_history(
+                        values[measured], last_order, window_size)
+    
+    def update(self, patient: str, time_key: str, value: Dict[str, float]) -> dict:
+        """
+        Score one newly arrived LAB row ({"kre": ..., "gfr": ...}, either may be missing) in O(window_size)
+        
+        Each measured metric's running mean/std and last window_size values
+        are updated and only the window ending at the new point is scored;
+        the result has the bulk_score row format. As in
+        KMRAnomalyDetector.update, scores are causal: equal to batch scoring
+        of the series so far, not to a later whole-series bulk_score.
+        Rows must arrive in time order per metric.
+        """
+        order = get_lab_time_info(time_key)["order"]
+        if not order:
+            raise ValueError(f"Unknown LAB time key {time_key!r}")
+        measured = {m: float(value[m]) for m in ("kre", "gfr") if value.get(m) is not None and not np.isnan(value[m])}
+        window_size = getattr(self, "window_size", 5)
+        streams = {m: self._streams.setdefault((str(patient), m), RunningSeries(window_size)) for m in measured}
+        # Check every metric first so a rejected row changes no state
+        for m, stream in streams.items():
+            if not stream.accepts(order):
+                raise ValueError(f"{m.upper()} of {patient} at {time_key} arrived out of order; "
+                                 "out-of-order or corrected points need a batch rescore")
+        
+        row = {}
+        for metric in ("kre", "gfr"):
+            score = None
+            if metric in measured:
+                streams[metric].push(measured[metric], order)
+                score = self._point_score(streams[metric], measured[metric], metric)
+            row[f"{metric}_anomaly_score"] = score["score"] if score else None
+            row[f"{metric}_anomaly_flag"] = score["flag"] if score else False
+        return row
+    
+    def _point_score(self, stream: RunningSeries, value: float, metric: str) -> dict:
+        """Score of a stream's newest value (same rules as _metric_scores)"""
+        vae = getattr(self, f"vae_{metric}", None)
+        threshold = getattr(self, f"global_threshold_{metric}", 1.0)
+        if HAS_TF and not getattr(self, f"use_simple_{metric}", False) and vae is not None and stream.count >= 3:
+            error = reconstruction_errors(vae, stream.window().reshape(1, -1))[0]
+            return {"score": round(min(100, (error / (threshold + 1e-6)) * 50), 2), "flag": bool(error > threshold)}
+        
+        z = abs(value - stream.mean) / (stream.std + 1e-6)
+        return {"score": round(float(min(100, z * 20)), 2), "flag": bool(z > 2.5)}
 
 
 if __name__ == "__main__":
     from io_excel import load_all_data
     
-    meta, kmr_long, lab_long, improved, raw = load_all_data()
+    meta, kmr_long, lab_long, improved, raw, panel = load_all_data()
     
     detector = LABAnomalyDetector()
-    detector.fit_global(lab_long)
-    scores = detector.bulk_score(lab_long)
+    detector.fit_global(lab_long, panel)
+    scores = detector.bulk_score(lab_long, panel)
     
     print("\nSample scores:")
     sample = list(scores.keys())[0]
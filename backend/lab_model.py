@@ -2,35 +2,54 @@
 LAB Model - LSTM prediction for KRE/GFR time series
 Supports both single-variable and multi-output models
 """
+from bisect import bisect_left
+
 import numpy as np
 import pandas as pd
 from typing import Dict, List, Tuple, Optional, Any
 import warnings
 warnings.filterwarnings('ignore')
 
-try:
-    import tensorflow as tf
-    from tensorflow import keras
-    from tensorflow.keras import layers, Model
-    from tensorflow.keras.callbacks import EarlyStopping, ReduceLROnPlateau
-    HAS_TF = True
-except ImportError:
-    HAS_TF = False
-    Model = Any  # Type hint fallback when TensorFlow is not available
-    print("⚠️ TensorFlow not available, using simple prediction fallback")
+from .tf_backend import HAS_TF, tf, keras, layers, Model
 
 from .config import MODEL_CONFIG
-from .time_mapping import LAB_TIME_MAP, UNIFIED_TIME_MAP, get_lab_time_info, get_unified_time_info
+from .time_mapping import (LAB_TIME_MAP, UNIFIED_LAB_DAYS, UNIFIED_LAB_KEYS, UNIFIED_LAB_ORDERS,
+                           get_lab_time_info, get_unified_time_info)
+from .patient_panel import PatientPanel, align_lab_grid
+from .parallel_training import seed_patient, train_patients_parallel
+from .model_store import ModelStore, data_digest
+from .model_templates import ModelTemplateCache
+from .training_budget import COMPLEXITY_COST, TrainingBudget, combine_paths, fit_model
+from .uncertainty import mc_dropout_predict, use_mc_dropout
+from .windowing import sequence_windows
+from .forecast_engine import numpy_engine, resolve_engine, sanitize
+from .joint_model import JointForecaster
+from .gfr_calibration import calibrate_gfr
+from .feature_kernel import (FEATURE_COLUMNS, first_valid_baseline, pad, series_features, split_frames,
+                             stack_frames, unpad)
 
 
 class LABPredictor:
     """LSTM-based KRE/GFR prediction model"""
     
-    def __init__(self, config: dict = None):
+    def __init__(self, config: dict = None, model_store: Optional[ModelStore] = None,
+                 joint: Optional[JointForecaster] = None):
         self.config = config or MODEL_CONFIG
         self.models: Dict[str, Any] = {}  # Model type when TF available
         self.scalers: Dict[str, dict] = {}
+        self.model_store = model_store  # Reuse weights of patients whose data did not change
         self.use_multi_output = True  # Use multi-output model for KRE+GFR
+        self.joint = joint  # Cohort-wide forecaster of the "joint" engine (may be shared with KMRPredictor)
+        template_config = self.config.get("model_templates", {})
+        self.templates = (ModelTemplateCache(template_config.get("max_templates", 16))
+                          if template_config.get("enabled", False) else None)
+        self.budget: Optional[TrainingBudget] = None  # Set by train_patients for one run
+        self._fit_paths: List[str] = []  # train_path of each model fitted for the current patient
+        self._gfr_pending: Optional[list] = None  # GFR records awaiting batched calibration (train_patients)
+
+    def _use_numpy_engine(self) -> bool:
+        """MODEL_CONFIG forecast_engine (keras runs the NumPy engine when TensorFlow is missing)"""
+        return resolve_engine(self.config, HAS_TF) == "numpy"
 
     @staticmethod
     def _sanitize_prediction(metric: str, pred: float, pred_lo: float, pred_hi: float) -> Tuple[float, float, float]:
@@ -52,84 +71,50 @@ class LABPredictor:
         Apply lightweight patient-level bias correction for GFR predictions.
         Uses observed points only; robust + clipped correction avoids overfitting
         and prevents implausible zero-collapse on low points.
+        
+        Inside train_patients the records are queued and calibrated for all
+        patients in one batch when the run ends; otherwise right away.
         """
-        errors = []
-        observed_values = []
-        for p in predictions:
-            status = p.get("gfr_pred_status")
-            if isinstance(status, str) and status.startswith("warmup_"):
-                continue
-            order = p.get("time_order")
-            actual = actual_lookup.get(order)
-            pred = p.get("gfr_pred")
-            if isinstance(actual, (int, float)) and not np.isnan(actual) and isinstance(pred, (int, float)):
-                errors.append(float(pred) - float(actual))
-                observed_values.append(float(actual))
-
-        if len(errors) < 4:
-            return predictions
-
-        errors_arr = np.array(errors, dtype=float)
-        q1, q3 = np.percentile(errors_arr, [25, 75])
-        iqr = max(q3 - q1, 1e-6)
-        inlier_mask = (errors_arr >= (q1 - 1.5 * iqr)) & (errors_arr <= (q3 + 1.5 * iqr))
-        core = errors_arr[inlier_mask] if int(np.sum(inlier_mask)) >= 3 else errors_arr
-
-        # Robust (median) correction with conservative cap.
-        raw_correction = float(np.median(core))
-        max_abs_correction = max(8.0, float(np.std(core)) * 1.5)
-        correction = float(np.clip(raw_correction, -max_abs_correction, max_abs_correction))
-
-        if abs(correction) < 0.1:
-            return predictions
-
-        global_floor = 1.0
-        if observed_values:
-            global_floor = max(1.0, float(np.percentile(np.array(observed_values), 10)) * 0.35)
-
-        calibrated = []
-        for p in predictions:
-            status = p.get("gfr_pred_status")
-            if isinstance(status, str) and status.startswith("warmup_"):
-                calibrated.append(p)
-                continue
-            pred = p.get("gfr_pred")
-            lo = p.get("gfr_pred_lo")
-            hi = p.get("gfr_pred_hi")
-            if not all(isinstance(x, (int, float)) for x in [pred, lo, hi]):
-                calibrated.append(p)
-                continue
-
-            pred_adj = float(pred) - correction
-            lo_adj = float(lo) - correction
-            hi_adj = float(hi) - correction
-
-            order = p.get("time_order")
-            actual = actual_lookup.get(order)
-            if isinstance(actual, (int, float)) and not np.isnan(actual):
-                # Keep calibrated prediction within clinically plausible fraction of measured value.
-                point_floor = max(1.0, float(actual) * 0.35)
-            else:
-                point_floor = global_floor
-
-            pred_adj = max(pred_adj, point_floor)
-            lo_adj = max(lo_adj, min(point_floor, pred_adj))
-            hi_adj = max(hi_adj, pred_adj)
-            pred_adj, lo_adj, hi_adj = self._sanitize_prediction("gfr", pred_adj, lo_adj, hi_adj)
-
-            residual = None
-            if isinstance(actual, (int, float)) and not np.isnan(actual):
-                residual = round(float(actual - pred_adj), 1)
-
-            calibrated.append({
-                **p,
-                "gfr_pred": round(pred_adj, 1),
-                "gfr_pred_lo": round(lo_adj, 1),
-                "gfr_pred_hi": round(hi_adj, 1),
-                "residual": residual,
+        if self._gfr_pending is not None:
+            self._gfr_pending.append((predictions, actual_lookup))
+        else:
+            self._calibrate_gfr_batch([(predictions, actual_lookup)])
+        return predictions
+    
+    @staticmethod
+    def _calibrate_gfr_batch(items: List[Tuple[List[dict], Dict[int, Any]]]) -> None:
+        """
+        GFR bias correction for many patients' prediction records at once
+        
+        items: (gfr prediction records, time_order -> actual GFR) per patient.
+        The records are stacked into (patients x slots) arrays, calibrated by
+        gfr_calibration.calibrate_gfr and updated in place.
+        """
+        def number(x: Any) -> float:
+            return float(x) if isinstance(x, (int, float)) else np.nan
+        
+        items = [item for item in items if item[0]]
+        if not items:
+            return
+        shape = (len(items), max(len(records) for records, _ in items))
+        pred, lo, hi, actual = (np.full(shape, np.nan) for _ in range(4))
+        calibrate = np.zeros(shape, dtype=bool)
+        for i, (records, actual_lookup) in enumerate(items):
+            for j, p in enumerate(records):
+                status = p.get("gfr_pred_status")
+                calibrate[i, j] = not (isinstance(status, str) and status.startswith("warmup_"))
+                pred[i, j], lo[i, j], hi[i, j] = number(p.get("gfr_pred")), number(p.get("gfr_pred_lo")), number(p.get("gfr_pred_hi"))
+                actual[i, j] = number(actual_lookup.get(p.get("time_order")))
+        
+        result = calibrate_gfr(pred, lo, hi, actual, calibrate)
+        for i, j in zip(*np.nonzero(result.calibrated)):
+            residual = result.residual[i, j]
+            items[i][0][j].update({
+                "gfr_pred": round(float(result.pred[i, j]), 1),
+                "gfr_pred_lo": round(float(result.lo[i, j]), 1),
+                "gfr_pred_hi": round(float(result.hi[i, j]), 1),
+                "residual": None if np.isnan(residual) else round(float(residual), 1),
             })
-
-        return calibrated
     
     def _winsorize_values(self, values: np.ndarray, metric: str) -> np.ndarray:
         """Winsorize extreme values based on clinical thresholds"""
@@ -146,46 +131,32 @@ class LABPredictor:
         
         return winsorized
     
+    @staticmethod
+    def _grid_frame(kre: np.ndarray, gfr: np.ndarray) -> pd.DataFrame:
+        """Unified LAB grid frame from KRE/GFR values aligned on UNIFIED_LAB_KEYS"""
+        return pd.DataFrame({
+            "time_key": list(UNIFIED_LAB_KEYS),
+            "time_order": list(UNIFIED_LAB_ORDERS),
+            "pseudo_time_days": list(UNIFIED_LAB_DAYS),
+            "kre": kre,
+            "gfr": gfr
+        })
+    
     def _prepare_unified_grid(self, lab_df: pd.DataFrame) -> pd.DataFrame:
         """
         Prepare LAB data on unified time grid (UNIFIED_TIME_MAP order)
         Missing points are set to NaN (no forward fill)
         """
         # LAB data from io_excel.py uses base time_key (e.g., "Day_7", "Month_4")
-        # without _KRE/_GFR suffix. Each row has both kre and gfr columns.
-        
-        # Create lookup by base time_key
-        lab_lookup = {}
-        for _, row in lab_df.iterrows():
-            base_key = row["time_key"]  # Already base key, no suffix
-            if base_key not in lab_lookup:
-                lab_lookup[base_key] = {}
-            lab_lookup[base_key]["kre"] = row.get("kre")
-            lab_lookup[base_key]["gfr"] = row.get("gfr")
-        
-        # Map to unified time grid
-        unified_grid = []
-        for time_key, info in sorted(UNIFIED_TIME_MAP.items(), key=lambda x: x[1]["order"]):
-            if info["has_lab"]:
-                # time_key is already base key (e.g., "Day_7")
-                base_key = time_key
-                
-                kre_val = None
-                gfr_val = None
-                
-                if base_key in lab_lookup:
-                    kre_val = lab_lookup[base_key].get("kre")
-                    gfr_val = lab_lookup[base_key].get("gfr")
-                
-                unified_grid.append({
-                    "time_key": time_key,
-                    "time_order": info["order"],
-                    "pseudo_time_days": info["pseudo_days"],
-                    "kre": kre_val,
-                    "gfr": gfr_val
-                })
-        
-        return pd.DataFrame(unified_grid)
+        # without _KRE/_GFR suffix. Each row has both kre and gfr columns;
+        # of duplicate time_keys the last row wins.
+        kre, gfr = align_lab_grid(lab_df)
+        return self._grid_frame(kre[0], gfr[0])
+    
+    def batch_unified_grid(self, panel: PatientPanel, patients: List[str]) -> List[pd.DataFrame]:
+        """_prepare_unified_grid for many patients from one aligned KRE/GFR scatter (PatientPanel.lab_grid)"""
+        kre, gfr = panel.lab_grid(patients)
+        return [self._grid_frame(k, g) for k, g in zip(kre, gfr)]
     
     def _feature_engineering(self, lab_series: pd.DataFrame, metric: str) -> pd.DataFrame:
         """
@@ -193,52 +164,40 @@ class LABPredictor:
         
         Input: DataFrame with columns [time_order, pseudo_time_days, kre/gfr]
         """
-        df = lab_series.sort_values("time_order").copy()
-        value_col = metric.lower()  # "kre" or "gfr"
-        
-        if value_col not in df.columns:
-            return df
+        if metric.lower() not in lab_series.columns:
+            return lab_series.sort_values("time_order").copy()
+        return self.batch_feature_engineering([lab_series], metric)[0]
+    
+    def batch_feature_engineering(self, lab_frames: List[pd.DataFrame], metric: str) -> List[pd.DataFrame]:
+        """
+        Feature engineering for many LAB series (one metric) at once
         
-        values = df[value_col].values
+        All series are padded into one array and run through feature_kernel; each
+        returned frame equals the per-patient pandas/polyfit computation.
+        """
+        value_col = metric.lower()  # "kre" or "gfr"
+        if not lab_frames:
+            return []
+        long_df, lengths = stack_frames(lab_frames)
+        values = pad(long_df[value_col].to_numpy(dtype=np.float64), lengths)
         
         # Winsorize extreme values
         values = self._winsorize_values(values, value_col)
-        df[value_col] = values
-        
-        # Baseline (first measurement)
-        baseline = df[value_col].iloc[0] if not pd.isna(df[value_col].iloc[0]) else df[value_col].dropna().iloc[0] if df[value_col].notna().any() else 0
-        
-        # Delta and ratio from baseline
-        df["delta_from_baseline"] = df[value_col] - baseline
-        if value_col == "kre":
-            # KRE: lower is better, ratio < 1 is good
-            df["ratio_from_baseline"] = df[value_col] / (baseline + 1e-6)
-        else:  # GFR
-            # GFR: higher is better, ratio > 1 is good
-            df["ratio_from_baseline"] = df[value_col] / (baseline + 1e-6)
-        
-        # EWMA
-        df["ewma"] = df[value_col].ewm(span=3, min_periods=1).mean()
-        
-        # Rolling CV
-        rolling_std = df[value_col].rolling(window=3, min_periods=1).std()
-        rolling_mean = df[value_col].rolling(window=3, min_periods=1).mean()
-        df["rolling_cv"] = rolling_std / (rolling_mean + 1e-6)
-        
-        # Short-term slope (last 2-3 points)
-        df["slope_short"] = 0.0
-        if len(df) >= 2:
-            for i in range(1, len(df)):
-                y = df[value_col].iloc[max(0, i-2):i+1].values
-                x = np.arange(len(y))
-                if len(y) >= 2 and not np.any(np.isnan(y)):
-                    slope = np.polyfit(x, y, 1)[0]
-                    df.iloc[i, df.columns.get_loc("slope_short")] = slope
-        
-        # Fill NaN
-        df = df.fillna(0)
-        
-        return df
+        
+        # Baseline (first measurement); slope also over the first 2 points
+        baseline = first_valid_baseline(values, default=0.0)
+        features = series_features(values, baseline, slope_min_points=2)
+        
+        long_df[value_col] = unpad(values, lengths)
+        for col in FEATURE_COLUMNS:
+            long_df[col] = unpad(features[col], lengths)
+        return split_frames(long_df.fillna(0), lengths)
+    
+    def patient_features(self, unified_dfs: List[pd.DataFrame]) -> List[Dict[str, pd.DataFrame]]:
+        """KRE and GFR feature frames for many unified grids: [{"kre": df, "gfr": df}, ...]"""
+        kre = self.batch_feature_engineering(unified_dfs, "kre")
+        gfr = self.batch_feature_engineering(unified_dfs, "gfr")
+        return [{"kre": k, "gfr": g} for k, g in zip(kre, gfr)]
     
     def _build_single_model(self, seq_len: int, n_features: int, metric: str) -> Any:
         """Build single-variable LSTM model for KRE or GFR"""
@@ -275,35 +234,39 @@ class LABPredictor:
         )
         return model
     
+    def _templated(self, key: tuple, build) -> Any:
+        """Model from the template cache when enabled, else a fresh build"""
+        return build() if self.templates is None else self.templates.get(key, build)
+    
     def _prepare_sequences(self, features: np.ndarray, targets: np.ndarray, seq_len: int) -> Tuple[np.ndarray, np.ndarray]:
         """Prepare sequences for training"""
-        X, y = [], []
-        for i in range(len(features) - seq_len):
-            X.append(features[i:i+seq_len])
-            y.append(targets[i+seq_len])
-        return np.array(X), np.array(y)
+        X, target_rows = sequence_windows(features, seq_len)
+        return X, np.asarray(targets)[target_rows]
     
     def _prepare_multi_sequences(self, features: np.ndarray, kre_targets: np.ndarray, 
                                  gfr_targets: np.ndarray, seq_len: int) -> Tuple[np.ndarray, List[np.ndarray]]:
         """Prepare sequences for multi-output training"""
-        X, y_kre, y_gfr = [], [], []
-        for i in range(len(features) - seq_len):
-            X.append(features[i:i+seq_len])
-            y_kre.append(kre_targets[i+seq_len])
-            y_gfr.append(gfr_targets[i+seq_len])
-        return np.array(X), [np.array(y_kre), np.array(y_gfr)]
-    
-    def train_patient_model(self, patient_code: str, lab_df: pd.DataFrame) -> Optional[dict]:
+        X, target_rows = sequence_windows(features, seq_len)
+        return X, [np.asarray(kre_targets)[target_rows], np.asarray(gfr_targets)[target_rows]]
+    
+    def train_patient_model(self, patient_code: str, lab_df: pd.DataFrame,
+                            unified_df: Optional[pd.DataFrame] = None,
+                            features: Optional[Dict[str, pd.DataFrame]] = None) -> Optional[dict]:
         """
         Train model for a single patient
         
+        unified_df / features: precomputed _prepare_unified_grid(lab_df) and its
+        {"kre", "gfr"} feature frames (see patient_features)
         Returns dict with predictions for KRE and GFR
         """
-        if not HAS_TF:
-            return self._simple_prediction(lab_df)
+        if self._use_numpy_engine():
+            return self.bulk_forecast(PatientPanel(lab_long=lab_df.assign(patient_code=patient_code)),
+                                      [patient_code])[patient_code]
         
         # Prepare unified grid
-        unified_df = self._prepare_unified_grid(lab_df)
+        if unified_df is None:
+            unified_df = self._prepare_unified_grid(lab_df)
+        features = features or {}
         
         # Check minimum data points (≥3 measurements)
         kre_valid = unified_df["kre"].notna().sum()
@@ -316,20 +279,22 @@ class LABPredictor:
         use_multi = self.use_multi_output and kre_valid >= 3 and gfr_valid >= 3
         
         if use_multi:
-            return self._train_multi_output(patient_code, unified_df)
+            return self._train_multi_output(patient_code, unified_df, features)
         else:
             # Train separate models
             results = {}
             if kre_valid >= 3:
-                results["kre"] = self._train_single_metric(patient_code, unified_df, "kre")
+                results["kre"] = self._train_single_metric(patient_code, unified_df, "kre", features.get("kre"))
             if gfr_valid >= 3:
-                results["gfr"] = self._train_single_metric(patient_code, unified_df, "gfr")
+                results["gfr"] = self._train_single_metric(patient_code, unified_df, "gfr", features.get("gfr"))
             return results if results else self._simple_prediction(lab_df)
     
-    def _train_single_metric(self, patient_code: str, unified_df: pd.DataFrame, metric: str) -> dict:
+    def _train_single_metric(self, patient_code: str, unified_df: pd.DataFrame, metric: str,
+                             features_df: Optional[pd.DataFrame] = None) -> dict:
         """Train single-variable model for KRE or GFR"""
         # Feature engineering
-        features_df = self._feature_engineering(unified_df, metric)
+        if features_df is None:
+            features_df = self._feature_engineering(unified_df, metric)
         n_points = len(features_df)
         
         # Determine sequence length
@@ -363,23 +328,34 @@ class LABPredictor:
         
         # Build model
         n_features = len(feature_cols)
-        model = self._build_single_model(seq_len, n_features, metric)
-        
-        # Callbacks
-        callbacks = [
-            EarlyStopping(patience=5, restore_best_weights=True, verbose=0),
-            ReduceLROnPlateau(factor=0.7, patience=3, min_lr=0.0001, verbose=0)
-        ]
-        
-        # Train
-        try:
-            model.fit(X, y, epochs=50, batch_size=min(8, len(X)), 
-                     validation_split=0.2, callbacks=callbacks, verbose=0, shuffle=False)
-        except Exception as e:
-            print(f"⚠️ Training failed for {patient_code} {metric}: {e}")
-            return self._simple_prediction_single(unified_df, metric)
+        model = self._templated((f"lab_{metric}", seq_len, n_features),
+                                lambda: self._build_single_model(seq_len, n_features, metric))
+        
+        # Unchanged patient: reload stored weights + scaler instead of retraining
+        store_key, stored_scaler = None, None
+        if self.model_store is not None:
+            store_key = self.model_store.key(f"lab_{metric}", patient_code, data_digest(X, y), "medium", seq_len)
+            stored_scaler = self.model_store.load(store_key, model)
+        
+        if stored_scaler is not None:
+            self.scalers[f"{patient_code}_{metric}"] = stored_scaler
+            self._fit_paths.append("model_store")
+        else:
+            # Train (early stopping; epochs/time capped by the training budget, if any)
+            try:
+                self._fit_paths.append(fit_model(model, X, y, self.budget))
+            except Exception as e:
+                print(f"⚠️ Training failed for {patient_code} {metric}: {e}")
+                return self._simple_prediction_single(unified_df, metric)
+            
+            # Fits cut short by the budget (keras_budget / keras_plateau) are not final weights:
+            # storing them would let a later unbudgeted run reload them as fully trained
+            if store_key is not None and self._fit_paths[-1] == "keras":
+                self.model_store.save(store_key, model, self.scalers[f"{patient_code}_{metric}"])
         
-        self.models[f"{patient_code}_{metric}"] = model
+        if self.templates is None:
+            # Templates are shared across patients; only keep models owned by one patient
+            self.models[f"{patient_code}_{metric}"] = model
         
         # Generate predictions for unified grid (all has_lab=True time_keys)
         predictions = self._generate_predictions_single_unified(
@@ -392,11 +368,17 @@ class LABPredictor:
             "seq_len": seq_len
         }
     
-    def _train_multi_output(self, patient_code: str, unified_df: pd.DataFrame) -> dict:
+    def _train_multi_output(self, patient_code: str, unified_df: pd.DataFrame,
+                            features: Optional[Dict[str, pd.DataFrame]] = None) -> dict:
         """Train multi-output model for KRE+GFR"""
         # Feature engineering for both metrics
-        kre_features_df = self._feature_engineering(unified_df, "kre")
-        gfr_features_df = self._feature_engineering(unified_df, "gfr")
+        features = features or {}
+        kre_features_df = features.get("kre")
+        if kre_features_df is None:
+            kre_features_df = self._feature_engineering(unified_df, "kre")
+        gfr_features_df = features.get("gfr")
+        if gfr_features_df is None:
+            gfr_features_df = self._feature_engineering(unified_df, "gfr")
         
         # Combine features (use KRE features as base, add GFR-specific)
         feature_cols = ["kre", "delta_from_baseline", "ratio_from_baseline", "ewma", "rolling_cv", "slope_short"]
@@ -436,23 +418,35 @@ class LABPredictor:
         
         # Build model
         n_features = combined_features.shape[1]
-        model = self._build_multi_output_model(seq_len, n_features)
-        
-        # Callbacks
-        callbacks = [
-            EarlyStopping(patience=5, restore_best_weights=True, verbose=0),
-            ReduceLROnPlateau(factor=0.7, patience=3, min_lr=0.0001, verbose=0)
-        ]
-        
-        # Train
-        try:
-            model.fit(X, y_list, epochs=50, batch_size=min(8, len(X)), 
-                     validation_split=0.2, callbacks=callbacks, verbose=0, shuffle=False)
-        except Exception as e:
-            print(f"⚠️ Multi-output training failed for {patient_code}: {e}")
-            return self._simple_prediction_multi(unified_df)
+        model = self._templated(("lab_multi", seq_len, n_features),
+                                lambda: self._build_multi_output_model(seq_len, n_features))
+        
+        # Unchanged patient: reload stored weights + scaler instead of retraining
+        store_key, stored_scaler = None, None
+        if self.model_store is not None:
+            store_key = self.model_store.key("lab_multi", patient_code, data_digest(X, *y_list),
+                                             "multi_output", seq_len)
+            stored_scaler = self.model_store.load(store_key, model)
+        
+        if stored_scaler is not None:
+            self.scalers[f"{patient_code}_multi"] = stored_scaler
+            self._fit_paths.append("model_store")
+        else:
+            # Train (early stopping; epochs/time capped by the training budget, if any)
+            try:
+                self._fit_paths.append(fit_model(model, X, y_list, self.budget))
+            except Exception as e:
+                print(f"⚠️ Multi-output training failed for {patient_code}: {e}")
+                return self._simple_prediction_multi(unified_df)
+            
+            # Fits cut short by the budget (keras_budget / keras_plateau) are not final weights:
+            # storing them would let a later unbudgeted run reload them as fully trained
+            if store_key is not None and self._fit_paths[-1] == "keras":
+                self.model_store.save(store_key, model, self.scalers[f"{patient_code}_multi"])
         
-        self.models[f"{patient_code}_multi"] = model
+        if self.templates is None:
+            # Templates are shared across patients; only keep models owned by one patient
+            self.models[f"{patient_code}_multi"] = model
         
         # Generate predictions for unified grid
         kre_pred, gfr_pred = self._generate_predictions_multi_unified(
@@ -561,6 +555,93 @@ class LABPredictor:
         
         return kre_pred_list, gfr_pred_list
     
+    @staticmethod
+    def _windows(features_norm: np.ndarray, window_starts: List[int], seq_len: int) -> np.ndarray:
+        """(n_windows, seq_len, n_features) float32 windows starting at window_starts"""
+        if not window_starts:
+            return np.empty((0, seq_len, features_norm.shape[1]), dtype=np.float32)
+        idx = np.asarray(window_starts)[:, None] + np.arange(seq_len)
+        return features_norm[idx].astype(np.float32)
+    
+    def _predict_windows(self, model: Any, windows: np.ndarray
+                         ) -> Tuple[np.ndarray, Optional[Tuple[np.ndarray, np.ndarray]]]:
+        """
+        Model outputs for all windows as (n_windows, n_outputs), plus the MC
+        dropout (lo, hi) arrays of the same shape (None in band mode); normalized units
+        """
+        if len(windows) == 0:
+            return np.empty((0, 0)), None
+        if use_mc_dropout(self.config):
+            pred, lo, hi = mc_dropout_predict(model, windows, self.config)
+            return pred, (lo, hi)
+        # predict_on_batch: one compiled call, none of predict()'s per-call setup
+        preds = model.predict_on_batch(windows)
+        if isinstance(preds, (list, tuple)):
+            return np.stack([np.asarray(p).reshape(-1) for p in preds], axis=-1), None
+        return np.asarray(preds).reshape(len(windows), -1), None
+    
+    @staticmethod
+    def _grid_lookups(unified_df: pd.DataFrame, n_features: int
+                      ) -> Tuple[List[int], Dict[int, int], List[int]]:
+        """
+        Row time_orders, time_order -> features_norm index (row position, later
+        duplicates win) and the sorted orders that have features
+        """
+        orders = unified_df["time_order"].tolist()
+        order_to_idx = {order: i for i, order in enumerate(orders) if i < n_features}
+        return orders, order_to_idx, sorted(order_to_idx)
+    
+    @staticmethod
+    def _last_before(sorted_orders: List[int], time_order: int) -> Optional[int]:
+        """Largest order in sorted_orders below time_order"""
+        pos = bisect_left(sorted_orders, time_order)
+        return sorted_orders[pos - 1] if pos > 0 else None
+    
+    @staticmethod
+    def _valid_orders(lookup: Dict[int, Any]) -> List[int]:
+        """Sorted orders whose value is present and not NaN"""
+        return sorted(o for o, v in lookup.items() if v is not None and not np.isnan(v))
+    
+    def _plan_grid(self, unified_df: pd.DataFrame, orders: List[int], order_to_idx: Dict[int, int],
+                   known_orders: List[int], n_features: int, seq_len: int) -> Tuple[list, List[int]]:
+        """
+        Pass 1 of the unified-grid generators: one (time_key, time_order, kind, arg)
+        entry per row and the model windows they need.
+
+        kind "ok" / "forecast": arg is the row's window in the batch;
+        "warmup": not enough history (arg unused);
+        "fallback": forecast without a full window, arg is the last known order;
+        "mean": forecast with no history.
+        """
+        plan = []
+        window_starts = []  # start index into features_norm, one per model call
+        seen_data = False   # a row with features has been passed
+        
+        for time_key, time_order in zip(unified_df["time_key"].tolist(), orders):
+            idx = order_to_idx.get(time_order)
+            if idx is not None:
+                # We have actual data - use model prediction
+                seen_data = True
+                if idx >= seq_len and n_features > seq_len:
+                    plan.append((time_key, time_order, "ok", len(window_starts)))
+                    window_starts.append(idx - seq_len)
+                else:
+                    plan.append((time_key, time_order, "warmup", None))
+            elif seen_data and n_features >= seq_len:
+                # Forecast: no actual data, use model with last known sequence
+                last_order = self._last_before(known_orders, time_order)
+                last_idx = order_to_idx[last_order] if last_order is not None else None
+                if last_idx is not None and last_idx >= seq_len - 1:
+                    plan.append((time_key, time_order, "forecast", len(window_starts)))
+                    window_starts.append(last_idx - seq_len + 1)
+                else:
+                    plan.append((time_key, time_order, "fallback", None))
+            else:
+                # No history, use mean
+                plan.append((time_key, time_order, "mean", None))
+        
+        return plan, window_starts
+    
     def _generate_predictions_single_unified(self, model: Any, features_norm: np.ndarray,
                                              targets: np.ndarray, unified_df: pd.DataFrame,
                                              seq_len: int, value_mean: float, value_std: float,
@@ -570,73 +651,48 @@ class LABPredictor:
         Forecast horizon: Day_7 to Month_12 (order 7-22)
         """
         # Create lookup for actual values and features by time_order
-        value_lookup = {}
-        order_to_idx = {}  # Map time_order to features_norm index
-        for i, (_, row) in enumerate(unified_df.iterrows()):
-            order = row.get("time_order")
-            if order is not None:
-                value_lookup[order] = row.get(metric.lower())
-                if i < len(features_norm):
-                    order_to_idx[order] = i
+        orders, order_to_idx, known_orders = self._grid_lookups(unified_df, len(features_norm))
+        value_lookup = dict(zip(orders, unified_df[metric.lower()].tolist()))
+        valid_orders = self._valid_orders(value_lookup)
         
-        predictions = []
-        forecast_features = None
+        # Pass 1: decide every row; Pass 2: all in-sample and forecast windows in one batched call
+        plan, window_starts = self._plan_grid(unified_df, orders, order_to_idx, known_orders,
+                                              len(features_norm), seq_len)
+        model_preds, mc_bands = self._predict_windows(model, self._windows(features_norm, window_starts, seq_len))
         
-        # Generate predictions for unified grid (all has_lab=True time_keys)
-        for _, row in unified_df.iterrows():
-            time_order = row.get("time_order")
-            time_key = row.get("time_key")
+        predictions = []
+        for time_key, time_order, kind, arg in plan:
             actual_val = value_lookup.get(time_order)
-            idx = order_to_idx.get(time_order)
+            has_actual = actual_val is not None and not np.isnan(actual_val)
+            mc_band = None
             
-            if idx is not None and idx < len(features_norm):
-                # We have actual data - use model prediction
-                forecast_features = features_norm[idx]
-                
-                if idx >= seq_len and len(features_norm) > seq_len:
-                    # Use model
-                    seq = features_norm[idx-seq_len:idx].reshape(1, seq_len, -1)
-                    pred_norm = model.predict(seq, verbose=0)[0, 0]
-                    pred = pred_norm * value_std + value_mean
-                    pred_status = "ok"
-                else:
-                    # Not enough history, use actual value or simple extrapolation
-                    if actual_val is not None and not np.isnan(actual_val):
-                        pred = actual_val
-                        pred_status = "warmup_copy"
-                    else:
-                        pred = value_mean
-                        pred_status = "warmup_bootstrap"
+            if kind in ("ok", "forecast"):
+                pred = model_preds[arg][0] * value_std + value_mean
+                if mc_bands is not None:
+                    mc_band = (mc_bands[0][arg], mc_bands[1][arg])
+            elif kind == "warmup":
+                # Not enough history, use actual value or simple extrapolation
+                pred = actual_val if has_actual else value_mean
+            elif kind == "fallback":
+                # Fallback: use last known value or mean
+                last_order = self._last_before(valid_orders, time_order)
+                pred = value_lookup[last_order] if last_order is not None else value_mean
+            else:
+                pred = value_mean
+            
+            if kind == "ok":
+                pred_status = "ok"
+            elif kind == "warmup":
+                pred_status = "warmup_copy" if has_actual else "warmup_bootstrap"
             else:
-                # Forecast: no actual data, use model with last known sequence
-                if forecast_features is not None and len(features_norm) >= seq_len:
-                    # Find last known index
-                    last_idx = None
-                    for o in sorted(order_to_idx.keys(), reverse=True):
-                        if o < time_order:
-                            last_idx = order_to_idx[o]
-                            break
-                    
-                    if last_idx is not None and last_idx >= seq_len - 1:
-                        # Use last seq_len features for forecast
-                        seq = features_norm[last_idx-seq_len+1:last_idx+1].reshape(1, seq_len, -1)
-                        pred_norm = model.predict(seq, verbose=0)[0, 0]
-                        pred = pred_norm * value_std + value_mean
-                    else:
-                        # Fallback: use last known value or mean
-                        last_val = None
-                        for o in sorted(value_lookup.keys(), reverse=True):
-                            if o < time_order and value_lookup[o] is not None and not np.isnan(value_lookup[o]):
-                                last_val = value_lookup[o]
-                                break
-                        pred = last_val if last_val is not None else value_mean
-                else:
-                    # No history, use mean
-                    pred = value_mean
                 pred_status = "forecast"
             
             # Confidence intervals (wider for forecasts)
-            if actual_val is None or np.isnan(actual_val):
+            if mc_band is not None:
+                # MC dropout quantiles, widened to contain the deterministic prediction
+                pred_lo = min(mc_band[0][0] * value_std + value_mean, pred)
+                pred_hi = max(mc_band[1][0] * value_std + value_mean, pred)
+            elif not has_actual:
                 # Forecast: wider confidence interval
                 pred_lo = pred * 0.75 if metric == "kre" else pred * 0.85
                 pred_hi = pred * 1.25 if metric == "kre" else pred * 1.15
@@ -648,7 +704,7 @@ class LABPredictor:
             pred, pred_lo, pred_hi = self._sanitize_prediction(metric, pred, pred_lo, pred_hi)
             
             # Residual (only if actual exists)
-            residual = (actual_val - pred) if actual_val is not None and not np.isnan(actual_val) else None
+            residual = (actual_val - pred) if has_actual else None
             
             predictions.append({
                 "time_order": time_order,
@@ -674,20 +730,10 @@ class LABPredictor:
         Forecast horizon: Day_7 to Month_12 (order 7-22)
         """
         # Create lookup for actual values and features by time_order
-        kre_lookup = {}
-        gfr_lookup = {}
-        order_to_idx = {}
-        for i, (_, row) in enumerate(unified_df.iterrows()):
-            order = row.get("time_order")
-            if order is not None:
-                kre_lookup[order] = row.get("kre")
-                gfr_lookup[order] = row.get("gfr")
-                if i < len(features_norm):
-                    order_to_idx[order] = i
-        
-        kre_pred_list = []
-        gfr_pred_list = []
-        forecast_features = None
+        orders, order_to_idx, known_orders = self._grid_lookups(unified_df, len(features_norm))
+        kre_lookup = dict(zip(orders, unified_df["kre"].tolist()))
+        gfr_lookup = dict(zip(orders, unified_df["gfr"].tolist()))
+        kre_valid, gfr_valid = self._valid_orders(kre_lookup), self._valid_orders(gfr_lookup)
         
         # KRE and GFR means/stds
         kre_mean = mean[0]
@@ -695,82 +741,63 @@ class LABPredictor:
         gfr_mean = mean[len(mean)//2]
         gfr_std = std[len(std)//2]
         
-        # Generate predictions for unified grid
-        for _, row in unified_df.iterrows():
-            time_order = row.get("time_order")
-            time_key = row.get("time_key")
+        # Pass 1: decide every row; Pass 2: all in-sample and forecast windows in one batched call
+        plan, window_starts = self._plan_grid(unified_df, orders, order_to_idx, known_orders,
+                                              len(features_norm), seq_len)
+        model_preds, mc_bands = self._predict_windows(model, self._windows(features_norm, window_starts, seq_len))
+        
+        kre_pred_list = []
+        gfr_pred_list = []
+        for time_key, time_order, kind, arg in plan:
             kre_actual = kre_lookup.get(time_order)
             gfr_actual = gfr_lookup.get(time_order)
-            idx = order_to_idx.get(time_order)
+            has_kre = kre_actual is not None and not np.isnan(kre_actual)
+            has_gfr = gfr_actual is not None and not np.isnan(gfr_actual)
+            mc_band = None
             
-            if idx is not None and idx < len(features_norm):
-                # We have actual data - use model prediction
-                forecast_features = features_norm[idx]
-                
-                if idx >= seq_len and len(features_norm) > seq_len:
-                    # Use model
-                    seq = features_norm[idx-seq_len:idx].reshape(1, seq_len, -1)
-                    preds = model.predict(seq, verbose=0)
-                    kre_pred_norm = preds[0][0, 0]
-                    gfr_pred_norm = preds[1][0, 0]
-                    kre_pred = kre_pred_norm * kre_std + kre_mean
-                    gfr_pred = gfr_pred_norm * gfr_std + gfr_mean
-                    kre_status = "ok"
-                    gfr_status = "ok"
-                else:
-                    # Not enough history, use actual values or mean
-                    kre_pred = kre_actual if kre_actual is not None and not np.isnan(kre_actual) else kre_mean
-                    gfr_pred = gfr_actual if gfr_actual is not None and not np.isnan(gfr_actual) else gfr_mean
-                    kre_status = "warmup_copy" if kre_actual is not None and not np.isnan(kre_actual) else "warmup_bootstrap"
-                    gfr_status = "warmup_copy" if gfr_actual is not None and not np.isnan(gfr_actual) else "warmup_bootstrap"
+            if kind in ("ok", "forecast"):
+                kre_pred_norm, gfr_pred_norm = model_preds[arg]
+                kre_pred = kre_pred_norm * kre_std + kre_mean
+                gfr_pred = gfr_pred_norm * gfr_std + gfr_mean
+                if mc_bands is not None:
+                    mc_band = (mc_bands[0][arg], mc_bands[1][arg])
+            elif kind == "warmup":
+                # Not enough history, use actual values or mean
+                kre_pred = kre_actual if has_kre else kre_mean
+                gfr_pred = gfr_actual if has_gfr else gfr_mean
+            elif kind == "fallback":
+                # Fallback: use last known values or mean
+                last_kre = self._last_before(kre_valid, time_order)
+                last_gfr = self._last_before(gfr_valid, time_order)
+                kre_pred = kre_lookup[last_kre] if last_kre is not None else kre_mean
+                gfr_pred = gfr_lookup[last_gfr] if last_gfr is not None else gfr_mean
             else:
-                # Forecast: no actual data, use model with last known sequence
-                if forecast_features is not None and len(features_norm) >= seq_len:
-                    # Find last known index
-                    last_idx = None
-                    for o in sorted(order_to_idx.keys(), reverse=True):
-                        if o < time_order:
-                            last_idx = order_to_idx[o]
-                            break
-                    
-                    if last_idx is not None and last_idx >= seq_len - 1:
-                        # Use last seq_len features for forecast
-                        seq = features_norm[last_idx-seq_len+1:last_idx+1].reshape(1, seq_len, -1)
-                        preds = model.predict(seq, verbose=0)
-                        kre_pred_norm = preds[0][0, 0]
-                        gfr_pred_norm = preds[1][0, 0]
-                        kre_pred = kre_pred_norm * kre_std + kre_mean
-                        gfr_pred = gfr_pred_norm * gfr_std + gfr_mean
-                    else:
-                        # Fallback: use last known values or mean
-                        last_kre = None
-                        last_gfr = None
-                        for o in sorted(kre_lookup.keys(), reverse=True):
-                            if o < time_order:
-                                if last_kre is None and kre_lookup[o] is not None and not np.isnan(kre_lookup[o]):
-                                    last_kre = kre_lookup[o]
-                                if last_gfr is None and gfr_lookup[o] is not None and not np.isnan(gfr_lookup[o]):
-                                    last_gfr = gfr_lookup[o]
-                                if last_kre is not None and last_gfr is not None:
-                                    break
-                        kre_pred = last_kre if last_kre is not None else kre_mean
-                        gfr_pred = last_gfr if last_gfr is not None else gfr_mean
-                else:
-                    # No history, use mean
-                    kre_pred = kre_mean
-                    gfr_pred = gfr_mean
-                kre_status = "forecast"
-                gfr_status = "forecast"
+                kre_pred = kre_mean
+                gfr_pred = gfr_mean
             
-            # Confidence intervals (wider for forecasts)
-            if kre_actual is None or np.isnan(kre_actual):
+            if kind == "ok":
+                kre_status = gfr_status = "ok"
+            elif kind == "warmup":
+                kre_status = "warmup_copy" if has_kre else "warmup_bootstrap"
+                gfr_status = "warmup_copy" if has_gfr else "warmup_bootstrap"
+            else:
+                kre_status = gfr_status = "forecast"
+            
+            # Confidence intervals (wider for forecasts; MC dropout quantiles when enabled)
+            if mc_band is not None:
+                kre_pred_lo = min(mc_band[0][0] * kre_std + kre_mean, kre_pred)
+                kre_pred_hi = max(mc_band[1][0] * kre_std + kre_mean, kre_pred)
+            elif not has_kre:
                 kre_pred_lo = kre_pred * 0.75
                 kre_pred_hi = kre_pred * 1.25
             else:
                 kre_pred_lo = kre_pred * 0.85
                 kre_pred_hi = kre_pred * 1.15
             
-            if gfr_actual is None or np.isnan(gfr_actual):
+            if mc_band is not None:
+                gfr_pred_lo = min(mc_band[0][1] * gfr_std + gfr_mean, gfr_pred)
+                gfr_pred_hi = max(mc_band[1][1] * gfr_std + gfr_mean, gfr_pred)
+            elif not has_gfr:
                 gfr_pred_lo = gfr_pred * 0.85
                 gfr_pred_hi = gfr_pred * 1.15
             else:
@@ -781,8 +808,8 @@ class LABPredictor:
             gfr_pred, gfr_pred_lo, gfr_pred_hi = self._sanitize_prediction("gfr", gfr_pred, gfr_pred_lo, gfr_pred_hi)
             
             # Residuals
-            kre_residual = (kre_actual - kre_pred) if kre_actual is not None and not np.isnan(kre_actual) else None
-            gfr_residual = (gfr_actual - gfr_pred) if gfr_actual is not None and not np.isnan(gfr_actual) else None
+            kre_residual = (kre_actual - kre_pred) if has_kre else None
+            gfr_residual = (gfr_actual - gfr_pred) if has_gfr else None
             
             kre_pred_list.append({
                 "time_order": time_order,
@@ -903,32 +930,165 @@ class LABPredictor:
         else:
             return {}
     
-    def bulk_train(self, lab_long: pd.DataFrame) -> Dict[str, dict]:
-        """Train models for all patients"""
-        results = {}
-        patients = lab_long["patient_code"].unique()
+    def bulk_train(self, lab_long: pd.DataFrame, panel: PatientPanel = None,
+                   patients: Optional[List[str]] = None, workers: int = 1,
+                   budget: Optional[TrainingBudget] = None) -> Dict[str, dict]:
+        """
+        Train models for all patients (or only `patients`, e.g. the dirty ones of an incremental run)
+        
+        Each patient is trained under its own seed (parallel_training.patient_seed), so
+        workers > 1 shards patients across processes with the same results.
+        budget: wall-clock TrainingBudget for the per-patient models (see train_patients).
+        """
+        if panel is None:
+            panel = PatientPanel(lab_long=lab_long)
+        wanted = None if patients is None else set(patients)
+        patients = [p for p in panel.lab_patients if wanted is None or p in wanted]
+        
+        if self._use_numpy_engine():
+            print(f"🧮 Forecasting LAB for {len(patients)} patients with the NumPy engine...")
+            return self.bulk_forecast(panel, patients)
+        
+        if resolve_engine(self.config, HAS_TF) == "joint":
+            self.joint = self.joint or JointForecaster(self.config)
+            return self.bulk_forecast(panel, patients, joint=self.joint)
         
         print(f"🧠 Training LAB models for {len(patients)} patients...")
         
-        for i, patient in enumerate(patients):
-            patient_df = lab_long[lab_long["patient_code"] == patient].copy()
-            result = self.train_patient_model(patient, patient_df)
-            results[patient] = result
-            
-            if (i + 1) % 10 == 0:
-                print(f"   Trained {i+1}/{len(patients)} models")
+        if workers > 1 and HAS_TF and len(patients) > 1:
+            costs = {p: self.training_cost(panel.lab(p)) for p in patients}
+            results = train_patients_parallel("lab", self.config, panel, patients, workers,
+                                              self.model_store, budget, costs)
+        else:
+            results = self.train_patients(panel, patients, budget=budget)
         
         print(f"✅ All LAB models trained")
         return results
+    
+    def bulk_forecast(self, panel: PatientPanel, patients: List[str],
+                      joint: Optional[JointForecaster] = None) -> Dict[str, dict]:
+        """
+        Forecast KRE and GFR on every patient's unified LAB grid with the NumPy engine
+        
+        Returns the per-metric format ({"kre": {"predictions": [...]}, "gfr": ...}),
+        with a metric only for patients that have >= 3 values of it, like the
+        Keras path. The filter runs on winsorized values; residuals use the raw ones.
+        With `joint`, the grid forecasts come from the cohort-wide JointForecaster.
+        """
+        grid_keys, orders = list(UNIFIED_LAB_KEYS), list(UNIFIED_LAB_ORDERS)
+        grids = dict(zip(("kre", "gfr"), panel.lab_grid(patients)))
+        engine = numpy_engine(self.config)
+        
+        # (interval half-widths, bounds, rounding) per metric, as in the Keras path
+        settings = {"kre": ((0.15, 0.25), (0.0, 15.0), 2), "gfr": ((0.10, 0.15), (0.0, 180.0), 1)}
+        train_path = "numpy" if joint is None else "joint"
+        results: Dict[str, dict] = {p: {"train_path": train_path} for p in patients}
+        gfr_items = []
+        for metric, (rel_band, (lower, upper), digits) in settings.items():
+            values = grids[metric]
+            if joint is None:
+                forecast = engine.forecast(self._winsorize_values(values, metric), rel_band=rel_band)
+            else:
+                forecast = joint.forecast(panel, patients, metric, grid_keys)
+            pred, pred_lo, pred_hi = sanitize(forecast.pred, forecast.lo, forecast.hi, lower, upper)
+            residual = values - pred
+            
+            enough = (~np.isnan(values)).sum(axis=1) >= 3
+            pred, pred_lo, pred_hi, residual = (
+                np.where(np.isnan(a), None, np.round(a, digits)).tolist() for a in (pred, pred_lo, pred_hi, residual)
+            )
+            status = forecast.status.tolist()
+            actual = values.tolist()
+            
+            for i, patient in enumerate(patients):
+                if not enough[i]:
+                    continue
+                predictions = [
+                    {
+                        "time_order": orders[j],
+                        "time_key": grid_keys[j],
+                        f"{metric}_pred": pred[i][j],
+                        f"{metric}_pred_lo": pred_lo[i][j],
+                        f"{metric}_pred_hi": pred_hi[i][j],
+                        f"{metric}_pred_status": status[i][j],
+                        "residual": residual[i][j],
+                    }
+                    for j in range(len(grid_keys))
+                ]
+                if metric == "gfr":
+                    gfr_items.append((predictions, dict(zip(orders, actual[i]))))
+                results[patient][metric] = {"predictions": predictions}
+        
+        # GFR bias calibration for the whole cohort in one batch
+        self._calibrate_gfr_batch(gfr_items)
+        return results
+    
+    def training_cost(self, lab_df: pd.DataFrame) -> float:
+        """Relative training cost (measurements x models) used to share a training budget"""
+        n_points = len(lab_df)
+        if n_points < 3:
+            return 0.0
+        if self.use_multi_output:
+            return n_points * COMPLEXITY_COST["multi_output"]
+        return 2 * n_points * COMPLEXITY_COST["medium"]
+    
+    def train_patients(self, panel: PatientPanel, patients: List[str], report_every: int = 10,
+                       budget: Optional[TrainingBudget] = None) -> Dict[str, dict]:
+        """
+        Train `patients` one after another in this process (features computed in one batch)
+        
+        With a budget, patients whose training no longer fits get the NumPy engine;
+        every result records its "train_path".
+        """
+        patient_dfs = [panel.lab(patient).copy() for patient in patients]
+        if HAS_TF:
+            unified_dfs = self.batch_unified_grid(panel, patients)
+            features = self.patient_features(unified_dfs)
+        else:
+            unified_dfs = features = [None] * len(patients)
+        costs = [self.training_cost(df) for df in patient_dfs]
+        if budget is not None:
+            budget.plan(costs)
+        
+        results, over_budget = {}, []
+        self.budget = budget
+        self._gfr_pending = []  # GFR calibration runs once for all patients below
+        try:
+            for i, patient in enumerate(patients):
+                seed_patient(self.config, patient)
+                if budget is not None and not budget.begin(costs[i]):
+                    over_budget.append(patient)
+                    continue
+                self._fit_paths = []
+                result = self.train_patient_model(patient, patient_dfs[i], unified_dfs[i], features[i])
+                if budget is not None:
+                    budget.end()
+                if result is not None:
+                    result.setdefault("train_path", combine_paths(self._fit_paths))
+                results[patient] = result
+                
+                if report_every and (i + 1) % report_every == 0:
+                    print(f"   Trained {i+1}/{len(patients)} models")
+            self._calibrate_gfr_batch(self._gfr_pending)
+        finally:
+            self.budget = None
+            self._gfr_pending = None
+        
+        if over_budget:
+            print(f"   Training budget used up: {len(over_budget)} patients fall back to the NumPy engine")
+            for patient, result in self.bulk_forecast(panel, over_budget).items():
+                result["train_path"] = "budget_fallback"
+                results[patient] = result
+        return {p: results[p] for p in patients}
 
 
 if __name__ == "__main__":
     from io_excel import load_all_data
     
-    meta, kmr_long, lab_long, improved, raw = load_all_data()
+    meta, kmr_long, lab_long, improved, raw, panel = load_all_data()
     
     predictor = LABPredictor()
-    results = predictor.bulk_train(lab_long)
+    results = predictor.bulk_train(lab_long, panel)
     
     print("\nSample result:")
     sample_patient = list(results.keys())[0]
@@ -0,0 +1,141 @@
+"""
+Model Store - On-disk registry of trained per-patient KMR/LAB model weights
+
+An entry is keyed by the patient code, a hash of the exact training arrays,
+the model variant (complexity / seq_len) and the model-relevant config, so a
+patient whose data did not change reloads its weights and scalers instead of
+being retrained. Entries are plain pickles of get_weights() + scaler arrays:
+the architecture is rebuilt by the predictor and only the weights are set.
+"""
+import hashlib
+import json
+import os
+import pickle
+import time
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+import numpy as np
+
+from .config import MODEL_CONFIG, MODEL_STORE_DIR, MODEL_STORE_CONFIG
+
+
+# Bump when model architectures/training change so stale weights are ignored
+MODEL_STORE_VERSION = 1
+ENTRY_SUFFIX = ".pkl"
+
+
+def data_digest(*arrays: np.ndarray) -> str:
+    """SHA-256 over the dtype, shape and bytes of each training array"""
+    digest = hashlib.sha256()
+    for arr in arrays:
+        arr = np.ascontiguousarray(arr)
+        digest.update(f"{arr.dtype.str}{arr.shape}".encode("utf-8"))
+        digest.update(arr.tobytes())
+    return digest.hexdigest()
+
+
+class ModelStore:
+    """Content-addressed weight store with age/size eviction (safe to delete at any time)"""
+
+    def __init__(self, root: Path = None, config: dict = None, store_config: dict = None):
+        self.root = Path(root or MODEL_STORE_DIR)
+        self.config = config or MODEL_CONFIG
+        self.store_config = store_config or MODEL_STORE_CONFIG
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, kind: str, patient_code: str, data_hash: str, complexity: str, seq_len: int) -> str:
+        """Entry key: model kind + patient + training data hash + variant + relevant config"""
+        payload = json.dumps(
+            {
+                "kind": kind,
+                "patient": str(patient_code),
+                "data": data_hash,
+                "complexity": complexity,
+                "seq_len": int(seq_len),
+                "random_seed": self.config.get("random_seed"),
+                "complexity_thresholds": self.config.get("complexity_thresholds"),
+                "seq_len_min": self.config.get("seq_len_min"),
+                "seq_len_max": self.config.get("seq_len_max"),
+                "version": MODEL_STORE_VERSION,
+            },
+            sort_keys=True,
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:32]
+
+    def _path(self, key: str) -> Path:
+        return self.root / key[:2] / f"{key}{ENTRY_SUFFIX}"
+
+    def load(self, key: str, model: Any) -> Optional[Dict[str, np.ndarray]]:
+        """Set stored weights on `model` and return its scaler; None on miss or unreadable entry"""
+        path = self._path(key)
+        if not path.exists():
+            self.misses += 1
+            return None
+
+        try:
+            with open(path, "rb") as f:
+                entry = pickle.load(f)
+            model.set_weights(entry["weights"])
+            os.utime(path)  # eviction by age counts from last use
+        except Exception as e:
+            print(f"⚠️ Ignoring unreadable model store entry {key}: {e}")
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        return entry["scaler"]
+
+    def save(self, key: str, model: Any, scaler: Dict[str, np.ndarray]) -> None:
+        """Persist model weights + scaler under key (written to a temp file, then renamed)"""
+        path = self._path(key)
+        tmp_path = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            entry = {
+                "weights": [np.asarray(w) for w in model.get_weights()],
+                "scaler": {k: np.asarray(v) for k, v in scaler.items()},
+                "version": MODEL_STORE_VERSION,
+            }
+            with open(tmp_path, "wb") as f:
+                pickle.dump(entry, f, protocol=pickle.HIGHEST_PROTOCOL)
+            tmp_path.replace(path)
+        except Exception as e:
+            # The store is an optimization only; never fail training because of it
+            print(f"⚠️ Could not write model store entry {key}: {e}")
+            tmp_path.unlink(missing_ok=True)
+
+    def evict(self, max_age_days: float = None, max_size_mb: float = None) -> int:
+        """
+        Drop entries unused for more than max_age_days, then the least recently
+        used ones until the store fits in max_size_mb. Returns entries removed.
+        """
+        if not self.root.exists():
+            return 0
+        max_age_days = self.store_config["max_age_days"] if max_age_days is None else max_age_days
+        max_size_mb = self.store_config["max_size_mb"] if max_size_mb is None else max_size_mb
+
+        entries = []
+        for path in self.root.glob(f"*/*{ENTRY_SUFFIX}"):
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        entries.sort()  # oldest first
+
+        cutoff = time.time() - max_age_days * 86400
+        budget = max_size_mb * 1024 * 1024
+        total = sum(size for _, size, _ in entries)
+        removed = 0
+        for mtime, size, path in entries:
+            if mtime >= cutoff and total <= budget:
+                break
+            path.unlink(missing_ok=True)
+            total -= size
+            removed += 1
+        return removed
+
+    def summary(self) -> str:
+        return f"{self.hits} reused, {self.misses} trained"
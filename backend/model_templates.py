@@ -0,0 +1,114 @@
+"""
+Model Templates - Reusable compiled Keras models for per-patient training
+
+Per-patient models only differ by architecture and input shape, and building
++ compiling a graph often costs more than training it on a few dozen windows.
+ModelTemplateCache keeps one compiled model per (architecture, seq_len,
+n_features) key and hands it out with freshly drawn weights and a reset
+optimizer, so the traced train/predict functions are reused across patients.
+
+Fresh weights come from each layer's own initializers, re-seeded from the
+NumPy RNG (seed_patient seeds it per patient), and are drawn for new and
+reused templates alike. The state of every dropout seed generator is re-seeded
+the same way, so neither a patient's initial weights nor its dropout masks
+depend on which patients were trained before it in the same process (or on
+how --workers chunks the cohort).
+"""
+from collections import OrderedDict
+from typing import Any, Callable, Hashable
+
+import numpy as np
+
+from .tf_backend import tf
+
+# Weight variable name -> initializer attribute on the layer (or RNN cell)
+_INITIALIZER_ATTRS = {
+    "kernel": "kernel_initializer",
+    "recurrent_kernel": "recurrent_initializer",
+    "bias": "bias_initializer",
+}
+
+
+def _reseeded(initializer: Any) -> Any:
+    """Copy of a Keras initializer with a seed drawn from the NumPy RNG (unseeded kinds as-is)"""
+    config = initializer.get_config()
+    if "seed" not in config:
+        return initializer
+    config["seed"] = int(np.random.randint(0, 2 ** 31 - 1))
+    return initializer.__class__.from_config(config)
+
+
+def _initial_value(owner: Any, name: str, shape: tuple, dtype: Any) -> Any:
+    initializer = getattr(owner, _INITIALIZER_ATTRS[name])
+    if name == "bias" and getattr(owner, "unit_forget_bias", False):
+        # LSTM: forget gate bias starts at 1 (same layout as LSTMCell.build)
+        units = owner.units
+        init = _reseeded(initializer)
+        return tf.concat([init((units,), dtype=dtype), tf.ones((units,), dtype=dtype),
+                          init((2 * units,), dtype=dtype)], axis=0)
+    return _reseeded(initializer)(shape, dtype=dtype)
+
+
+def reinitialize(model: Any, learning_rate: float) -> None:
+    """Draw new initial weights and dropout seeds for every layer and reset the optimizer state"""
+    for layer in model.layers:
+        owner = getattr(layer, "cell", layer)
+        for var in owner.weights:
+            name = var.name.split("/")[-1].split(":")[0]
+            if name not in _INITIALIZER_ATTRS:
+                raise ValueError(f"No initializer known for weight {var.name!r} of layer {layer.name!r}")
+            var.assign(_initial_value(owner, name, tuple(var.shape), var.dtype))
+        # Dropout (Dropout layers, RNN cells): the generator state advances with every
+        # masked call, so it would otherwise carry over from the previous patient
+        for generator in getattr(owner, "_seed_generators", ()):
+            seed = int(np.random.randint(1, 2 ** 31 - 1))
+            generator.state.assign(np.array([seed, 0], dtype=generator.state.dtype))
+
+    optimizer = model.optimizer
+    for var in optimizer.variables:
+        var.assign(tf.zeros_like(var))
+    optimizer.learning_rate = learning_rate
+
+
+class ModelTemplateCache:
+    """LRU cache of compiled models; `get` returns one ready to train from scratch"""
+
+    def __init__(self, max_templates: int = 16):
+        self.max_templates = max(1, int(max_templates))
+        self._templates: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self.built = 0
+        self.reused = 0
+
+    def get(self, key: Hashable, build: Callable[[], Any]) -> Any:
+        """
+        Compiled model for `key` with fresh weights; `build` is called on a miss.
+
+        A template whose weights cannot be re-initialized is dropped and rebuilt,
+        so an unexpected layer type costs speed, never correctness.
+        """
+        entry = self._templates.pop(key, None)
+        if entry is not None:
+            model, learning_rate = entry
+            try:
+                reinitialize(model, learning_rate)
+                self.reused += 1
+                self._templates[key] = entry
+                return model
+            except Exception:
+                pass
+
+        model = build()
+        self.built += 1
+        learning_rate = float(np.asarray(model.optimizer.learning_rate))
+        try:
+            reinitialize(model, learning_rate)
+        except Exception:
+            # Train this one with its build-time weights and do not keep it as a template
+            return model
+        self._templates[key] = (model, learning_rate)
+        while len(self._templates) > self.max_templates:
+            self._templates.popitem(last=False)
+        return model
+
+    def summary(self) -> str:
+        return f"{self.built} built, {self.reused} reused"
@@ -0,0 +1,123 @@
+"""
+Parallel Training - Shard per-patient model training across worker processes
+
+Every patient is trained under its own seed derived from MODEL_CONFIG
+random_seed and the patient code, both sequentially and in workers, so
+predictions do not depend on the worker count or on which worker a
+patient lands in. Workers are spawned (TensorFlow is not fork-safe) and
+each gets a small TF thread pool so N workers do not oversubscribe the CPU.
+"""
+import hashlib
+import os
+import random
+import time
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import get_context
+from typing import Dict, List, Tuple
+
+import numpy as np
+import pandas as pd
+
+from . import tf_backend
+
+
+def patient_seed(base_seed: int, patient_code: str) -> int:
+    """Stable per-patient seed (independent of training order and PYTHONHASHSEED)"""
+    digest = hashlib.sha256(f"{int(base_seed)}:{patient_code}".encode("utf-8")).digest()
+    return int.from_bytes(digest[:4], "little") & 0x7FFFFFFF
+
+
+def seed_patient(config: dict, patient_code: str) -> None:
+    """Reset Python/NumPy/TF RNGs to the patient's seed before training it"""
+    seed = patient_seed(config.get("random_seed", 42), patient_code)
+    random.seed(seed)
+    np.random.seed(seed)
+    tf_backend.set_random_seed(seed)
+
+
+def _init_worker(tf_threads: int) -> None:
+    """Limit the worker's TF thread pools (must run before its first TF op)"""
+    os.environ["OMP_NUM_THREADS"] = str(tf_threads)
+    os.environ["TF_NUM_INTRAOP_THREADS"] = str(tf_threads)
+    os.environ["TF_NUM_INTEROP_THREADS"] = "1"
+    # The env vars above configure TF whenever a worker first loads it; only
+    # determinism needs the loader (workers using the NumPy engine never import TF)
+    tf_backend.enable_op_determinism()
+
+
+def _train_shard(kind: str, config: dict, shard_long: pd.DataFrame, patients: List[str],
+                 model_store=None, budget=None) -> Tuple[Dict[str, dict], int, float, Tuple[int, int]]:
+    """Worker entry point: train `patients` sequentially, return (results, pid, seconds, store hits/misses)"""
+    from .patient_panel import PatientPanel
+
+    start = time.perf_counter()
+    if kind == "kmr":
+        from .kmr_model import KMRPredictor
+        predictor = KMRPredictor(config, model_store)
+        panel = PatientPanel(kmr_long=shard_long)
+    else:
+        from .lab_model import LABPredictor
+        predictor = LABPredictor(config, model_store)
+        panel = PatientPanel(lab_long=shard_long)
+
+    results = predictor.train_patients(panel, patients, report_every=0, budget=budget)
+    store_counts = (model_store.hits, model_store.misses) if model_store is not None else (0, 0)
+    return results, os.getpid(), time.perf_counter() - start, store_counts
+
+
+def train_patients_parallel(kind: str, config: dict, panel, patients: List[str],
+                            workers: int, model_store=None, budget=None,
+                            costs: Dict[str, float] = None) -> Dict[str, dict]:
+    """
+    Train per-patient models for `patients` on `workers` processes.
+
+    Patients are handed out in small chunks so slow (complex) patients do not
+    leave other workers idle. Prints per-worker throughput at the end.
+    With a TrainingBudget, each chunk gets the share of the workers' combined
+    time matching its share of the training cost `costs`.
+    """
+    workers = max(1, min(int(workers), len(patients)))
+    tf_threads = max(1, (os.cpu_count() or 1) // workers)
+    chunk_size = max(1, len(patients) // (workers * 4))
+    chunks = [patients[i:i + chunk_size] for i in range(0, len(patients), chunk_size)]
+
+    print(f"   Parallel training: {len(patients)} patients, {workers} workers "
+          f"x {tf_threads} TF threads, {len(chunks)} chunks")
+
+    results: Dict[str, dict] = {}
+    per_worker = defaultdict(lambda: [0, 0.0])
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers, mp_context=get_context("spawn"),
+                             initializer=_init_worker, initargs=(tf_threads,)) as pool:
+        futures = []
+        total_cost = sum((costs or {}).get(p, 0.0) for p in patients)
+        for chunk in chunks:
+            shard_long = pd.concat([panel.kmr(p) if kind == "kmr" else panel.lab(p) for p in chunk])
+            chunk_budget = None
+            if budget is not None:
+                chunk_cost = sum((costs or {}).get(p, 0.0) for p in chunk)
+                fraction = chunk_cost / total_cost if total_cost > 0 else len(chunk) / len(patients)
+                chunk_budget = budget.share(fraction, workers)
+            futures.append(pool.submit(_train_shard, kind, config, shard_long, chunk, model_store, chunk_budget))
+
+        for done, future in enumerate(as_completed(futures), start=1):
+            chunk_results, pid, seconds, (hits, misses) = future.result()
+            results.update(chunk_results)
+            if model_store is not None:
+                # Workers got a pickled copy of the store; fold their counters back in
+                model_store.hits += hits
+                model_store.misses += misses
+            per_worker[pid][0] += len(chunk_results)
+            per_worker[pid][1] += seconds
+            print(f"   Trained {len(results)}/{len(patients)} models ({done}/{len(chunks)} chunks)")
+
+    wall = time.perf_counter() - start
+    for i, (pid, (n, busy)) in enumerate(sorted(per_worker.items()), start=1):
+        rate = n / busy if busy > 0 else 0.0
+        print(f"   worker {i} (pid {pid}): {n} patients in {busy:.1f}s busy -> {rate:.2f} patients/s")
+    print(f"   Overall: {len(results)} patients in {wall:.1f}s wall -> "
+          f"{len(results) / wall if wall > 0 else 0.0:.2f} patients/s")
+
+    # Same order as the sequential path
+    return {p: results[p] for p in patients if p in results}
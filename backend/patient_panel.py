@@ -0,0 +1,245 @@
+"""
+Patient Panel - Patient-indexed access to long KMR/LAB frames
+
+Stages used to slice the long frames with `df[df["patient_code"] == p]`,
+which scans the whole frame for every patient. The panel groups row
+positions by patient once; each per-patient slice is then a positional
+take of only that patient's rows.
+
+PatientTensor is the dense companion: one (patients x unified time x metric)
+float32 array with NaN for missing values, so grid-shaped consumers can slice
+views instead of re-pivoting the long frames.
+"""
+import json
+import numpy as np
+import pandas as pd
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from .time_mapping import UNIFIED_LAB_KEYS, get_all_time_keys
+
+TENSOR_METRICS = ("kmr", "kre", "gfr")
+
+
+def _group_positions(df: Optional[pd.DataFrame]) -> Dict[str, np.ndarray]:
+    """Map patient_code -> row positions (original row order kept within each patient)"""
+    if df is None or len(df) == 0 or "patient_code" not in df.columns:
+        return {}
+
+    codes, uniques = pd.factorize(df["patient_code"], sort=False)
+    valid = np.flatnonzero(codes >= 0)
+    order = valid[np.argsort(codes[valid], kind="stable")]
+    counts = np.bincount(codes[valid], minlength=len(uniques))
+    groups = np.split(order, np.cumsum(counts)[:-1])
+    return {str(code): rows for code, rows in zip(uniques, groups)}
+
+
+_LAB_SLOTS = pd.Index(UNIFIED_LAB_KEYS)
+
+
+def align_lab_grid(lab_long: Optional[pd.DataFrame],
+                   patient_codes: Sequence[str] = None) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    KRE and GFR of many patients aligned on the unified LAB grid (UNIFIED_LAB_KEYS).
+
+    Returns two float64 (patients x LAB slots) arrays, NaN where missing; rows off
+    the grid are ignored and of duplicate (patient, time_key) rows the last one wins.
+    Without patient_codes, lab_long is taken as one patient's rows (1 x LAB slots).
+    """
+    n_patients = 1 if patient_codes is None else len(patient_codes)
+    kre = np.full((n_patients, len(_LAB_SLOTS)), np.nan)
+    gfr = np.full((n_patients, len(_LAB_SLOTS)), np.nan)
+    if lab_long is None or len(lab_long) == 0:
+        return kre, gfr
+
+    if patient_codes is None:
+        rows = np.zeros(len(lab_long), dtype=np.intp)
+    else:
+        rows = pd.Index([str(p) for p in patient_codes]).get_indexer(lab_long["patient_code"].astype(str))
+    cols = _LAB_SLOTS.get_indexer(lab_long["time_key"])
+    keep = (rows >= 0) & (cols >= 0)
+    rows, cols = rows[keep], cols[keep]
+    # Last row per (patient, slot) only, so the scatter does not depend on assignment order
+    last = ~pd.Series(rows * len(_LAB_SLOTS) + cols).duplicated(keep="last").to_numpy()
+    for out, metric in ((kre, "kre"), (gfr, "gfr")):
+        if metric in lab_long.columns:
+            vals = pd.to_numeric(lab_long[metric], errors="coerce").to_numpy(dtype=np.float64, na_value=np.nan)
+            out[rows[last], cols[last]] = vals[keep][last]
+    return kre, gfr
+
+
+class PatientTensor:
+    """
+    Dense patients x time x metric array on the UNIFIED_TIME_MAP grid.
+
+    values[i, t, m] holds metric TENSOR_METRICS[m] of patient_codes[i] at
+    time_keys[t]; NaN marks a missing measurement. All accessors return views.
+    """
+
+    def __init__(self, values: np.ndarray, patient_codes: Sequence[str],
+                 time_keys: Sequence[str] = None, metrics: Sequence[str] = TENSOR_METRICS):
+        self.values = values
+        self.patient_codes = [str(p) for p in patient_codes]
+        self.time_keys = list(time_keys) if time_keys is not None else get_all_time_keys()
+        self.metrics = tuple(metrics)
+        self.patient_index: Dict[str, int] = {p: i for i, p in enumerate(self.patient_codes)}
+        self.time_index: Dict[str, int] = {tk: t for t, tk in enumerate(self.time_keys)}
+        self.metric_index: Dict[str, int] = {m: j for j, m in enumerate(self.metrics)}
+        self._mask = None
+
+        expected = (len(self.patient_codes), len(self.time_keys), len(self.metrics))
+        if values.shape != expected:
+            raise ValueError(f"Tensor shape {values.shape} does not match index maps {expected}")
+
+    @property
+    def shape(self) -> tuple:
+        return self.values.shape
+
+    @property
+    def mask(self) -> np.ndarray:
+        """Boolean observed-mask (True where a value exists)"""
+        if self._mask is None:
+            self._mask = ~np.isnan(self.values)
+        return self._mask
+
+    def patient(self, patient_code: str) -> np.ndarray:
+        """(time, metric) view for one patient"""
+        return self.values[self.patient_index[str(patient_code)]]
+
+    def metric(self, metric: str) -> np.ndarray:
+        """(patients, time) view for one metric"""
+        return self.values[:, :, self.metric_index[metric]]
+
+    def series(self, patient_code: str, metric: str) -> np.ndarray:
+        """(time,) view for one patient and metric"""
+        return self.values[self.patient_index[str(patient_code)], :, self.metric_index[metric]]
+
+    def time_slice(self, time_keys: Sequence[str]) -> np.ndarray:
+        """Positions of the given time keys on the tensor's time axis"""
+        return np.array([self.time_index[tk] for tk in time_keys], dtype=np.intp)
+
+    @classmethod
+    def from_long(cls, kmr_long: Optional[pd.DataFrame], lab_long: Optional[pd.DataFrame],
+                  patient_codes: Sequence[str] = None, dtype=np.float32) -> "PatientTensor":
+        """Scatter long KMR/LAB rows onto the dense grid (rows off the grid are ignored)"""
+        time_keys = get_all_time_keys()
+        time_index = {tk: t for t, tk in enumerate(time_keys)}
+
+        if patient_codes is None:
+            seen: Dict[str, None] = {}
+            for df in (kmr_long, lab_long):
+                if df is not None and len(df) > 0:
+                    seen.update(dict.fromkeys(pd.unique(df["patient_code"].astype(str))))
+            patient_codes = list(seen.keys())
+        patient_codes = [str(p) for p in patient_codes]
+        patient_index = pd.Index(patient_codes)
+
+        values = np.full((len(patient_codes), len(time_keys), len(TENSOR_METRICS)), np.nan, dtype=dtype)
+
+        def scatter(df: Optional[pd.DataFrame], metric_cols: Sequence[str]) -> None:
+            if df is None or len(df) == 0:
+                return
+            rows = patient_index.get_indexer(df["patient_code"].astype(str))
+            cols = df["time_key"].map(time_index).to_numpy(dtype=np.float64, na_value=np.nan)
+            keep = (rows >= 0) & ~np.isnan(cols)
+            rows, cols = rows[keep], cols[keep].astype(np.intp)
+            for metric in metric_cols:
+                m = TENSOR_METRICS.index(metric)
+                vals = pd.to_numeric(df[metric], errors="coerce").to_numpy(dtype=np.float64, na_value=np.nan)[keep]
+                values[rows, cols, m] = vals
+
+        scatter(kmr_long, ["kmr"])
+        scatter(lab_long, ["kre", "gfr"])
+        return cls(values, patient_codes, time_keys)
+
+    def save(self, directory: Path) -> None:
+        """Write values.npy + index.json (loadable with memory mapping)"""
+        directory = Path(directory)
+        directory.mkdir(parents=True, exist_ok=True)
+        np.save(directory / "values.npy", np.ascontiguousarray(self.values))
+        with open(directory / "index.json", "w", encoding="utf-8") as f:
+            json.dump({
+                "patient_codes": self.patient_codes,
+                "time_keys": self.time_keys,
+                "metrics": list(self.metrics),
+            }, f, ensure_ascii=False)
+
+    @classmethod
+    def load(cls, directory: Path, mmap: bool = True) -> "PatientTensor":
+        """Load a saved tensor; mmap=True maps values read-only instead of reading them"""
+        directory = Path(directory)
+        with open(directory / "index.json", "r", encoding="utf-8") as f:
+            index = json.load(f)
+        values = np.load(directory / "values.npy", mmap_mode="r" if mmap else None)
+        return cls(values, index["patient_codes"], index["time_keys"], index["metrics"])
+
+
+class PatientPanel:
+    """Long KMR/LAB frames plus a per-patient row index built once"""
+
+    def __init__(self, kmr_long: pd.DataFrame = None, lab_long: pd.DataFrame = None):
+        self.kmr_long = kmr_long if kmr_long is not None else pd.DataFrame(
+            columns=["patient_code", "time_key", "time_order", "pseudo_time_days", "kmr"]
+        )
+        self.lab_long = lab_long if lab_long is not None else pd.DataFrame(
+            columns=["patient_code", "time_key", "time_order", "pseudo_time_days", "kre", "gfr"]
+        )
+        self._kmr_rows = _group_positions(self.kmr_long)
+        self._lab_rows = _group_positions(self.lab_long)
+        self._tensor: Optional[PatientTensor] = None
+
+    @property
+    def tensor(self) -> PatientTensor:
+        """Dense KMR/KRE/GFR tensor over the panel's patients (built on first use)"""
+        if self._tensor is None:
+            self._tensor = PatientTensor.from_long(self.kmr_long, self.lab_long, self.patients)
+        return self._tensor
+
+    @tensor.setter
+    def tensor(self, tensor: PatientTensor) -> None:
+        self._tensor = tensor
+
+    @property
+    def kmr_patients(self) -> List[str]:
+        """Patients with KMR rows, in order of first appearance"""
+        return list(self._kmr_rows.keys())
+
+    @property
+    def lab_patients(self) -> List[str]:
+        """Patients with LAB rows, in order of first appearance"""
+        return list(self._lab_rows.keys())
+
+    @property
+    def patients(self) -> List[str]:
+        """All patients (KMR order first, then LAB-only patients)"""
+        seen = dict.fromkeys(self._kmr_rows)
+        seen.update(dict.fromkeys(self._lab_rows))
+        return list(seen.keys())
+
+    def __contains__(self, patient: str) -> bool:
+        return patient in self._kmr_rows or patient in self._lab_rows
+
+    def __len__(self) -> int:
+        return len(self.patients)
+
+    def kmr(self, patient: str) -> pd.DataFrame:
+        """KMR rows of one patient (same rows/order/index as a boolean-mask filter)"""
+        rows = self._kmr_rows.get(str(patient))
+        return self.kmr_long.iloc[rows] if rows is not None else self.kmr_long.iloc[:0]
+
+    def lab(self, patient: str) -> pd.DataFrame:
+        """LAB rows of one patient (same rows/order/index as a boolean-mask filter)"""
+        rows = self._lab_rows.get(str(patient))
+        return self.lab_long.iloc[rows] if rows is not None else self.lab_long.iloc[:0]
+
+    def lab_grid(self, patients: Sequence[str] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """(patients x unified LAB slots) KRE and GFR arrays, float64 (default: all LAB patients)"""
+        return align_lab_grid(self.lab_long, self.lab_patients if patients is None else patients)
+
+    def n_kmr(self, patient: str) -> int:
+        rows = self._kmr_rows.get(str(patient))
+        return len(rows) if rows is not None else 0
+
+    def n_lab(self, patient: str) -> int:
+        rows = self._lab_rows.get(str(patient))
+        return len(rows) if rows is not None else 0
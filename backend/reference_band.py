@@ -11,6 +11,7 @@ from scipy.stats import linregress
 
 from .config import CLINICAL_THRESHOLDS
 from .time_mapping import KMR_TIME_MAP, LAB_TIME_MAP, UNIFIED_TIME_MAP
+from .patient_panel import PatientPanel
 
 
 def exponential_decay(t, a, b, c):
@@ -26,8 +27,15 @@ def power_decay(t, a, b, c):
 class ReferenceBandCalculator:
     """Calculate reference bands from improved cohort patients"""
     
-    def __init__(self):
+    def __init__(self, panel: Optional[PatientPanel] = None):
         self.clinical = CLINICAL_THRESHOLDS
+        self.panel = panel
+    
+    def _lab_panel(self, lab_long: pd.DataFrame) -> PatientPanel:
+        """Panel over lab_long (rebuilt if a different frame is passed)"""
+        if self.panel is None or self.panel.lab_long is not lab_long:
+            self.panel = PatientPanel(lab_long=lab_long)
+        return self.panel
     
     def calculate_kmr_bands(self, kmr_long: pd.DataFrame, 
                             improved_patients: List[str]) -> List[dict]:
@@ -228,19 +236,19 @@ class ReferenceBandCalculator:
         # Check which improved patients have LAB data
         lab_improved = []
         for patient in improved_patients:
-            patient_lab = lab_long[lab_long["patient_code"] == patient]
+            patient_lab = self._lab_panel(lab_long).lab(patient)
             if len(patient_lab) > 0 and (patient_lab["kre"].notna().any() or patient_lab["gfr"].notna().any()):
                 lab_improved.append(patient)
         
         # If not enough, expand to all patients with LAB data and good outcomes
         if len(lab_improved) < 5:
             # Check all patients for LAB-based improvement
-            all_patients = lab_long["patient_code"].unique()
+            all_patients = self._lab_panel(lab_long).lab_patients
             for patient in all_patients:
                 if patient in lab_improved:
                     continue
                 
-                patient_lab = lab_long[lab_long["patient_code"] == patient]
+                patient_lab = self._lab_panel(lab_long).lab(patient)
                 # Check for good outcomes at later time points
                 later_data = patient_lab[patient_lab["time_key"].str.contains("Month_6|Month_12", na=False, regex=True)]
                 
@@ -327,9 +335,9 @@ class ReferenceBandCalculator:
 if __name__ == "__main__":
     from io_excel import load_all_data
     
-    meta, kmr_long, lab_long, improved, raw = load_all_data()
+    meta, kmr_long, lab_long, improved, raw, panel = load_all_data()
     
-    calculator = ReferenceBandCalculator()
+    calculator = ReferenceBandCalculator(panel=panel)
     bands = calculator.generate_reference_band_json(kmr_long, lab_long, improved)
     
     print("\nKMR Bands sample:")
@@ -11,6 +11,7 @@ import argparse
 import os
 import random
 from pathlib import Path
+from typing import Any, Callable, Dict, List
 
 # Deterministic runtime defaults (must be set before TensorFlow imports)
 os.environ.setdefault("PYTHONHASHSEED", "42")
@@ -34,6 +35,13 @@ from backend.cohort_trajectory import analyze_improved_cohort
 from backend.cohort_trajectory_lab import analyze_improved_lab_cohort
 from backend.export_json import JSONExporter, sanitize_for_json
 from backend.export_markdown import MarkdownReportExporter
+from backend.incremental import PipelineState, config_fingerprint, plan_run
+from backend.model_store import ModelStore
+from backend.detector_store import DetectorStore
+from backend.forecast_engine import ENGINES, resolve_engine
+from backend.joint_model import JointForecaster
+from backend.training_budget import TrainingBudget, parse_budget
+from backend import tf_backend
 
 
 GENERATED_FILES = [
@@ -53,16 +61,9 @@ def set_global_seed(seed: int) -> None:
     """Set random seeds for reproducible training and exports."""
     random.seed(seed)
     np.random.seed(seed)
-    try:
-        import tensorflow as tf  # noqa: WPS433
-        tf.keras.utils.set_random_seed(seed)
-        try:
-            tf.config.experimental.enable_op_determinism()
-        except Exception:
-            pass
-    except Exception:
-        # TensorFlow can be unavailable in some environments.
-        pass
+    # TF is seeded (with op determinism) when it is first loaded, not here
+    tf_backend.set_random_seed(seed)
+    tf_backend.enable_op_determinism()
 
 
 def clean_training_data():
@@ -176,58 +177,196 @@ def publish_staged_output(staging_output: Path) -> None:
         shutil.rmtree(patients_old, ignore_errors=True)
 
 
-def run_pipeline(clean_first: bool = True):
-    """Execute full data processing pipeline"""
+def _merge_patient_results(cached: Dict[str, Any], patients: List[str], todo: List[str],
+                           compute: Callable[[List[str]], Dict[str, Any]]) -> Dict[str, Any]:
+    """Recompute `todo` patients, reuse cached results for the rest (patient order kept)"""
+    fresh = compute(todo) if todo else {}
+    return {p: fresh[p] if p in fresh else cached[p] for p in patients if p in fresh or p in cached}
+
+
+def _score_anomalies(name: str, label: str, channel: str, detector: Any, long_df, panel,
+                     patients: List[str], plan, detector_store: DetectorStore = None,
+                     score_only: bool = False):
+    """
+    Anomaly scores of one detector stage + the input digest its detector was fitted on
+
+    Scores are reused when neither the inputs nor the detector changed. Else
+    the stored detector is loaded if it was fitted on exactly these inputs
+    (with score_only: on a cohort within the drift limit, and then only new
+    or changed patients are scored); otherwise it is refitted and saved.
+    """
+    fingerprint = plan.global_digests[name]
+    # States written before detectors were stored scored with a detector fitted on that run's inputs
+    previous_fit = plan.cached("anomaly_detectors").get(
+        name, plan.previous.global_digests.get(name) if plan.previous else None)
+    if plan.reuse_global(name) and (score_only or previous_fit == fingerprint):
+        print(f"   {label} anomaly detector inputs unchanged, reusing scores")
+        return plan.previous.results[name], previous_fit
+
+    patient_hashes = {p: h[channel] for p, h in plan.hashes.items()}
+    artifact = detector_store.restore(name, detector, fingerprint, patient_hashes,
+                                      allow_drift=score_only) if detector_store else None
+    if artifact is None:
+        detector.fit_global(long_df, panel)
+        if detector_store is not None:
+            detector_store.save(name, detector, fingerprint, patient_hashes)
+        return detector.bulk_score(long_df, panel), fingerprint
+
+    # Cached scores are only valid if the previous run scored with this same detector
+    cached = plan.cached(name) if previous_fit == artifact.fingerprint else {}
+    todo = [p for p in patients if plan.is_dirty(p, channel) or p not in cached]
+    print(f"   Loaded stored {label} anomaly detector, scoring {len(todo)} of {len(patients)} patients")
+    scores = _merge_patient_results(cached, patients, todo,
+                                    lambda todo: detector.bulk_score(long_df, panel, todo))
+    return scores, artifact.fingerprint
+
+
+def run_pipeline(clean_first: bool = True, incremental: bool = False, workers: int = 1,
+                 use_model_cache: bool = True, engine: str = None, train_budget: float = None,
+                 score_only: bool = False):
+    """
+    Execute full data processing pipeline
+
+    incremental=True reuses the previous run's results (.cache/pipeline) and only
+    retrains/rescores/re-exports patients whose Excel row changed, plus the global
+    stages (anomaly detectors, reference bands, cohort trajectories) whose inputs
+    changed. Without saved state, or after a config change, it runs in full.
+
+    workers > 1 trains per-patient KMR/LAB models on that many processes; every
+    patient uses its own derived seed, so results do not depend on the worker count.
+
+    use_model_cache=True reloads per-patient KMR/LAB weights from .cache/models for
+    patients whose training data, model variant and config are unchanged, and the
+    anomaly detectors from .cache/detectors when they were fitted on the same data.
+
+    score_only=True (implies incremental) scores new or changed patients with the
+    stored anomaly detectors instead of refitting them on the changed cohort; a
+    detector is still refitted when its artifact is missing, was written by another
+    version/anomaly config, or more than DETECTOR_STORE_CONFIG max_drift_fraction of
+    its training cohort changed.
+
+    engine ("keras" | "numpy" | "joint") overrides MODEL_CONFIG["forecast_engine"] for this run
+    (set before planning, so incremental runs see it as a config change).
+
+    train_budget (seconds) caps per-patient KMR/LAB training wall-clock time: slots
+    are shared by training cost, plateaued models stop early and patients that no
+    longer fit get the NumPy engine (see each result's "train_path"). It is also
+    written to MODEL_CONFIG before planning.
+    """
     print("=" * 60)
     print("Kimerizm Takip Sistemi - Data Pipeline v3.0")
     print("=" * 60)
 
     # Step 0: Always clean generated artifacts unless explicitly skipped
-    if clean_first:
+    # (incremental runs keep them: unchanged patients are reused from there)
+    incremental = incremental or score_only
+    if clean_first and not incremental:
         clean_training_data()
 
+    if engine is not None:
+        MODEL_CONFIG["forecast_engine"] = engine
+    print(f"Forecast engine: {MODEL_CONFIG.get('forecast_engine', 'keras')}")
+    if train_budget is not None:
+        if float(train_budget) <= 0:
+            raise ValueError(f"Invalid training budget {train_budget!r} (must be positive)")
+        MODEL_CONFIG["train_budget"]["seconds"] = float(train_budget)
+
     seed = int(MODEL_CONFIG.get("random_seed", 42))
     print(f"Using random seed: {seed}")
     set_global_seed(seed)
     
     # Step 1: Load data from Excel
     print("Step 1: Loading Excel data...")
-    meta_df, kmr_long, lab_long, improved_proxy, raw_df = load_all_data()
+    meta_df, kmr_long, lab_long, improved_proxy, raw_df, panel = load_all_data()
+
+    plan = plan_run(raw_df, improved_proxy, incremental)
+    print(f"Run plan: {plan.summary()}")
     
     # Step 2: Train prediction models
     print("\nStep 2: Training prediction models...")
-    kmr_predictor = KMRPredictor()
-    kmr_prediction_results = kmr_predictor.bulk_train(kmr_long)
+    model_store = ModelStore() if use_model_cache else None
+    # The joint engine trains one model for KMR and LAB: both predictors share it
+    joint = JointForecaster() if resolve_engine(MODEL_CONFIG, tf_backend.HAS_TF) == "joint" else None
+    kmr_predictor = KMRPredictor(model_store=model_store, joint=joint)
+    kmr_cached = plan.cached("kmr_predictions")
+    # A shared (global-mode or joint) forecaster sees every patient: any change refreshes all
+    joint_stale = joint is not None and "joint_forecaster" in plan.stale_globals
+    kmr_shared_stale = joint_stale or (MODEL_CONFIG.get("kmr_model_mode") == "global"
+                                       and "kmr_forecaster" in plan.stale_globals)
+    kmr_todo = [p for p in panel.kmr_patients if kmr_shared_stale or plan.is_dirty(p, "kmr") or p not in kmr_cached]
+    lab_cached = plan.cached("lab_predictions")
+    lab_todo = [p for p in panel.lab_patients if joint_stale or plan.is_dirty(p, "lab") or p not in lab_cached]
+    
+    budget_seconds = MODEL_CONFIG["train_budget"].get("seconds")
+    budget = TrainingBudget(budget_seconds).start() if budget_seconds is not None else None
+    if budget is not None:
+        print(f"Training budget: {budget_seconds:.0f}s for {len(kmr_todo)} KMR + {len(lab_todo)} LAB patients")
+    kmr_prediction_results = _merge_patient_results(
+        kmr_cached, panel.kmr_patients, kmr_todo,
+        lambda todo: kmr_predictor.bulk_train(
+            kmr_long, panel, todo, workers=workers,
+            # KMR gets its patients' share of the budget, LAB whatever is left
+            budget=budget.share(len(todo) / (len(todo) + len(lab_todo))) if budget else None),
+    )
     
     # Train LAB prediction models
     print("\nStep 2b: Training LAB prediction models...")
-    lab_predictor = LABPredictor()
-    lab_prediction_results = lab_predictor.bulk_train(lab_long)
+    lab_predictor = LABPredictor(model_store=model_store, joint=joint)
+    lab_prediction_results = _merge_patient_results(
+        lab_cached, panel.lab_patients, lab_todo,
+        lambda todo: lab_predictor.bulk_train(lab_long, panel, todo, workers=workers,
+                                              budget=budget.share(1.0) if budget else None),
+    )
+    if budget is not None:
+        print(f"Training budget: {budget.summary()}")
+    if model_store is not None:
+        evicted = model_store.evict()
+        print(f"Model store: {model_store.summary()}, {evicted} evicted")
     
     # Step 3: Train anomaly detector and score
+    # Detectors are fitted on the whole cohort: any KMR (LAB) change refits and rescores all,
+    # unless a stored detector fits the inputs (see _score_anomalies)
     print("\nStep 3: Training anomaly detectors...")
-    kmr_detector = KMRAnomalyDetector()
-    kmr_detector.fit_global(kmr_long)
-    kmr_anomaly_scores = kmr_detector.bulk_score(kmr_long)
-    
-    # Train LAB anomaly detector
-    lab_detector = LABAnomalyDetector()
-    lab_detector.fit_global(lab_long)
-    lab_anomaly_scores = lab_detector.bulk_score(lab_long)
+    detector_store = DetectorStore() if use_model_cache or score_only else None
+    kmr_anomaly_scores, kmr_detector_fit = _score_anomalies(
+        "kmr_anomaly", "KMR", "kmr", KMRAnomalyDetector(), kmr_long, panel, panel.kmr_patients,
+        plan, detector_store, score_only,
+    )
+    lab_anomaly_scores, lab_detector_fit = _score_anomalies(
+        "lab_anomaly", "LAB", "lab", LABAnomalyDetector(), lab_long, panel, panel.lab_patients,
+        plan, detector_store, score_only,
+    )
+
+    # Timelines depend on the patient's own rows, predictions and anomaly scores only
+    # (a stale shared forecaster re-predicts every patient, changed or not)
+    cached_kmr_anomaly = plan.cached("kmr_anomaly")
+    cached_lab_anomaly = plan.cached("lab_anomaly")
+    cached_timelines = plan.cached("timelines")
+    retrained = set(kmr_todo) | set(lab_todo)
+    rescore = {
+        p for p in panel.patients
+        if plan.is_dirty(p, "kmr", "lab") or p not in cached_timelines or p in retrained
+        or cached_kmr_anomaly.get(p) != kmr_anomaly_scores.get(p)
+        or cached_lab_anomaly.get(p) != lab_anomaly_scores.get(p)
+    }
     
     # Step 4: Calculate risk scores for all patients
-    print("\nStep 4: Calculating risk scores...")
+    print(f"\nStep 4: Calculating risk scores ({len(rescore)} to rescore)...")
     scorer = RiskScorer()
     timelines = {}
     
     patients = meta_df["patient_code"].unique()
     for i, patient in enumerate(patients):
         # Get patient data
-        p_kmr = kmr_long[kmr_long["patient_code"] == patient].copy()
-        p_lab = lab_long[lab_long["patient_code"] == patient].copy()
+        p_kmr = panel.kmr(patient).copy()
+        p_lab = panel.lab(patient).copy()
         
         if len(p_kmr) == 0 and len(p_lab) == 0:
             continue
+
+        if patient not in rescore:
+            timelines[patient] = cached_timelines[patient]
+            continue
         
         # Get KMR predictions and anomaly scores
         kmr_pred_result = kmr_prediction_results.get(patient, {})
@@ -266,19 +405,41 @@ def run_pipeline(clean_first: bool = True):
     
     # Step 5: Calculate reference bands
     print("\nStep 5: Calculating reference bands...")
-    band_calculator = ReferenceBandCalculator()
-    reference_bands = band_calculator.generate_reference_band_json(
-        kmr_long, lab_long, improved_proxy
-    )
+    if plan.reuse_global("reference_band"):
+        print("   Reference band inputs unchanged, reusing previous bands")
+        reference_bands = plan.previous.results["reference_band"]
+    else:
+        band_calculator = ReferenceBandCalculator(panel=panel)
+        reference_bands = band_calculator.generate_reference_band_json(
+            kmr_long, lab_long, improved_proxy
+        )
     
     # Step 5b: Analyze improved cohort trajectory (LSTM/VAE)
     print("\nStep 5b: Analyzing improved cohort trajectory...")
     improved_patients = [p for p, v in improved_proxy.items() if v]
-    cohort_trajectory = analyze_improved_cohort(kmr_long, improved_patients)
+    if plan.reuse_global("cohort_trajectory"):
+        print("   Improved cohort KMR unchanged, reusing previous trajectory")
+        cohort_trajectory = plan.previous.results["cohort_trajectory"]
+    else:
+        cohort_trajectory = analyze_improved_cohort(kmr_long, improved_patients, panel)
     
     # Analyze LAB cohort trajectory
     print("\nStep 5c: Analyzing improved LAB cohort trajectory...")
-    lab_cohort_trajectory = analyze_improved_lab_cohort(lab_long, improved_patients)
+    if plan.reuse_global("cohort_trajectory_lab"):
+        print("   Improved cohort LAB unchanged, reusing previous trajectory")
+        lab_cohort_trajectory = plan.previous.results["cohort_trajectory_lab"]
+    else:
+        lab_cohort_trajectory = analyze_improved_lab_cohort(lab_long, improved_patients, panel)
+
+    # Patient files/reports to rewrite; the rest are carried over from the last publish
+    export_patients = None
+    if not plan.full:
+        # Retrained patients are rescored, so their new training path is exported with the timeline
+        export_patients = {
+            str(p) for p in meta_df["patient_code"]
+            if p in rescore or plan.is_dirty(str(p), "meta") or p in plan.improved_changed
+            or not (PATIENTS_DIR / f"{p}.json").exists()
+        }
     
     # Step 6: Export JSON files (stage first, then publish atomically)
     print("\nStep 6: Exporting JSON files to staging area...")
@@ -290,8 +451,17 @@ def run_pipeline(clean_first: bool = True):
 
         # Export patient files and get last status
         patient_risks = exporter.bulk_export_patients(
-            meta_df, kmr_long, lab_long, timelines
+            meta_df, kmr_long, lab_long, timelines, panel, write_patients=export_patients,
+            train_paths={
+                p: {"kmr": kmr_prediction_results.get(p, {}).get("train_path"),
+                    "lab": lab_prediction_results.get(p, {}).get("train_path")}
+                for p in meta_df["patient_code"]
+            },
         )
+        if export_patients is not None:
+            for p in meta_df["patient_code"]:
+                if str(p) not in export_patients:
+                    shutil.copy2(PATIENTS_DIR / f"{p}.json", exporter.patients_dir / f"{p}.json")
 
         # Export reference band
         exporter.export_reference_band(reference_bands)
@@ -352,7 +522,7 @@ def run_pipeline(clean_first: bool = True):
         exporter.export_data_summary(meta_df, patient_risks, timelines)
 
         # Export patient features
-        exporter.export_patient_features(meta_df, patient_risks, kmr_long, lab_long, timelines)
+        exporter.export_patient_features(meta_df, patient_risks, kmr_long, lab_long, timelines, panel)
 
         # Export anomaly trajectory (KMR/KRE/GFR anomaly points + time summaries)
         exporter.export_anomaly_trajectory(timelines)
@@ -374,11 +544,33 @@ def run_pipeline(clean_first: bool = True):
     # Step 7: Export dynamic markdown reports and chart PNG assets
     print("\nStep 7: Exporting dynamic markdown reports...")
     report_exporter = MarkdownReportExporter(public_dir=FRONTEND_PUBLIC, doc_dir=PROJECT_ROOT / "Doc")
-    report_result = report_exporter.generate()
+    # Reference bands are drawn into every report, so a band change re-renders all
+    report_patients = None if plan.full or "reference_band" in plan.stale_globals else export_patients
+    report_result = report_exporter.generate(patients=report_patients)
     print(
-        f"[OK] Report export complete: {report_result.get('patient_reports', 0)} patient markdown files, "
+        f"[OK] Report export complete: {report_result.get('patient_reports', 0)} patient markdown files "
+        f"({report_result.get('rendered_reports', 0)} rendered), "
         f"{report_result.get('assets', 0)} PNG assets"
     )
+
+    # Save what this run consumed/produced so the next --incremental run can diff against it
+    PipelineState(
+        fingerprint=config_fingerprint(),
+        patient_hashes=plan.hashes,
+        improved_proxy={str(p): bool(v) for p, v in improved_proxy.items()},
+        global_digests=plan.global_digests,
+        results={
+            "kmr_predictions": kmr_prediction_results,
+            "lab_predictions": lab_prediction_results,
+            "kmr_anomaly": kmr_anomaly_scores,
+            "lab_anomaly": lab_anomaly_scores,
+            "anomaly_detectors": {"kmr_anomaly": kmr_detector_fit, "lab_anomaly": lab_detector_fit},
+            "timelines": timelines,
+            "reference_band": reference_bands,
+            "cohort_trajectory": cohort_trajectory,
+            "cohort_trajectory_lab": lab_cohort_trajectory,
+        },
+    ).save()
     
     # Done
     print("\n" + "=" * 60)
@@ -391,7 +583,8 @@ def run_pipeline(clean_first: bool = True):
     return {
         "n_patients": len(timelines),
         "n_improved": sum(improved_proxy.values()),
-        "output_dir": str(FRONTEND_PUBLIC)
+        "output_dir": str(FRONTEND_PUBLIC),
+        "run_plan": plan.summary()
     }
 
 
@@ -402,7 +595,50 @@ if __name__ == "__main__":
         action="store_true",
         help="Do not remove previous generated outputs before training.",
     )
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="Only recompute patients whose Excel rows changed since the last run (implies --skip-clean).",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Worker processes for per-patient KMR/LAB training (default: 1, sequential).",
+    )
+    parser.add_argument(
+        "--no-model-cache",
+        action="store_true",
+        help="Retrain every per-patient model instead of reloading unchanged ones from .cache/models.",
+    )
+    parser.add_argument(
+        "--score-only",
+        action="store_true",
+        help="Score new or changed patients with the stored anomaly detectors instead of refitting them "
+             "(implies --incremental).",
+    )
+    parser.add_argument(
+        "--engine",
+        choices=ENGINES,
+        default=None,
+        help="Per-patient KMR/LAB forecaster (default: MODEL_CONFIG forecast_engine).",
+    )
+    parser.add_argument(
+        "--train-budget",
+        type=parse_budget,
+        default=None,
+        metavar="DURATION",
+        help="Wall-clock budget for per-patient KMR/LAB training, e.g. 300s, 5m (default: no limit).",
+    )
     args = parser.parse_args()
 
-    result = run_pipeline(clean_first=not args.skip_clean)
+    result = run_pipeline(
+        clean_first=not args.skip_clean,
+        incremental=args.incremental,
+        workers=args.workers,
+        use_model_cache=not args.no_model_cache,
+        engine=args.engine,
+        train_budget=args.train_budget,
+        score_only=args.score_only,
+    )
     print(f"\nResult: {result}")
@@ -0,0 +1,143 @@
+"""
+TF Backend - Lazy TensorFlow/Keras access for the model modules
+
+Importing TensorFlow costs seconds and hundreds of MB, and most entry points
+(export, checks, the NumPy forecast engine) never build a Keras model.
+`tf`, `keras`, `layers`, `Model` and the callbacks below are proxies that
+import TensorFlow on first attribute access or call, i.e. when a model is
+actually built. HAS_TF is truthy iff TensorFlow imports: its first truth test
+(when a caller picks between a Keras path and its fallback) attempts the
+import, so an installed but broken TensorFlow selects the fallbacks as if it
+were missing.
+"""
+import importlib.util
+import random
+import sys
+from typing import Any, Optional
+
+import numpy as np
+
+_tf: Any = None
+_available: Optional[bool] = None
+_seed: Optional[int] = None
+_deterministic = False
+
+
+def tf_loaded() -> bool:
+    """True once TensorFlow has been imported (by this loader or anyone else)"""
+    return _tf is not None or "tensorflow" in sys.modules
+
+
+def load_tf() -> Any:
+    """Import TensorFlow (once) and apply any seed/determinism requested before the import"""
+    global _tf
+    if _tf is None:
+        # Snapshot before the import: importing TF/Keras itself draws from the Python RNG
+        py_state, np_state = random.getstate(), np.random.get_state()
+        try:
+            import tensorflow  # noqa: WPS433
+            _tf = tensorflow
+            if _seed is not None:
+                # Seed TF/Keras without disturbing the Python/NumPy RNGs already in use
+                _tf.keras.utils.set_random_seed(_seed)
+        finally:
+            random.setstate(py_state)
+            np.random.set_state(np_state)
+        if _deterministic:
+            _enable_op_determinism()
+    return _tf
+
+
+def tf_available() -> bool:
+    """True if TensorFlow imports (the import is attempted on the first call)"""
+    global _available
+    if _available is None:
+        _available = importlib.util.find_spec("tensorflow") is not None
+        if _available:
+            try:
+                load_tf()
+            except ImportError:
+                _available = False
+        if not _available:
+            print("⚠️ TensorFlow not available, using simple prediction fallback")
+    return _available
+
+
+class _TFAvailable:
+    """HAS_TF: truth-tests as tf_available()"""
+
+    def __bool__(self) -> bool:
+        return tf_available()
+
+    def __repr__(self) -> str:
+        return repr(tf_available())
+
+
+HAS_TF = _TFAvailable()
+
+
+def _enable_op_determinism() -> None:
+    try:
+        _tf.config.experimental.enable_op_determinism()
+    except Exception:
+        pass
+
+
+def set_random_seed(seed: int) -> None:
+    """
+    Seed TF/Keras now if TensorFlow is loaded, otherwise when it is first loaded.
+
+    Python/NumPy RNGs are the caller's job (they are seeded directly).
+    """
+    global _seed
+    _seed = int(seed)
+    if tf_loaded() and HAS_TF:
+        try:
+            load_tf().keras.utils.set_random_seed(_seed)
+        except Exception:
+            # TensorFlow can be installed but unusable in some environments.
+            pass
+
+
+def enable_op_determinism() -> None:
+    """Request deterministic TF ops (applied now if TensorFlow is loaded, else on load)"""
+    global _deterministic
+    _deterministic = True
+    if tf_loaded() and HAS_TF:
+        try:
+            load_tf()
+            _enable_op_determinism()
+        except Exception:
+            pass
+
+
+class _LazyTF:
+    """Stand-in for a TensorFlow object at `path` (e.g. "keras.layers"), resolved on first use"""
+
+    def __init__(self, path: str = ""):
+        self._path = path
+
+    def _resolve(self) -> Any:
+        obj = load_tf()
+        for part in filter(None, self._path.split(".")):
+            obj = getattr(obj, part)
+        return obj
+
+    def __getattr__(self, name: str) -> Any:
+        if name.startswith("__"):
+            raise AttributeError(name)
+        return getattr(self._resolve(), name)
+
+    def __call__(self, *args, **kwargs) -> Any:
+        return self._resolve()(*args, **kwargs)
+
+    def __repr__(self) -> str:
+        return f"<lazy tensorflow{'.' + self._path if self._path else ''}>"
+
+
+tf = _LazyTF()
+keras = _LazyTF("keras")
+layers = _LazyTF("keras.layers")
+Model = _LazyTF("keras.Model")
+EarlyStopping = _LazyTF("keras.callbacks.EarlyStopping")
+ReduceLROnPlateau = _LazyTF("keras.callbacks.ReduceLROnPlateau")
@@ -84,3 +84,12 @@ def get_unified_time_info(time_key: str) -> dict:
 def get_all_time_keys() -> list:
     """Get all time keys in order"""
     return sorted(UNIFIED_TIME_MAP.keys(), key=lambda k: UNIFIED_TIME_MAP[k]["order"])
+
+def get_unified_lab_keys() -> list:
+    """Get unified time keys with has_lab=True in order"""
+    return [tk for tk in get_all_time_keys() if UNIFIED_TIME_MAP[tk]["has_lab"]]
+
+# Precomputed unified LAB grid index (the slots LAB grids/arrays are aligned on)
+UNIFIED_LAB_KEYS = tuple(get_unified_lab_keys())
+UNIFIED_LAB_ORDERS = tuple(UNIFIED_TIME_MAP[tk]["order"] for tk in UNIFIED_LAB_KEYS)
+UNIFIED_LAB_DAYS = tuple(UNIFIED_TIME_MAP[tk]["pseudo_days"] for tk in UNIFIED_LAB_KEYS)
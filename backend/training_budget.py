@@ -0,0 +1,173 @@
+"""
+Training Budget - Wall-clock budget for per-patient Keras training
+
+Without a budget every model trains for up to 50 epochs with early stopping,
+so total time grows with the cohort. A TrainingBudget spreads a fixed number
+of seconds over the patients still to train: each patient gets a time slot
+proportional to its cost (training windows x complexity), training stops
+when the slot is used up or the loss plateaus, and patients whose minimum
+epochs no longer fit in the remaining time get the NumPy engine instead.
+
+Each per-patient result records the path taken in "train_path":
+keras, keras_plateau, keras_budget, model_store, simple, numpy, budget_fallback.
+"""
+import re
+import time
+from typing import Any, Dict, List, Optional
+
+from .config import MODEL_CONFIG
+from .tf_backend import EarlyStopping, ReduceLROnPlateau, keras
+
+# Relative cost of one training window per model variant (size of the recurrent stack)
+COMPLEXITY_COST = {"simple": 1.0, "medium": 2.5, "complex": 5.0, "multi_output": 3.0}
+
+_UNITS = {"": 1, "s": 1, "m": 60, "h": 3600}
+
+
+def parse_budget(text: str) -> float:
+    """"300", "300s", "5m" or "1.5h" -> seconds (must be positive)"""
+    match = re.fullmatch(r"\s*(\d+(?:\.\d+)?)\s*([smh]?)\s*", str(text).lower())
+    if match is None or float(match.group(1)) <= 0:
+        raise ValueError(f"Invalid training budget {text!r} (expected e.g. 300s, 5m, 1h)")
+    return float(match.group(1)) * _UNITS[match.group(2)]
+
+
+def combine_paths(paths: List[str], default: str = "simple") -> str:
+    """One train_path for a patient trained through several models (e.g. LAB KRE + GFR)"""
+    unique = list(dict.fromkeys(paths))
+    return "+".join(unique) if unique else default
+
+
+class TrainingBudget:
+    """
+    Wall-clock budget shared by the patients of one training run.
+
+    The clock starts on first use; `share` hands out part of the remaining time
+    (e.g. to KMR vs LAB, or to one worker chunk) under the same hard deadline.
+    Picklable, so worker processes can schedule their own chunks.
+    """
+
+    def __init__(self, seconds: float, config: dict = None, hard_deadline: Optional[float] = None):
+        params = (config or MODEL_CONFIG).get("train_budget", {})
+        self.params = dict(params)
+        self.seconds = float(seconds)
+        self.hard_deadline = hard_deadline
+        self.deadline: Optional[float] = None
+        self.max_epochs = int(params.get("max_epochs", 50))
+        self.min_epochs = int(params.get("min_epochs", 5))
+        self.plateau_patience = int(params.get("plateau_patience", 3))
+        self.plateau_min_delta = float(params.get("plateau_min_delta", 0.01))
+        self._remaining_cost = 0.0
+        self._spent_units = 0.0
+        self._spent_seconds = 0.0
+        self._slot_end = 0.0
+        self._slot_cost = 0.0
+        self._slot_start = 0.0
+        self._slot_epochs: List[int] = []
+
+    def start(self) -> "TrainingBudget":
+        if self.deadline is None:
+            self.deadline = time.time() + self.seconds
+            if self.hard_deadline is not None:
+                self.deadline = min(self.deadline, self.hard_deadline)
+        return self
+
+    def remaining(self) -> float:
+        return max(0.0, self.start().deadline - time.time())
+
+    def share(self, fraction: float, workers: int = 1) -> "TrainingBudget":
+        """Sub-budget of `fraction` of the remaining time (x workers running in parallel)"""
+        seconds = self.remaining() * max(1, workers) * min(max(fraction, 0.0), 1.0)
+        return TrainingBudget(seconds, {"train_budget": self.params}, hard_deadline=self.deadline)
+
+    def plan(self, costs: List[float]) -> None:
+        """Register the costs of all patients this budget will be asked for"""
+        self._remaining_cost = float(sum(costs))
+
+    def seconds_per_unit(self) -> Optional[float]:
+        """Measured seconds per (cost x epoch); None until a model has been trained"""
+        return self._spent_seconds / self._spent_units if self._spent_units > 0 else None
+
+    def begin(self, cost: float) -> bool:
+        """
+        Open the next patient's time slot (cost-proportional share of what is left).
+
+        False when its minimum epochs are not expected to fit in the remaining
+        time: the caller falls back to the cheap engine for this patient.
+        """
+        remaining = self.remaining()
+        pending = max(self._remaining_cost, cost)
+        self._remaining_cost = max(0.0, self._remaining_cost - cost)
+        if cost <= 0:
+            # Too little data for a model: the cheap fallback runs anyway
+            self._slot_cost = 0.0
+            return True
+
+        rate = self.seconds_per_unit()
+        if remaining <= 0 or (rate is not None and rate * cost * self.min_epochs > remaining):
+            return False
+
+        now = time.time()
+        self._slot_start, self._slot_cost, self._slot_epochs = now, cost, []
+        self._slot_end = now + remaining * cost / pending
+        return True
+
+    def record_epochs(self, epochs: int) -> None:
+        """Epochs one model of the current slot actually ran"""
+        self._slot_epochs.append(int(epochs))
+
+    def end(self) -> None:
+        """Close the slot opened by begin() and update the seconds-per-unit estimate"""
+        if self._slot_cost > 0 and self._slot_epochs:
+            mean_epochs = sum(self._slot_epochs) / len(self._slot_epochs)
+            self._spent_units += self._slot_cost * mean_epochs
+            self._spent_seconds += time.time() - self._slot_start
+        self._slot_cost = 0.0
+
+    def stop_callback(self, model: Any, outcome: Dict[str, str]) -> Any:
+        """Keras callback ending training at the slot end or on a loss plateau (after min_epochs)"""
+        history: List[float] = []
+
+        def on_epoch_end(epoch: int, logs: dict = None) -> None:
+            history.append(float((logs or {}).get("loss", float("nan"))))
+            if epoch + 1 < self.min_epochs:
+                return
+            patience = self.plateau_patience
+            if time.time() >= self._slot_end:
+                outcome["path"] = "keras_budget"
+            elif len(history) > patience and \
+                    min(history[-patience:]) > (1.0 - self.plateau_min_delta) * min(history[:-patience]):
+                outcome["path"] = "keras_plateau"
+            else:
+                return
+            model.stop_training = True
+
+        return keras.callbacks.LambdaCallback(on_epoch_end=on_epoch_end)
+
+    def summary(self) -> str:
+        used = self.seconds - self.remaining()
+        return f"{used:.0f}s of {self.seconds:.0f}s used"
+
+
+def fit_model(model: Any, X: Any, y: Any, budget: Optional[TrainingBudget] = None) -> str:
+    """
+    Fit a per-patient model (early stopping + LR schedule); returns its train_path.
+
+    With a budget, epochs are capped by it and the patient's slot / plateau
+    callback may stop training early.
+    """
+    callbacks = [
+        EarlyStopping(patience=5, restore_best_weights=True, verbose=0),
+        ReduceLROnPlateau(factor=0.7, patience=3, min_lr=0.0001, verbose=0)
+    ]
+    outcome = {"path": "keras"}
+    epochs = 50
+    if budget is not None:
+        callbacks.append(budget.stop_callback(model, outcome))
+        epochs = budget.max_epochs
+
+    history = model.fit(X, y, epochs=epochs, batch_size=min(8, len(X)),
+                        validation_split=0.2, callbacks=callbacks, verbose=0, shuffle=False)
+    if budget is not None:
+        budget.record_epochs(len(history.history.get("loss", [])))
+    return outcome["path"]
@@ -0,0 +1,205 @@
+"""
+Windowing - Strided sliding windows over ragged per-patient series
+
+Per-patient series are passed concatenated (`flat`) with their `lengths`
+(feature_kernel.stack_frames order). Statistics are computed per group of
+equal-length series, so per-series means/stds equal ndarray.mean()/std() of
+each series exactly; windows are sliding_window_view views of one padded
+(series x time) array, gathered once into a contiguous array.
+
+- segment_stats / zscore: per-series mean, population std and z-scores
+- training_windows: every full window of each series (short series are
+  left-padded with their mean to one window), NaN windows dropped
+- paired_training_windows: KRE+GFR windows side by side (shorter series
+  end-padded with its mean)
+- point_windows / trailing_windows: the window ending at every point
+  (first points left-filled with the mean of the available values)
+- sequence_windows: (seq_len x features) inputs of next-step forecasters
+- RunningSeries: streaming state of one series (running mean/std and the
+  last window_size values) for scoring newly arrived points in O(window)
+"""
+import math
+import warnings
+from collections import deque
+from typing import Optional, Tuple
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+from .feature_kernel import pad, trailing_window_view
+
+
+def _bounds(lengths: np.ndarray) -> np.ndarray:
+    return np.concatenate([[0], np.cumsum(lengths)]).astype(np.intp)
+
+
+def segment_stats(flat: np.ndarray, lengths: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Per-series mean and population std (NaN for empty series)"""
+    lengths = np.asarray(lengths, dtype=np.intp)
+    starts = _bounds(lengths)[:-1]
+    mean = np.full(len(lengths), np.nan)
+    std = np.full(len(lengths), np.nan)
+    for n in np.unique(lengths[lengths > 0]):
+        rows = np.flatnonzero(lengths == n)
+        block = flat[starts[rows, None] + np.arange(n)]
+        mean[rows] = block.mean(axis=1)
+        std[rows] = block.std(axis=1)
+    return mean, std
+
+
+def zscore(flat: np.ndarray, lengths: np.ndarray, eps: float = 1e-6) -> np.ndarray:
+    """(x - mean) / (std + eps) per series, concatenated like `flat`"""
+    mean, std = segment_stats(flat, lengths)
+    return (flat - np.repeat(mean, lengths)) / (np.repeat(std, lengths) + eps)
+
+
+def _gather(windows: np.ndarray, valid: np.ndarray, dtype) -> np.ndarray:
+    """Contiguous (n_valid, ...) copy of the valid windows, NaN windows dropped"""
+    picked = windows[valid]
+    keep = ~np.isnan(picked).reshape(len(picked), -1).any(axis=1)
+    return np.ascontiguousarray(picked[keep], dtype=dtype)
+
+
+def training_windows(flat: np.ndarray, lengths: np.ndarray, window_size: int,
+                     dtype=np.float32) -> np.ndarray:
+    """
+    All window_size-long windows of every series; a series shorter than
+    window_size gives one window, left-padded with the series mean.
+    Windows containing NaN are dropped.
+    """
+    lengths = np.asarray(lengths, dtype=np.intp)
+    if lengths.sum() == 0:
+        return np.empty((0, window_size), dtype=dtype)
+    lead = np.maximum(window_size - lengths, 0)
+    width = int((lengths + lead).max())
+    # Left padding cells hold the series mean, the series follows, NaN after its end
+    mean = segment_stats(flat, lengths)[0]
+    values = np.where(np.arange(width)[None, :] < lead[:, None], mean[:, None], np.nan)
+    rows = np.repeat(np.arange(len(lengths)), lengths)
+    cols = np.repeat(lead - _bounds(lengths)[:-1], lengths) + np.arange(lengths.sum())
+    values[rows, cols] = flat
+
+    windows = sliding_window_view(values, window_size, axis=1)
+    valid = np.arange(windows.shape[1])[None, :] <= (lengths + lead - window_size)[:, None]
+    valid &= (lengths > 0)[:, None]
+    return _gather(windows, valid, dtype)
+
+
+def paired_training_windows(flat_a: np.ndarray, lengths_a: np.ndarray, flat_b: np.ndarray,
+                            lengths_b: np.ndarray, window_size: int, dtype=np.float32) -> np.ndarray:
+    """
+    (n, 2 * window_size) windows [a window | b window] over the same
+    positions of two series per patient; the shorter series is end-padded
+    with its mean to the longer one's length. Series shorter than
+    window_size give no windows; windows containing NaN are dropped.
+    """
+    lengths_a = np.asarray(lengths_a, dtype=np.intp)
+    lengths_b = np.asarray(lengths_b, dtype=np.intp)
+    longest = np.maximum(lengths_a, lengths_b)
+    width = max(int(longest.max()) if len(longest) else 0, window_size)
+
+    def end_padded(flat: np.ndarray, lengths: np.ndarray) -> np.ndarray:
+        values = np.full((len(lengths), width), np.nan)
+        if len(flat):
+            padded = pad(flat, lengths)
+            values[:, :padded.shape[1]] = padded
+        cols = np.arange(width)[None, :]
+        fill = (cols >= lengths[:, None]) & (cols < longest[:, None])
+        return np.where(fill, segment_stats(flat, lengths)[0][:, None], values)
+
+    windows = np.concatenate([
+        sliding_window_view(end_padded(flat_a, lengths_a), window_size, axis=1),
+        sliding_window_view(end_padded(flat_b, lengths_b), window_size, axis=1),
+    ], axis=-1)
+    valid = np.arange(windows.shape[1])[None, :] <= (longest - window_size)[:, None]
+    return _gather(windows, valid, dtype)
+
+
+def trailing_windows(values: np.ndarray, window_size: int) -> np.ndarray:
+    """
+    (n_series, T, window_size) window ending at each point of NaN-padded
+    (n_series, T) series; cells before a series' start are filled with the
+    mean of the window's available values (the per-point left-pad rule)
+    """
+    windows = trailing_window_view(values, window_size)
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)  # all-NaN windows of padding cells
+        fill = np.nanmean(windows, axis=-1, keepdims=True)
+    return np.where(np.isnan(windows), fill, windows)
+
+
+def point_windows(flat: np.ndarray, lengths: np.ndarray, window_size: int) -> np.ndarray:
+    """(sum(lengths), window_size) trailing window of every point, concatenated like `flat`"""
+    lengths = np.asarray(lengths, dtype=np.intp)
+    if lengths.sum() == 0:
+        return np.empty((0, window_size))
+    values = pad(flat, lengths)
+    real = np.arange(values.shape[1])[None, :] < lengths[:, None]
+    return trailing_windows(values, window_size)[real]
+
+
+def sequence_windows(features: np.ndarray, seq_len: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Next-step training pairs of one (time, n_features) series: X[i] is
+    features[i:i + seq_len] and the target row is features[i + seq_len].
+    Returns (X, target row indices).
+    """
+    n_windows = max(len(features) - seq_len, 0)
+    if n_windows == 0:
+        return np.empty((0, seq_len) + features.shape[1:], dtype=features.dtype), np.empty(0, dtype=np.intp)
+    # sliding_window_view puts the window axis last: (n, n_features, seq_len) -> (n, seq_len, n_features)
+    views = sliding_window_view(features[:-1], seq_len, axis=0)[:n_windows]
+    return np.ascontiguousarray(np.moveaxis(views, -1, 1)), np.arange(seq_len, seq_len + n_windows)
+
+
+class RunningSeries:
+    """
+    Streaming state of one series: Welford running count/mean/M2 over every
+    value pushed so far and the last window_size values. window() is the
+    trailing window of the newest point z-scored with the running stats,
+    i.e. what point_windows gives for the last point of the series so far.
+    """
+
+    def __init__(self, window_size: int):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.last_order: Optional[int] = None
+        self.values = deque(maxlen=window_size)
+
+    @classmethod
+    def from_history(cls, values: np.ndarray, last_order: int, window_size: int) -> "RunningSeries":
+        """State after pushing `values` (in time order) one by one, from whole-series stats"""
+        series = cls(window_size)
+        if len(values):
+            series.count = len(values)
+            series.mean = float(values.mean())
+            series.m2 = float(values.var()) * len(values)
+            series.values.extend(values[-window_size:].tolist())
+            series.last_order = last_order
+        return series
+
+    @property
+    def std(self) -> float:
+        """Population std of the values so far"""
+        return math.sqrt(self.m2 / self.count) if self.count else 0.0
+
+    def accepts(self, order: int) -> bool:
+        return self.last_order is None or order > self.last_order
+
+    def push(self, value: float, order: int) -> None:
+        if not self.accepts(order):
+            raise ValueError(f"Point at order {order} arrived after order {self.last_order}; "
+                             "out-of-order or corrected points need a batch rescore")
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+        self.values.append(value)
+        self.last_order = order
+
+    def window(self, eps: float = 1e-6) -> np.ndarray:
+        """(window_size,) z-scored trailing window; a shorter history is left-padded with its mean"""
+        z = (np.array(self.values) - self.mean) / (self.std + eps)
+        missing = self.values.maxlen - len(z)
+        return np.concatenate([np.full(missing, z.mean()), z]) if missing else z